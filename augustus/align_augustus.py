@@ -1,82 +1,86 @@
+"""
+Aligns Augustus transcripts to the reference transcript they were predicted from with blat to produce identity and
+coverage. Each job aligns a chunk of transcripts with a single blat call, and the results are cached by
+(Augustus sequence hash, reference ID) so that sequences seen in a previous run are not realigned. The parsing and
+cache logic is in lib/blat_lib.py.
+"""
 import os
+import glob
 import argparse
 import shutil
+import cPickle as pickle
 from jobTree.scriptTree.target import Target
 from jobTree.scriptTree.stack import Stack
-from lib.psl_lib import PslRow, remove_augustus_alignment_number, remove_alignment_number
 from sonLib.bioio import fastaRead, fastaWrite, popenCatch, system, getRandomAlphaNumericString
 from pyfaidx import Fasta
-from lib.general_lib import format_ratio, mkdir_p
-
-
-def coverage(p_list):
-    m = sum(x.matches for x in p_list)
-    mi = sum(x.misMatches for x in p_list)
-    rep = sum(x.repMatches for x in p_list)
-    return format_ratio(m + mi + rep, p_list[0].qSize)
-
-
-def identity(p_list):
-    m = sum(x.matches for x in p_list)
-    mi = sum(x.misMatches for x in p_list)
-    rep = sum(x.repMatches for x in p_list)
-    ins = sum(x.qNumInsert for x in p_list)
-    return format_ratio(m + rep, m + rep + mi + ins)
-
-
-def chunker(seq, size):
-    return (seq[pos:pos + size] for pos in xrange(0, len(seq), size))
+from lib.general_lib import mkdir_p
+from lib.blat_lib import cache_key, chunker, load_cache, pair_results, parse_blat, partition_cached, source_id
 
 
 def align(target, g, target_fasta, chunk, ref_fasta, out_path):
+    """
+    Aligns a chunk of Augustus transcripts to their reference transcripts in one blat call. Hits between an Augustus
+    transcript and any other reference transcript in the chunk are discarded.
+    """
     g_f = Fasta(target_fasta)
     r_f = Fasta(ref_fasta)
-    results = []
-    for aug_aId in chunk:
-        aId = remove_augustus_alignment_number(aug_aId)
-        gencode_id = remove_alignment_number(aId)
-        gencode_seq = str(r_f[gencode_id])
-        aug_seq = str(g_f[aug_aId])
-        tmp_aug = os.path.join(target.getLocalTempDir(), "tmp_aug")
-        tmp_gencode = os.path.join(target.getLocalTempDir(), "tmp_gencode")
-        fastaWrite(tmp_aug, aug_aId, aug_seq)
-        fastaWrite(tmp_gencode, gencode_id, gencode_seq)
-        r = popenCatch("blat {} {} -out=psl -noHead /dev/stdout".format(tmp_gencode, tmp_aug))
-        r = r.split("\n")[:-3]
-        if len(r) == 0:
-            results.append([aug_aId, "0", "0"])
-        else:
-            p_list = [PslRow(x) for x in r]
-            results.append(map(str, [aug_aId, identity(p_list), coverage(p_list)]))
-    with open(os.path.join(out_path, getRandomAlphaNumericString(10) + ".txt"), "w") as outf:
+    tmp_aug = os.path.join(target.getLocalTempDir(), "tmp_aug")
+    tmp_gencode = os.path.join(target.getLocalTempDir(), "tmp_gencode")
+    pairs = []
+    with open(tmp_aug, "w") as aug_fh, open(tmp_gencode, "w") as gencode_fh:
+        gencode_ids = set()
+        for aug_aId in chunk:
+            gencode_id = source_id(aug_aId)
+            aug_seq = str(g_f[aug_aId])
+            fastaWrite(aug_fh, aug_aId, aug_seq)
+            if gencode_id not in gencode_ids:
+                fastaWrite(gencode_fh, gencode_id, str(r_f[gencode_id]))
+                gencode_ids.add(gencode_id)
+            pairs.append([aug_aId, gencode_id, cache_key(aug_seq, gencode_id)])
+    p_lists = parse_blat(popenCatch("blat {} {} -out=psl -noHead /dev/stdout".format(tmp_gencode, tmp_aug)))
+    results, cache = pair_results(pairs, p_lists)
+    base_path = os.path.join(out_path, getRandomAlphaNumericString(10))
+    with open(base_path + ".txt", "w") as outf:
         for x in results:
             outf.write("\t".join(x) + "\n")
+    with open(base_path + ".cache", "w") as outf:
+        pickle.dump(cache, outf, pickle.HIGHEST_PROTOCOL)
 
 
 def cat(target, g, in_path, out_dir):
-    in_p = os.path.join(in_path, "*")
+    in_p = os.path.join(in_path, "*.txt")
     out_p = os.path.join(out_dir, g + ".stats")
     system("cat {} > {}".format(in_p, out_p))
 
 
 def wrapper(target, genomes, ref_fasta, out_dir, fa_dir):
+    cache = load_cache(os.path.join(out_dir, "align_cache.pickle"))
     for g in genomes:
         out_path = os.path.join(out_dir, "tmp", g)
         mkdir_p(out_path)
         for f in os.listdir(out_path):
             os.remove(os.path.join(out_path, f))
         target_fasta = os.path.join(fa_dir, g + ".fa")
-        faidx = os.path.join(fa_dir, g + ".fa.fai")
-        aug_aIds = [x.split()[0] for x in open(faidx)]
-        for chunk in chunker(aug_aIds, 200):
+        g_f = Fasta(target_fasta)
+        cached, to_align = partition_cached(((aug_aId, str(g_f[aug_aId])) for aug_aId in g_f.keys()), cache)
+        with open(os.path.join(out_path, "cached.txt"), "w") as outf:
+            for x in cached:
+                outf.write("\t".join(x) + "\n")
+        for chunk in chunker(to_align, 200):
             target.addChildTargetFn(align, args=(g, target_fasta, chunk, ref_fasta, out_path))
     target.setFollowOnTargetFn(wrapper2, args=(genomes, out_dir))
 
 
 def wrapper2(target, genomes, out_dir):
+    cache_path = os.path.join(out_dir, "align_cache.pickle")
+    cache = load_cache(cache_path)
     for g in genomes:
         out_path = os.path.join(out_dir, "tmp", g)
+        for f in glob.glob(os.path.join(out_path, "*.cache")):
+            cache.update(load_cache(f))
         target.addChildTargetFn(cat, args=(g, out_path, out_dir))
+    with open(cache_path, "w") as outf:
+        pickle.dump(cache, outf, pickle.HIGHEST_PROTOCOL)
 
 
 def main():
@@ -95,5 +99,5 @@ def main():
 
 
 if __name__ == '__main__':
-    from scripts.alignAugustus import *
+    from augustus.align_augustus import *
     main()
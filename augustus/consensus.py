@@ -1,5 +1,9 @@
 import argparse
+import multiprocessing
+import pandas as pd
 from scripts.plot_functions import *
+import lib.attribute_lib as attribute_lib
+from lib.consensus_lib import bin_transcripts, build_candidates, load_aug_stats, load_sorted_records
 
 
 def parse_args():
@@ -13,170 +17,86 @@ def parse_args():
     parser.add_argument("--tmGps", nargs="+", required=True)
     parser.add_argument("--compGp", required=True)
     parser.add_argument("--basicGp", required=True)
+    parser.add_argument("--numProcesses", type=int, default=multiprocessing.cpu_count(),
+                        help="Number of genomes to build consensus for (and figures to render) in parallel")
     return parser.parse_args()
 
 
-def get_aug_stats(stats_dir, genome):
-    """
-    Pulls the alignment metrics from the output of alignAugustus.py
-    """
-    aln_stats = {}
-    with open(os.path.join(stats_dir, genome + ".stats")) as f:
-        for l in f:
-            aug_aId, ident, cov = l.split()
-            aln_stats[aug_aId] = [aug_aId] + map(float, [ident, cov])
-    return aln_stats
-
-
-def merge_stats(cur, stats_dir, genome):
-    """
-    Adapter function to return the combination of the stats dicts produced for augustus and transMap
-    """
-    tm_stats = get_tm_stats(cur, genome)
-    aug_stats = get_aug_stats(stats_dir, genome)
-    r = tm_stats.copy()
-    r.update(aug_stats)
-    return r
+def none_if_nan(x):
+    return None if x is None or x != x else x
 
 
-def find_ok_not_ok_candidates(stats_dict, ids, ok_ids, discard_cov_cutoff, filter_cov_cutoff):
+def load_candidate_table(comp_ann_path, stats_dir, genome):
     """
-    Returns a list of candidate transcripts for OK and not OK. All transcripts must have discard_cov_cutoff
-    coverage or they are discarded. In order to be a OK candidate, a transcript must be classifier OK and have
-    coverage above filter_cov_cutoff.
+    Loads every Augustus and transMap alignment for genome into one DataFrame with its identity, coverage, source
+    transcript ID and OK flags. The Augustus identity and coverage come from the blat alignments made by
+    align_augustus.py, the transMap ones from the attributes database. Also returns the stats dict mapping each
+    alignment ID to [aln_id, identity, coverage].
     """
-    ok_candidates = []
-    not_ok_candidates = []
-    discarded = []
-    for aln_id in ids:
-        if stats_dict[aln_id][2] < discard_cov_cutoff:
-            discarded.append(stats_dict[aln_id][0])
-        elif aln_id in ok_ids and stats_dict[aln_id][2] >= filter_cov_cutoff:
-            ok_candidates.append(stats_dict[aln_id])
-        else:
-            not_ok_candidates.append(stats_dict[aln_id])
-    return ok_candidates, not_ok_candidates, discarded
+    con, cur = attach_databases(comp_ann_path, has_augustus=True)
+    coding_ok = get_all_ok(cur, genome, tm_coding_classifiers)
+    noncoding_ok = get_all_ok(cur, genome, tm_noncoding_classifiers)
+    cmd = "SELECT AlignmentId, AlignmentIdentity AS Identity, AlignmentCoverage AS Coverage FROM attributes.'{}'"
+    tm = pd.read_sql_query(cmd.format(genome), con)
+    con.close()
+    aug = load_aug_stats(os.path.join(stats_dir, genome + ".stats"))
+    candidates = build_candidates(aug, tm, coding_ok, noncoding_ok)
+    stats_dict = {aln_id: [aln_id, none_if_nan(ident), none_if_nan(cov)] for aln_id, ident, cov in
+                  itertools.izip(candidates.AlignmentId, candidates.Identity, candidates.Coverage)}
+    return candidates, stats_dict
 
 
 def find_best_aln(stats):
     """
-    Takes the list of OK/notOK candidates from find_ok_not_ok_candidates and returns the best alignment(s).
+    Takes a list of OK/notOK candidates and returns the best alignment(s).
     """
     s = sorted(stats, key=lambda x: -x[1])
     best_ident = round(s[0][1], 6)
     return [x[0] for x in s if round(x[1], 6) == best_ident]
 
 
-def split_alternatives(stats, best_id):
-    """
-    Takes the list of OK/notOK candidates and splits them up by augustus/transMap, filtering out the winner
-    """
-    tm = []
-    aug = []
-    for aln_id, ident, cov in stats:
-        if aln_id == best_id:
-            continue
-        if aln_id.startswith("aug"):
-            aug.append(aln_id)
-        else:
-            tm.append(aln_id)
-    return aug, tm
-
-
-def analyze_candidates(candidates, aug_re=re.compile("I[1-2]-")):
-    """
-    Analyzes candidate transcripts, finding the winner and splitting the alternatives based on coming from augustus
-    or transMap. If there are multiple equal winners from both transMap and Augustus, reports so.
-    aug_re is used if Augustus was ran in two modes (I1 and I2) to prevent counting that as a tie with transMap.
+def write_gene_sets(gp_paths, gene_map, binned, consensus_ids, out_dir, genome):
     """
-    winner_ids = find_best_aln(candidates)
-    winner_id = winner_ids[0]
-    if len({"-".join(aug_re.split(x[0])) for x in winner_ids}) > 1:
-        is_tie = True
-    else:
-        is_tie = False
-    aug_alts, tm_alts = split_alternatives(candidates, winner_id)
-    return winner_id, aug_alts, tm_alts, is_tie
-
-
-def bin_candidates(winner_id, aug_alts, tm_alts, bins, binned_transcripts):
+    Writes the genePred of every bin of every biotype and the consensus gene set in a single pass over the records
+    sorted by load_sorted_records, so no output file needs to be sorted itself. Also writes the fail and discarded
+    ID lists.
     """
-    bins analyzed candidates based on tier
-    """
-    for b, vals in itertools.izip(bins, [[winner_id], aug_alts, tm_alts]):
-        for v in vals:
-            binned_transcripts[b].append(v)
-
-
-def bin_transcripts(reverse_name_map, stats_dict, ok_ids, ens_ids):
-    binned_transcripts = {"bestOk": [], "augAltOk": [], "tmAltOk": [], "bestNotOk": [], "augAltNotOk": [], 
-                          "tmAltNotOk": [], "fail": [], "discarded": [], "tieIds": set()}
-    for ens_id in ens_ids:
-        aln_ids = reverse_name_map[ens_id]
-        ok_candidates, not_ok_candidates, discarded = find_ok_not_ok_candidates(stats_dict, aln_ids, ok_ids,
-                                                                                discard_cov_cutoff=0.50,
-                                                                                filter_cov_cutoff=0.80)
-        binned_transcripts["discarded"].extend(discarded)
-        if len(ok_candidates) == len(not_ok_candidates) == 0:
-            binned_transcripts["fail"].append(ens_id)
-        elif len(ok_candidates) > 0:
-            ok_id, aug_alt, tm_alt, is_tie = analyze_candidates(ok_candidates)
-            bin_candidates(ok_id, aug_alt, tm_alt, ["bestOk", "augAltOk", "tmAltOk"], binned_transcripts)
-            if is_tie:
-                binned_transcripts["tieIds"].add(strip_alignment_numbers(ok_id))
-        else:
-            not_ok_id, aug_alt, tm_alt, is_tie = analyze_candidates(not_ok_candidates)
-            bin_candidates(not_ok_id, aug_alt, tm_alt, ["bestNotOk", "augAltNotOk", "tmAltNotOk"], binned_transcripts)
-            if is_tie:
-                binned_transcripts["tieIds"].add(strip_alignment_numbers(not_ok_id))
-    return binned_transcripts
-
-
-def fix_gene_pred(gp, gene_map):
-    """
-    These genePreds have a few problems. First, the alignment numbers must be removed. Second, we want to fix
-    the name2 field to be the gene name. Third, we want to set the unique ID field. Finally, we want to sort the whole 
-    thing by genomic coordinates.
-    """
-    gp = sorted([x.split("\t") for x in gp], key=lambda x: [x[1], x[3]])
-    fixed = []
-    for x in gp:
-        x[10] = x[0]  # use unique Aug/TM ID as unique identifier
-        tx_id = strip_alignment_numbers(x[0])
-        x[0] = tx_id
-        gene_id = gene_map[tx_id]
-        x[11] = gene_id
-        fixed.append(x)
-    return ["\t".join(x) for x in fixed]
-
-
-def write_gps(binned_transcripts, gps, out_dir, genome, biotype, gene_map):
-    p = os.path.join(out_dir, genome, biotype)
-    mkdir_p(p)
-    for b in ["bestOk", "augAltOk", "tmAltOk", "bestNotOk", "augAltNotOk", "tmAltNotOk"]:
-        gp = [gps[aln_id] for aln_id in binned_transcripts[b]]
-        fixed_gp = fix_gene_pred(gp, gene_map)
-        with open(os.path.join(p, genome + "_" + b + ".gp"), "w") as outf:
-            for x in fixed_gp:
-                outf.write(x)
-    for b in ["fail", "discarded"]:
-        with open(os.path.join(p, genome + "_" + b + ".txt"), "w") as outf:
+    handles = []
+    outputs = defaultdict(list)  # maps each alignment ID to the handles it is written to
+    for biotype, binned_transcripts in binned.iteritems():
+        p = os.path.join(out_dir, "binnedTranscripts", genome, biotype)
+        mkdir_p(p)
+        for b in ["bestOk", "augAltOk", "tmAltOk", "bestNotOk", "augAltNotOk", "tmAltNotOk"]:
+            outf = open(os.path.join(p, genome + "_" + b + ".gp"), "w")
+            handles.append(outf)
             for aln_id in binned_transcripts[b]:
-                outf.write(aln_id + "\n")
-
-
-def consensus_gene_set(binned_transcripts, stats_dict, gps, gene_map, gene_biotype_map, gene_cov_cutoff=0.20):
+                outputs[aln_id].append(outf)
+        for b in ["fail", "discarded"]:
+            with open(os.path.join(p, genome + "_" + b + ".txt"), "w") as outf:
+                for aln_id in binned_transcripts[b]:
+                    outf.write(aln_id + "\n")
+    outf = open(os.path.join(out_dir, "geneSets", genome + "consensusGeneSet.gp"), "w")
+    handles.append(outf)
+    for aln_id in consensus_ids:
+        outputs[aln_id].append(outf)
+    for r in load_sorted_records(gp_paths, gene_map, outputs):
+        for outf in outputs[r.aln_id]:
+            outf.write(r.line)
+    for outf in handles:
+        outf.close()
+
+
+def consensus_gene_set(binned_transcripts, stats_dict, gene_map, gene_cov_cutoff=0.20):
     """
     Builds the consensus gene set. For each transcript that has a best OK/not OK (passes coverage filter),
     report it. For the remaining transcripts, determine the set of genes they come from. Find anything above
-    gene_cov_cutoff to be the one transcript to best represent this gene.
+    gene_cov_cutoff to be the one transcript to best represent this gene. Returns the alignment IDs.
     """
     consensus = []
     best_ids = set()
     for b in ["bestOk", "bestNotOk"]:
         best_ids |= set(binned_transcripts[b])
-        for aln_id in binned_transcripts[b]:
-            consensus.append(gps[aln_id])
+        consensus.extend(binned_transcripts[b])
     discarded_genes = defaultdict(list)
     genes_we_have = {gene_map[strip_alignment_numbers(x)] for x in best_ids}
     for x in binned_transcripts["discarded"]:
@@ -187,17 +107,10 @@ def consensus_gene_set(binned_transcripts, stats_dict, gps, gene_map, gene_bioty
         stats = [stats_dict[x] for x in transcripts if stats_dict[x][1] != None and stats_dict[x][2] > gene_cov_cutoff]
         if len(stats) > 0:
             best = find_best_aln(stats)[0]
-            consensus.append(gps[best])
+            consensus.append(best)
     return consensus
 
 
-def write_consensus(consensus, gene_map, consensus_path):
-    consensus = fix_gene_pred(consensus, gene_map)
-    with open(consensus_path, "w") as outf:
-        for x in consensus:
-            outf.write(x)
-
-
 def make_tx_counts_dict(binned_transcripts, filter_set=set()):
     """
     Makes a counts dictionary from binned_transcripts.
@@ -243,14 +156,15 @@ def find_genome_order(binned_transcript_holder, ens_ids):
     return zip(*genome_order)[0]
 
 
-def make_coding_transcript_plot(binned_transcript_holder, out_path, out_name, genome_order, ens_ids, title_string):
+def make_coding_transcript_plot(figures, binned_transcript_holder, out_path, out_name, genome_order, ens_ids,
+                                title_string):
     coding_metrics = OrderedDict()
     for g in genome_order:
         bins = binned_transcript_holder[g]['protein_coding']
         coding_metrics[g] = make_counts_frequency(make_tx_counts_dict(bins, filter_set=ens_ids))
     categories = zip(*coding_metrics[g])[0]
     results = [[g, zip(*coding_metrics[g])[1]] for g in coding_metrics]
-    stacked_barplot(results, categories, out_path, out_name, title_string, color_palette=paired_palette)
+    figures.add(stacked_barplot, results, categories, out_path, out_name, title_string, color_palette=paired_palette)
 
 
 base_title_string = "Proportion of {:,} {}\nOK / not OK In Target Genomes"
@@ -261,7 +175,7 @@ file_name_dict = {"Comp": "protein_coding_comprehensive", "Basic": "protein_codi
                   "Complement": "protein_coding_complement"}
 
 
-def make_coding_transcript_plots(binned_transcript_holder, out_path, comp_gp, basic_gp, attr_path):
+def make_coding_transcript_plots(figures, binned_transcript_holder, out_path, comp_gp, basic_gp, attr_path):
     comp_ids = get_gp_ids(comp_gp)
     basic_ids = get_gp_ids(basic_gp)
     coding_ids = get_all_ids(attr_path, biotype="protein_coding")
@@ -273,7 +187,8 @@ def make_coding_transcript_plots(binned_transcript_holder, out_path, comp_gp, ba
     for cat, ids in zip(*[["Comp", "Basic", "Complement"], [comp_coding, basic_coding, complement_coding]]):
         title_string = base_title_string.format(len(ids), title_string_dict[cat].format("Transcript"))
         out_name = file_name_dict[cat]
-        make_coding_transcript_plot(binned_transcript_holder, out_path, out_name, genome_order, ids, title_string)
+        make_coding_transcript_plot(figures, binned_transcript_holder, out_path, out_name, genome_order, ids,
+                                    title_string)
 
 
 def calculate_gene_ok_metrics(bins, gene_map, gene_ids):
@@ -285,7 +200,7 @@ def calculate_gene_ok_metrics(bins, gene_map, gene_ids):
     return make_counts_frequency(od)
 
 
-def ok_gene_by_biotype(binned_transcript_holder, out_path, attr_path, gene_map, genome_order, biotype):
+def ok_gene_by_biotype(figures, binned_transcript_holder, out_path, attr_path, gene_map, genome_order, biotype):
     biotype_ids = get_all_ids(attr_path, biotype=biotype, id_type="Gene")
     title_string = "Proportion of {:,} {} genes with at least one OK transcript".format(len(biotype_ids), biotype)
     file_name = "{}_gene".format(biotype)
@@ -295,51 +210,58 @@ def ok_gene_by_biotype(binned_transcript_holder, out_path, attr_path, gene_map,
         metrics[g] = calculate_gene_ok_metrics(bins, gene_map, biotype_ids)
     categories = zip(*metrics[g])[0]
     results = [[g, zip(*metrics[g])[1]] for g in metrics]
-    stacked_barplot(results, categories, out_path, file_name, title_string)
+    figures.add(stacked_barplot, results, categories, out_path, file_name, title_string)
+
+
+def consensus_genome(args):
+    """
+    Builds the binned transcripts and consensus gene set for one genome. Ran in a worker process.
+    Returns the binned transcripts for each biotype.
+    """
+    genome, tm_gp, aug_gp, comp_ann_path, stats_dir, out_dir, attribute_table, chr_y_ids = args
+    gene_map = attribute_table.GeneId.to_dict()
+    candidates, stats_dict = load_candidate_table(comp_ann_path, stats_dir, genome)
+    binned = bin_transcripts(candidates, attribute_table, chr_y_ids)  # filter out chrY
+    consensus = []
+    for binned_transcripts in binned.itervalues():
+        consensus.extend(consensus_gene_set(binned_transcripts, stats_dict, gene_map))
+    write_gene_sets([tm_gp, aug_gp], gene_map, binned, consensus, out_dir, genome)
+    return binned
 
 
 def main():
     args = parse_args()
-    con, cur = attach_databases(args.compAnnPath, has_augustus=True)
-    biotypes = get_all_biotypes(args.attributePath)
-    gene_map = get_gene_map(args.attributePath)
-    gene_biotype_map = get_gene_biotype_map(args.attributePath)
+    attribute_table = attribute_lib.load_attribute_table(args.attributePath).to_frame()
+    gene_map = attribute_table.GeneId.to_dict()
     chr_y_ids = gp_chrom_filter(args.compGp)
     sorted_genomes = sorted(args.genomes)
     sorted_tm_gps = sorted(args.tmGps)
     sorted_aug_gps = sorted(args.augGps)
-    consensus_base_path = os.path.join(args.outDir, "geneSets")
-    mkdir_p(consensus_base_path)
+    for d in ["geneSets", "binnedTranscripts"]:
+        mkdir_p(os.path.join(args.outDir, d))
     plots_path = os.path.join(args.outDir, "geneSetMetrics")
     mkdir_p(plots_path)
-    raw_bins_base_path = os.path.join(args.outDir, "binnedTranscripts")
-    mkdir_p(raw_bins_base_path)
-    binned_transcript_holder = defaultdict(dict)  # save all bins to make some plots at the end
+    tasks = []
     for genome, tm_gp, aug_gp in itertools.izip(sorted_genomes, sorted_tm_gps, sorted_aug_gps):
-        consensus = []
         assert genome in tm_gp and genome in aug_gp # sanity check that the right genePreds are being used
-        coding_ok = get_all_ok(cur, genome, tm_coding_classifiers)
-        noncoding_ok = get_all_ok(cur, genome, tm_noncoding_classifiers)
-        gps = load_gps([tm_gp, aug_gp])
-        for biotype in biotypes:
-            ens_ids = get_all_ids(args.attributePath, biotype=biotype) - chr_y_ids  # filter out chrY
-            reverse_name_map = get_reverse_name_map(cur, genome, whitelist=ens_ids, has_augustus=True)
-            stats_dict = merge_stats(cur, args.statsDir, genome)
-            if biotype == "protein_coding": 
-                binned_transcripts = bin_transcripts(reverse_name_map, stats_dict, coding_ok, ens_ids)
-            else:
-                binned_transcripts = bin_transcripts(reverse_name_map, stats_dict, noncoding_ok, ens_ids)
-            consensus.extend(consensus_gene_set(binned_transcripts, stats_dict, gps, gene_map, gene_biotype_map))
-            write_gps(binned_transcripts, gps, raw_bins_base_path, genome, biotype, gene_map)
-            binned_transcript_holder[genome][biotype] = binned_transcripts
-        consensus_path = os.path.join(consensus_base_path, genome + "consensusGeneSet.gp")
-        write_consensus(consensus, gene_map, consensus_path)
-    make_coding_transcript_plots(binned_transcript_holder, plots_path, args.compGp, args.basicGp, args.attributePath)
+        tasks.append([genome, tm_gp, aug_gp, args.compAnnPath, args.statsDir, args.outDir, attribute_table, chr_y_ids])
+    if len(tasks) == 0:
+        return
+    pool = multiprocessing.Pool(min(args.numProcesses, len(tasks)))
+    # save all bins to make some plots at the end
+    binned_transcript_holder = dict(itertools.izip(sorted_genomes, pool.map(consensus_genome, tasks)))
+    pool.close()
+    pool.join()
+    figures = FigureQueue(args.numProcesses)
+    make_coding_transcript_plots(figures, binned_transcript_holder, plots_path, args.compGp, args.basicGp,
+                                 args.attributePath)
     biotype = "protein_coding"
-    # ok_gene_by_biotype(binned_transcript_holder, plots_path, args.attributePath, gene_map, genome_order, biotype)
-    ok_gene_by_biotype(binned_transcript_holder, plots_path, args.attributePath, gene_map, hard_coded_genome_order,
-                       biotype)
+    # ok_gene_by_biotype(figures, binned_transcript_holder, plots_path, args.attributePath, gene_map, genome_order,
+    #                    biotype)
+    ok_gene_by_biotype(figures, binned_transcript_holder, plots_path, args.attributePath, gene_map,
+                       hard_coded_genome_order, biotype)
+    figures.run()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
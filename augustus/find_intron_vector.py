@@ -3,6 +3,7 @@ import os
 import argparse
 from scripts.plot_functions import attach_databases
 import lib.sequence_lib as seq_lib
+from lib.sql_lib import compile_query
 
 
 def parse_args():
@@ -21,8 +22,9 @@ def load_gp(path):
 
 
 def load_database_results(cur, genome):
-    cmd = "SELECT AlignmentId, HasOriginalIntrons from details.'{}'".format(genome)
-    results = {x: y for x, y in cur.execute(cmd).fetchall()}
+    q = compile_query([("details", "AlignmentId"), ("details", "HasOriginalIntrons")], ["details"],
+                      name="load_database_results")
+    results = {x: y for x, y in q.execute(cur, genome)}
     return results
 
 
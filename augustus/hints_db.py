@@ -0,0 +1,125 @@
+"""
+Access layer for the Augustus RNAseq hints database. Connections are pooled per process and the species/sequence IDs
+are resolved once per genome, so extracting the hints for a window is a single indexed range query. Many windows can
+be extracted in one statement with get_hints_batch.
+
+The covering index the window queries rely on is created once per hints database, as a setup step:
+    python augustus/hints_db.py --createIndex <hints db>
+"""
+import argparse
+import sqlite3 as sql
+
+__author__ = "Ian Fiddes"
+
+hints_index = "hints_speciesid_seqnr_start_end"
+
+batch_query = '''SELECT hint_windows.id,source,typename,hints.start,hints.end,score,strand,frame,priority,grp,mult,esource
+      FROM temp.hint_windows JOIN hints ON hints.speciesid=? AND hints.seqnr=hint_windows.seqnr
+             AND hints.start >= hint_windows.start AND hints.end <= hint_windows.stop
+             JOIN featuretypes ON typeid=type'''
+
+# per-process caches, keyed on database path
+_connections = {}
+_species_ids = {}
+_seqnrs = {}
+
+
+def get_connection(path):
+    """
+    Returns the connection to the hints database at path for this process, opening it if necessary.
+    """
+    if path not in _connections:
+        _connections[path] = sql.connect(path)
+    return _connections[path]
+
+
+def close_connections():
+    """
+    Closes all pooled connections and drops the cached IDs.
+    """
+    for con in _connections.itervalues():
+        con.close()
+    _connections.clear()
+    _species_ids.clear()
+    _seqnrs.clear()
+
+
+def create_hints_index(path):
+    """
+    Creates the covering index on (speciesid, seqnr, start, end) used by the window queries, if it does not exist.
+    Should be ran once on a new hints database before any extraction.
+    """
+    con = sql.connect(path)
+    with con:
+        con.execute("CREATE INDEX IF NOT EXISTS {} ON hints (speciesid, seqnr, start, end)".format(hints_index))
+    con.close()
+
+
+def has_hints_index(path):
+    """
+    Returns True if the covering index exists. Only reads the schema.
+    """
+    cmd = "SELECT 1 FROM sqlite_master WHERE type='index' AND name=?"
+    return get_connection(path).execute(cmd, (hints_index,)).fetchone() is not None
+
+
+def get_species_id(path, genome):
+    """
+    Returns the speciesid for genome, or None if this genome is not in the database.
+    """
+    if (path, genome) not in _species_ids:
+        r = get_connection(path).execute("SELECT speciesid FROM speciesnames WHERE speciesname=?", (genome,))
+        r = r.fetchone()
+        _species_ids[(path, genome)] = r[0] if r is not None else None
+    return _species_ids[(path, genome)]
+
+
+def get_seqnrs(path, genome):
+    """
+    Returns a dict mapping sequence names to seqnr for genome.
+    """
+    if (path, genome) not in _seqnrs:
+        species_id = get_species_id(path, genome)
+        r = get_connection(path).execute("SELECT seqname, seqnr FROM seqnames WHERE speciesid=?", (species_id,))
+        _seqnrs[(path, genome)] = dict(r)
+    return _seqnrs[(path, genome)]
+
+
+def get_hints_batch(path, genome, windows):
+    """
+    Extracts the hints for a list of (chrom, start, stop) windows in one query. Returns a list with one list of
+    (source, typename, start, end, score, strand, frame, priority, grp, mult, esource) rows per window.
+    """
+    results = [[] for _ in windows]
+    species_id = get_species_id(path, genome)
+    seqnrs = get_seqnrs(path, genome)
+    rows = [(i, seqnrs[chrom], start, stop) for i, (chrom, start, stop) in enumerate(windows) if chrom in seqnrs]
+    if species_id is None or len(rows) == 0:
+        return results
+    con = get_connection(path)
+    con.execute("CREATE TEMP TABLE IF NOT EXISTS hint_windows (id INTEGER, seqnr INTEGER, start INTEGER, "
+                "stop INTEGER)")
+    con.execute("DELETE FROM temp.hint_windows")
+    con.executemany("INSERT INTO temp.hint_windows VALUES (?, ?, ?, ?)", rows)
+    for r in con.execute(batch_query, (species_id,)):
+        results[r[0]].append(r[1:])
+    con.commit()
+    return results
+
+
+def get_hints(path, genome, chrom, start, stop):
+    """
+    Extracts the hints for a single window.
+    """
+    return get_hints_batch(path, genome, [(chrom, start, stop)])[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--createIndex", required=True, help="hints database to create the covering index in")
+    args = parser.parse_args()
+    create_hints_index(args.createIndex)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,13 +6,15 @@ import os
 import argparse
 import shutil
 import itertools
-import sqlite3 as sql
 from pyfaidx import Fasta
 from jobTree.scriptTree.target import Target
 from jobTree.scriptTree.stack import Stack
-from sonLib.bioio import system, popenCatch, getRandomAlphaNumericString, catFiles, TempFileTree
-from lib.sequence_lib import genePredTranscript
+from sonLib.bioio import popenCatch, getRandomAlphaNumericString, TempFileTree
+import lib.seq_lib as seq_lib
+import augustus.hints_db as hints_db
+from augustus.transmap_2_hints import transmap_2_hints, pipeline_params
 from lib.general_lib import mkdir_p
+from lib.gtf_lib import gtf_sort_key, merge_many_sorted_gtfs
 
 
 #####
@@ -20,17 +22,18 @@ from lib.general_lib import mkdir_p
 #####
 padding = 20000
 max_gene_size = 2000000
-tm_2_hints_params = ("--ep_cutoff=0 --ep_margin=12 --min_intron_len=40 --start_stop_radius=5 --tss_tts_radius=5 "
-                    "--utrend_cutoff=6 --in=/dev/stdin --out=/dev/stdout")
-tm_2_hints_script = "augustus/transMap2hints.pl"
-tm_2_hints_cmd = " ".join([tm_2_hints_script, tm_2_hints_params])
-
-hints_db = "/hive/groups/recon/projs/mus_strain_cactus/pipeline_data/comparative/1509/augustus/hints/1509.aug.hints.db"
-hints_db_query = '''select source,typename,start,end,score,strand,frame,priority,grp,mult,esource
-      FROM hints,featuretypes
-      WHERE hints.speciesid IN (SELECT speciesid FROM speciesnames WHERE speciesname="{genome}")
-             AND seqnr IN (SELECT seqnr FROM seqnames WHERE speciesid IN (SELECT speciesid FROM speciesnames WHERE speciesname="{genome}") AND seqname="{chrom}")
-             AND start >= {start} AND end <= {stop} AND typeid=type'''
+# overlapping or nearby alignments are run together in one padded window. Windows are not grown past the largest
+# window a single alignment can produce.
+max_window_size = max_gene_size + 2 * padding
+# from initial testing, ~15 seconds to extract the RNAseq hints and ~1 minute per Augustus instance on a typical
+# padded window. Used to estimate how many windows to run per job.
+hints_seconds = 15
+augustus_seconds = 60
+typical_window_size = 2 * padding + 50000
+# parameters for transmap_2_hints, the port of transMap2hints.pl
+tm_2_hints_params = pipeline_params
+
+hints_db_path = "/hive/groups/recon/projs/mus_strain_cactus/pipeline_data/comparative/1509/augustus/hints/1509.aug.hints.db"
 
 augustus_bin = "/cluster/home/mario/augustus/trunks/bin/augustus"
 augustus_base_cmd = ("{fasta} --predictionStart=-{start} --predictionEnd=-{start} --extrinsicCfgFile={cfg} "
@@ -42,17 +45,11 @@ augustus_cmd = " ".join([augustus_bin, augustus_base_cmd])
 cfgs = {1: "etc/extrinsic.ETM1.cfg", 2: "etc/extrinsic.ETM2.cfg"}
 
 
-def attach_database(path):
-    con = sql.connect(path)
-    cur = con.cursor()
-    return con, cur
-
-
-def get_transmap_hints(gp_string):
+def get_transmap_hints(gps):
     """
-    Uses transMap2hints.pl to create a hints file from a genePred
+    Creates hints from a list of GenePredTranscript objects
     """
-    return popenCatch(tm_2_hints_cmd, stdinString=gp_string)
+    return "".join(transmap_2_hints(gps, **tm_2_hints_params))
 
 
 def parse_rnaseq_query(query, chromosome, priority=3):
@@ -64,15 +61,12 @@ def parse_rnaseq_query(query, chromosome, priority=3):
         yield "\t".join(map(str, [chromosome, source, typename, start, end, score, ".", ".", tags])) + "\n"
 
 
-def get_rnaseq_hints(genome, chrom, start, stop):
+def get_rnaseq_hints(genome, windows):
     """
-    Extracts the RNAseq hints from the database
+    Extracts the RNAseq hints for a list of (chrom, start, stop) windows from the database in one query
     """
-    this_db_query = hints_db_query.format(genome=genome, chrom=chrom, start=start, stop=stop)
-    con, cur = attach_database(hints_db)
-    query = cur.execute(this_db_query)
-    rnaseq_hint = "".join(list(parse_rnaseq_query(query, chrom)))
-    return rnaseq_hint
+    return ["".join(parse_rnaseq_query(rows, chrom)) for (chrom, start, stop), rows in
+            itertools.izip(windows, hints_db.get_hints_batch(hints_db_path, genome, windows))]
 
 
 def write_hint_fasta(hint, seq, chrom, tmp_dir):
@@ -101,90 +95,145 @@ def rename_transcripts(transcripts, cfg_version, name):
     return name_map
 
 
-def write_augustus(r, name_map, out_path, start_offset):
+def parse_augustus(r, name_map, start_offset):
     """
-    Writes the results of AugustusTMR to a file.
+    Parses the results of AugustusTMR into GTF lines in genome coordinates. Only transcripts in name_map are kept.
     """
-    with open(out_path, "w") as outf:
-        for x in r:
-            if x.startswith("#"):
-                continue
-            if "AUGUSTUS" in x:
-                x = x.split("\t")
-                if x[2] in ["exon", "CDS", "start_codon", "stop_codon"]:
-                    t = x[-1].split()
-                    n = t[-3].split('"')[1]
-                    t[-1] = t[-3] = '"{}";'.format(name_map[n])
-                    t = " ".join(t)
-                    x[3] = int(x[3]) + start_offset
-                    x[4] = int(x[4]) + start_offset
-                    x[-1] = t
-                    outf.write("\t".join(map(str, x)) + "\n")
-
-
-def run_augustus(target, hint_f, seq_f, name, start, stop, aln_start, aln_stop, cfg_version, cfg_path, out_file_tree):
+    for x in r:
+        if x.startswith("#"):
+            continue
+        if "AUGUSTUS" in x:
+            x = x.split("\t")
+            if x[2] in ["exon", "CDS", "start_codon", "stop_codon"]:
+                t = x[-1].split()
+                n = t[-3].split('"')[1]
+                if n not in name_map:
+                    continue
+                t[-1] = t[-3] = '"{}";'.format(name_map[n])
+                t = " ".join(t)
+                x[3] = int(x[3]) + start_offset
+                x[4] = int(x[4]) + start_offset
+                x[-1] = t
+                yield "\t".join(map(str, x)) + "\n"
+
+
+def run_augustus(hint_f, seq_f, alignments, start, stop, cfg_version, cfg_path):
     """
-    Runs Augustus for each cfg/gp_string pair.
+    Runs Augustus on one window with one cfg. The predictions are split back out to each alignment in the window,
+    where each alignment gets the predictions that overlap it, named as if Augustus was ran on that alignment alone.
+    Yields the resulting GTF lines.
     """
     cmd = augustus_cmd.format(fasta=seq_f, start=start, stop=stop, cfg=cfg_path, hints=hint_f)
     r = popenCatch(cmd)
     r = r.split("\n")
     # extract only the transcript lines
     l = [x.split() for x in r if "\ttranscript\t" in x]
-    # filter out transcripts that do not overlap the alignment range
-    transcripts = [x[-1] for x in l if not (int(x[4]) < start or int(x[3]) > stop)]
-    # if we lose everything, stop here
-    if len(transcripts) > 0:
-        # rename transcript based on cfg version, and make names unique
-        name_map = rename_transcripts(transcripts, cfg_version, name)
-        # write this to a shared location where we will combine later
-        out_path = out_file_tree.getTempFile()
-        write_augustus(r, name_map, out_path, start)
-
-
-def transmap_2_aug(target, gp_string, genome, sizes_path, fasta_path, out_file_tree):
+    for name, aln_start, aln_stop in alignments:
+        # filter out transcripts that do not overlap the alignment range
+        transcripts = [x[-1] for x in l if not (int(x[4]) + start < aln_start or int(x[3]) + start > aln_stop)]
+        # if we lose everything, stop here
+        if len(transcripts) > 0:
+            # rename transcript based on cfg version, and make names unique
+            name_map = rename_transcripts(transcripts, cfg_version, name)
+            for line in parse_augustus(r, name_map, start):
+                yield line
+
+
+def transmap_2_aug(target, windows, genome, fasta_path, out_file_tree):
     """
-    Runs Augustus on one individual genePred string. Augustus is ran with each cfg file in cfgs
+    Runs Augustus on a batch of windows. Each window is a (chrom, start, stop, gp_strings) tuple containing all of
+    the alignments clustered into that window. Augustus is ran once per window with each cfg file in cfgs.
+    All of the results of this batch are written, sorted, to one file to be merged later.
     """
     fasta = Fasta(fasta_path)
-    chrom_sizes = {x.split()[0]: x.split()[1] for x in open(sizes_path)}
-    gp = genePredTranscript(gp_string.rstrip().split("\t"))
-    # ignore genes with no coding region or longer than max_gene_size
-    if not (gp.thick_start >= gp.thick_stop or gp.stop - gp.start > max_gene_size):
-        chrom = gp.chromosome
-        start = max(gp.start - padding, 0)
-        stop = min(gp.stop + padding, chrom_sizes[chrom])
-        tm_hint = get_transmap_hints(gp_string)
-        rnaseq_hint = get_rnaseq_hints(genome, chrom, start, stop)
+    rnaseq_hints = get_rnaseq_hints(genome, [(chrom, start, stop) for chrom, start, stop, _ in windows])
+    results = []
+    for (chrom, start, stop, gp_strings), rnaseq_hint in itertools.izip(windows, rnaseq_hints):
+        gps = [seq_lib.GenePredTranscript(x.rstrip().split("\t")) for x in gp_strings]
+        alignments = [(gp.name, gp.start, gp.stop) for gp in gps]
+        tm_hint = get_transmap_hints(gps)
         hint = "".join([tm_hint, rnaseq_hint])
         seq = fasta[chrom][start:stop]
-        hint_f, seq_f = write_hint_fasta(hint, seq, chrom, target.getGlobalTempDir())
+        hint_f, seq_f = write_hint_fasta(hint, seq, chrom, target.getLocalTempDir())
         for cfg_version, cfg_path in cfgs.iteritems():
-            target.addChildTargetFn(run_augustus, memory=8 * (1024 ** 3),
-                                    args=[hint_f, seq_f, gp.name, start, stop, gp.start, gp.stop,
-                                          cfg_version, cfg_path, out_file_tree])
+            results.extend(run_augustus(hint_f, seq_f, alignments, start, stop, cfg_version, cfg_path))
+    if len(results) > 0:
+        # write this to a shared location where we will combine later
+        results.sort(key=gtf_sort_key)
+        with open(out_file_tree.getTempFile(), "w") as outf:
+            outf.write("".join(results))
+
+
+def cluster_windows(gps, chrom_sizes):
+    """
+    Clusters genePred transcripts into padded windows. Transcripts whose padded windows overlap share a window, as long
+    as that does not grow it past max_window_size. Returns a list of (chrom, start, stop, gp_strings) tuples.
+    Transcripts with no coding region or longer than max_gene_size are ignored.
+    """
+    gps = sorted([(gp, gp_string) for gp, gp_string in gps if not (gp.thick_start >= gp.thick_stop or
+                                                                  gp.stop - gp.start > max_gene_size)],
+                 key=lambda (gp, _): (gp.chromosome, gp.start))
+    windows = []
+    for gp, gp_string in gps:
+        start = max(gp.start - padding, 0)
+        stop = min(gp.stop + padding, chrom_sizes[gp.chromosome])
+        if len(windows) > 0:
+            w_chrom, w_start, w_stop, w_gp_strings = windows[-1]
+            if w_chrom == gp.chromosome and start <= w_stop and max(stop, w_stop) - w_start <= max_window_size:
+                windows[-1] = (w_chrom, w_start, max(stop, w_stop), w_gp_strings + [gp_string])
+                continue
+        windows.append((gp.chromosome, start, stop, [gp_string]))
+    return windows
 
 
-def cat(target, genome, output_gtf, unsorted_tmp_file, out_file_tree):
+def estimate_window_duration(window):
+    """
+    Rough estimate of the number of seconds it takes to extract hints and run Augustus with every cfg on a window.
+    """
+    chrom, start, stop, gp_strings = window
+    return hints_seconds + len(cfgs) * augustus_seconds * max(1.0, float(stop - start) / typical_window_size)
+
+
+def batch_windows(windows, target_job_duration):
+    """
+    Groups windows into batches that are estimated to take about target_job_duration seconds.
+    """
+    batch, duration = [], 0
+    for window in windows:
+        batch.append(window)
+        duration += estimate_window_duration(window)
+        if duration >= target_job_duration:
+            yield batch
+            batch, duration = [], 0
+    if len(batch) > 0:
+        yield batch
+
+
+def cat(target, genome, output_gtf, out_file_tree):
     """
-    Concatenates all of the results into one big genePred, and sorts it by chromosome/pos
+    Merges the sorted results of every job into one big GTF, sorted by chromosome/pos. If there are too many files
+    to hold open at once, they are merged in more than one pass.
     """
-    catFiles(out_file_tree.listFiles(), unsorted_tmp_file)
-    system("sort -k1,1 -k4,4 {} > {}".format(unsorted_tmp_file, output_gtf))
+    merge_many_sorted_gtfs(out_file_tree.listFiles(), output_gtf, target.getLocalTempDir())
 
 
-def wrapper(target, input_gp, output_gtf, genome, sizes_path, fasta_path):
+def wrapper(target, input_gp, output_gtf, genome, sizes_path, fasta_path, target_job_duration):
     """
-    Produces one jobTree target per genePred entry. In the future, we could try chunking this per target but during
-    initial testing I found that it takes ~15 seconds to extract the RNAseq hints and ~1 minute to run each Augustus
-    instance. This seems to be a good time per job to me.
+    Clusters the transMap genePreds into padded windows by locus, so that overlapping alignments such as paralogs and
+    alternative isoforms are ran through Augustus together once instead of once each. Windows are batched into jobs
+    that are estimated to take target_job_duration seconds.
     """
+    assert hints_db.has_hints_index(hints_db_path), ("hints database has no covering index, set it up once with "
+                                                     "augustus/hints_db.py --createIndex")
     # create a file tree in the global output directory. This tree will store the gtf created by each Augustus instance
     out_file_tree = TempFileTree(target.getGlobalTempDir())
-    unsorted_tmp_file = os.path.join(target.getGlobalTempDir(), getRandomAlphaNumericString(10))
-    for line in open(input_gp):
-        target.addChildTargetFn(transmap_2_aug, args=[line, genome, sizes_path, fasta_path, out_file_tree])
-    target.setFollowOnTargetFn(cat, args=[genome, output_gtf, unsorted_tmp_file, out_file_tree])
+    chrom_sizes = {x.split()[0]: int(x.split()[1]) for x in open(sizes_path)}
+    gps = [(seq_lib.GenePredTranscript(line.rstrip().split("\t")), line) for line in open(input_gp)]
+    windows = cluster_windows(gps, chrom_sizes)
+    for batch in batch_windows(windows, target_job_duration):
+        target.addChildTargetFn(transmap_2_aug, memory=8 * (1024 ** 3),
+                                args=[batch, genome, fasta_path, out_file_tree])
+    target.setFollowOnTargetFn(cat, args=[genome, output_gtf, out_file_tree])
 
 
 def main():
@@ -194,10 +243,12 @@ def main():
     parser.add_argument("--genome", required=True)
     parser.add_argument("--chromSizes", required=True)
     parser.add_argument("--fasta", required=True)
+    parser.add_argument("--targetJobDuration", type=int, default=1800,
+                        help="Approximate number of seconds each Augustus job should run for (default: %(default)s)")
     Stack.addJobTreeOptions(parser)
     args = parser.parse_args()
-    i = Stack(Target.makeTargetFn(wrapper, args=(args.inputGp, args.outputGtf, args.genome,
-                                                 args.chromSizes, args.fasta))).startJobTree(args)
+    i = Stack(Target.makeTargetFn(wrapper, args=(args.inputGp, args.outputGtf, args.genome, args.chromSizes,
+                                                 args.fasta, args.targetJobDuration))).startJobTree(args)
     if i != 0:
         raise RuntimeError("Got failed jobs")
 
@@ -0,0 +1,208 @@
+"""
+Converts transMap genePreds to Augustus hints. This is a port of transMap2hints.pl (Mario Stanke) that works on
+GenePredTranscript objects, so that a whole genePred can be converted in one pass without a Perl interpreter per
+transcript. The output is identical to the Perl script with the same parameters.
+
+The Perl script can read an optional 16th column marking which gaps are introns. genePreds produced by this pipeline
+do not have it, and like the Perl script without that column every gap long enough is treated as an intron.
+"""
+import re
+
+import lib.seq_lib as seq_lib
+
+__author__ = "Ian Fiddes"
+
+max_intronpart_len = 200000
+min_exon_len = 3
+prgname = "t2h"
+
+# parameters the pipeline runs transMap2hints with
+pipeline_params = {"ep_cutoff": 0, "ep_margin": 12, "min_intron_len": 40, "start_stop_radius": 5, "tss_tts_radius": 5,
+                   "utrend_cutoff": 6}
+
+
+class TransMapHints(object):
+    """
+    Accumulates the hints for all transcripts on one chromosome, kept in the same order as the Perl script keeps
+    them. Call add_transcript for each transcript and then hint_lines to get the output.
+    """
+    def __init__(self, ep_cutoff=1, ep_margin=18, ip_cutoff=0, utrend_cutoff=15, min_intron_len=50,
+                 min_intron_len_utr=80, start_stop_radius=15, tss_tts_radius=100, priority=4, source="T"):
+        self.ep_cutoff = ep_cutoff
+        self.ep_margin = ep_margin
+        self.ip_cutoff = ip_cutoff
+        self.utrend_cutoff = utrend_cutoff
+        self.min_intron_len = min_intron_len
+        self.min_intron_len_utr = min_intron_len_utr
+        self.start_stop_radius = start_stop_radius
+        self.tss_tts_radius = tss_tts_radius
+        self.priority = priority
+        self.source = source
+        self.chromosome = None
+        self.hints = {x: [] for x in ["tss", "start", "stop", "tts", "ass", "dss", "exonpart", "intron", "CDSpart",
+                                      "UTRpart"]}
+
+    def add_transcript(self, gp):
+        """
+        Adds the hints for one GenePredTranscript.
+        """
+        self.chromosome = gp.chromosome
+        strand = seq_lib.convert_strand(gp.strand)
+        name = gp.name
+        tx_start, tx_end, cds_start, cds_end = gp.start, gp.stop, gp.thick_start, gp.thick_stop
+        r = self.start_stop_radius
+        start_hint = (cds_start + 1 - r, cds_start + 3 + r, strand, name)
+        stop_hint = (cds_end - 2 - r, cds_end + r, strand, name)
+        # start and stop hint
+        if strand == "+":
+            if tx_start != cds_start and cds_start > 0:
+                self._add_signal_hint("start", start_hint)
+            if tx_end != cds_end and cds_end > 0:
+                self._add_signal_hint("stop", stop_hint)
+        else:
+            if tx_start != cds_start and cds_start > 0:
+                self._add_signal_hint("stop", start_hint)
+            if tx_end != cds_end and cds_end > 0:
+                self._add_signal_hint("start", stop_hint)
+        # transcription start and transcription stop hint (tss and tts)
+        r = self.tss_tts_radius
+        tss_hint = (tx_start + 1 - r, tx_start + 1 + r, strand, name)
+        tts_hint = (tx_end - r, tx_end + r, strand, name)
+        if tx_start != cds_start and tx_start > 0:
+            self._add_signal_hint("tss" if strand == "+" else "tts", tss_hint)
+        if tx_end != cds_end and tx_end > 0:
+            self._add_signal_hint("tts" if strand == "+" else "tss", tts_hint)
+        # exonpart and intron hints
+        exons = gp.exon_intervals
+        ep_begin = ep_end = -1
+        for i, exon in enumerate(exons):
+            begin, end = exon.start + 1, exon.stop
+            if i == 0:
+                if begin + self.utrend_cutoff <= end:
+                    begin += self.utrend_cutoff
+                else:
+                    begin = end
+                if begin > cds_start >= tx_start:
+                    begin = cds_start
+            if i == len(exons) - 1:
+                if end - self.utrend_cutoff >= begin:
+                    end -= self.utrend_cutoff
+                else:
+                    end = begin
+                if end < cds_end <= tx_end:
+                    end = cds_end
+            if ep_begin < 0 or ep_end < 0:
+                ep_begin, ep_end = begin, end
+            elif (((ep_end < cds_start or ep_begin > cds_end) and ep_end + self.min_intron_len_utr + 1 >= begin) or
+                    ep_end + self.min_intron_len + 1 >= begin):
+                ep_end = end
+            else:  # large gap
+                intron_begin, intron_end = ep_end + 1, begin - 1
+                if intron_end - intron_begin + 1 >= self.min_intron_len:
+                    self.hints["intron"].append((intron_begin, intron_end, strand, name))
+                    # also add dss and ass hints in case it is an utr intron
+                    if intron_begin < cds_start or intron_begin > cds_end:
+                        self._add_signal_hint("dss" if strand == "+" else "ass",
+                                              (intron_begin, intron_begin, strand, name))
+                    if intron_end < cds_start or intron_end > cds_end:
+                        self._add_signal_hint("ass" if strand == "+" else "dss",
+                                              (intron_end, intron_end, strand, name))
+                self._add_exonpart_fuzzy_hint(ep_begin, ep_end, strand, name, cds_start, cds_end)
+                ep_begin, ep_end = begin, end
+        self._add_exonpart_fuzzy_hint(ep_begin, ep_end, strand, name, cds_start, cds_end)
+
+    def _add_signal_hint(self, kind, hint):
+        """
+        Adds a signal hint in sorted order, if the same hint does not exist already.
+        """
+        hints = self.hints[kind]
+        begin, strand = hint[0], hint[2]
+        k = len(hints) - 1
+        while k >= 0 and hints[k][0] >= begin:
+            k -= 1
+        for j in [k + 1, k + 2]:
+            if j <= len(hints) - 1 and hints[j][0] == begin and hints[j][2] == strand:
+                return
+        hints.insert(k + 1, hint)
+
+    def _add_exonpart_fuzzy_hint(self, begin, end, strand, name, cds_start, cds_end):
+        """
+        Splits the interval in case it covers the CDS start or stop and then adds the more specific CDS/UTR hints.
+        """
+        if end - begin + 1 < min_exon_len:
+            return
+        if begin < cds_start <= end:
+            self._add_fuzzy_hint(begin, cds_start - 1, strand, name, cds_start, cds_end)
+            begin = cds_start
+        if begin <= cds_end < end:
+            self._add_fuzzy_hint(begin, cds_end, strand, name, cds_start, cds_end)
+            begin = cds_end + 1
+        self._add_fuzzy_hint(begin, end, strand, name, cds_start, cds_end)
+
+    def _add_fuzzy_hint(self, begin, end, strand, name, cds_start, cds_end):
+        """
+        | ep_cutoff |       |       exon      |       | ep_cutoff |
+        |     ep_margin     |       exon      |    ep_margin      |
+                 fuzzybegin                         fuzzyend
+                         corebegin        coreend
+        """
+        if begin > end:
+            return
+        fuzzy_begin, fuzzy_end = begin + self.ep_cutoff, end - self.ep_cutoff
+        core_begin, core_end = begin + self.ep_margin, end - self.ep_margin
+        if core_begin > core_end:
+            # Perl int() truncates towards zero
+            core_begin = core_end = int((core_begin + core_end) / 2.0)
+        self._add_exonpart_hint((core_begin, core_end, strand, name, 2), cds_start, cds_end)
+        if fuzzy_begin < core_begin:
+            self._add_exonpart_hint((fuzzy_begin, core_begin - 1, strand, name, 1), cds_start, cds_end)
+        if fuzzy_end > core_end:
+            self._add_exonpart_hint((core_end + 1, fuzzy_end, strand, name, 1), cds_start, cds_end)
+
+    def _add_exonpart_hint(self, hint, cds_start, cds_end):
+        """
+        Sorts an exonpart hint into the UTRpart, CDSpart or exonpart list.
+        """
+        begin, end = hint[0], hint[1]
+        if end < cds_start or begin > cds_end:
+            hints = self.hints["UTRpart"]
+        elif begin >= cds_start and end <= cds_end:
+            hints = self.hints["CDSpart"]
+        else:
+            hints = self.hints["exonpart"]
+        k = len(hints) - 1
+        while k >= 0 and hints[k][0] > begin:
+            k -= 1
+        hints.insert(k + 1, hint)
+
+    def hint_lines(self):
+        """
+        Yields the hints as gff lines.
+        """
+        for kind in ["tss", "start", "stop", "tts", "ass", "dss", "exonpart", "intron", "CDSpart", "UTRpart"]:
+            frame = "0" if kind in ["tss", "start", "stop", "tts"] else "."
+            for hint in self.hints[kind]:
+                score = hint[4] if kind in ["exonpart", "CDSpart", "UTRpart"] else 0
+                tags = "grp={};src={};pri={}".format(hint[3], self.source, self.priority)
+                yield "\t".join(map(str, [self.chromosome, prgname, kind, hint[0], hint[1], score, hint[2], frame,
+                                          tags])) + "\n"
+
+
+def transmap_2_hints(gps, keep_ids=None, **kwargs):
+    """
+    Streams hint lines for an iterable of GenePredTranscript objects. Like the Perl script, hints are collected and
+    written out each time the chromosome changes, so sorting the input by chromosome keeps this fast. keep_ids is an
+    optional set of transcript IDs (without the -N alignment number) to restrict to. Other keyword arguments are the
+    transMap2hints.pl parameters (ep_cutoff, ep_margin, utrend_cutoff, min_intron_len, ...).
+    """
+    hints = TransMapHints(**kwargs)
+    for gp in gps:
+        if keep_ids is not None and re.sub("-[0-9]+$", "", gp.name) not in keep_ids:
+            continue
+        if hints.chromosome is not None and gp.chromosome != hints.chromosome:
+            for line in hints.hint_lines():
+                yield line
+            hints = TransMapHints(**kwargs)
+        hints.add_transcript(gp)
+    for line in hints.hint_lines():
+        yield line
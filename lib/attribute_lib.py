@@ -0,0 +1,180 @@
+"""
+Library for loading the gencode attributes file (GeneId, GeneName, GeneType, TranscriptId, TranscriptType). The file
+is parsed once into interned columns with indexes on transcript ID and biotype, and the parsed form is pickled next
+to the attributes file so that later processes skip the parse entirely. Only the columns are pickled; loading them
+interns them again (cPickle does not keep strings interned) and rebuilds the indexes.
+"""
+import os
+import re
+import hashlib
+import cPickle as pickle
+from collections import defaultdict
+
+import pandas as pd
+
+import lib.seq_lib as seq_lib
+
+__author__ = "Ian Fiddes"
+
+# bump this if the contents of AttributeTable change so that old caches are not reused
+cache_version = 2
+
+columns = ["GeneId", "GeneName", "GeneType", "TranscriptId", "TranscriptType"]
+
+# per-process cache, keyed on the cache path (see get_attribute_cache_path)
+_tables = {}
+
+
+class AttributeTable(object):
+    """
+    Columnar in-memory form of the attributes file. Each column is a list of interned strings; row i of every column
+    describes the same transcript. transcript_index maps transcript ID to row and biotype_index maps transcript
+    biotype to a list of rows.
+    """
+    def __init__(self, rows):
+        self._set_columns(zip(*rows) if len(rows) > 0 else [[] for _ in columns])
+
+    def __getstate__(self):
+        return [self.gene_ids, self.gene_names, self.gene_types, self.transcript_ids, self.transcript_types]
+
+    def __setstate__(self, state):
+        self._set_columns(state)
+
+    def _set_columns(self, cols):
+        """
+        Interns the five columns and builds the indexes.
+        """
+        self.gene_ids, self.gene_names, self.gene_types, self.transcript_ids, self.transcript_types = \
+            [map(intern, x) for x in cols]
+        self.transcript_index = {tx_id: i for i, tx_id in enumerate(self.transcript_ids)}
+        self.biotype_index = defaultdict(list)
+        for i, biotype in enumerate(self.transcript_types):
+            self.biotype_index[biotype].append(i)
+        self.biotype_index = dict(self.biotype_index)
+
+    def __len__(self):
+        return len(self.transcript_ids)
+
+    def __contains__(self, tx_id):
+        return tx_id in self.transcript_index
+
+    def _rows(self, biotype):
+        return xrange(len(self)) if biotype is None else self.biotype_index.get(biotype, [])
+
+    def get_biotypes(self):
+        """
+        Returns the set of transcript biotypes.
+        """
+        return set(self.biotype_index)
+
+    def get_transcript_ids(self, biotype=None):
+        """
+        Returns the set of transcript IDs, optionally restricted to one transcript biotype.
+        """
+        return {self.transcript_ids[i] for i in self._rows(biotype)}
+
+    def get_gene_ids(self, biotype=None):
+        """
+        Returns the set of gene IDs, optionally restricted to genes with a transcript of this transcript biotype.
+        """
+        return {self.gene_ids[i] for i in self._rows(biotype)}
+
+    def get_gene_map(self):
+        """
+        Returns a dictionary mapping all transcript IDs to their respective gene IDs.
+        """
+        return dict(zip(self.transcript_ids, self.gene_ids))
+
+    def get_gene_biotype_map(self):
+        """
+        Returns a dictionary mapping all gene IDs to their respective gene biotypes.
+        """
+        return dict(zip(self.gene_ids, self.gene_types))
+
+    def get_attribute(self, tx_id):
+        """
+        Returns a seq_lib.Attribute for one transcript ID.
+        """
+        i = self.transcript_index[tx_id]
+        return seq_lib.Attribute(self.gene_ids[i], self.gene_names[i], self.gene_types[i], self.transcript_ids[i],
+                                 self.transcript_types[i])
+
+    def get_attribute_dict(self):
+        """
+        Returns a dictionary mapping every transcript ID to a seq_lib.Attribute.
+        """
+        return {tx_id: self.get_attribute(tx_id) for tx_id in self.transcript_index}
+
+    def to_frame(self):
+        """
+        Returns the table as a pandas DataFrame indexed on TranscriptId.
+        """
+        df = pd.DataFrame(dict(zip(columns, [self.gene_ids, self.gene_names, self.gene_types, self.transcript_ids,
+                                             self.transcript_types])), columns=columns)
+        return df.set_index("TranscriptId")
+
+
+def parse_attribute_file(attr_path):
+    """
+    Parses the attributes file into an AttributeTable. The header line is skipped if present.
+    """
+    rows = []
+    with open(attr_path) as f:
+        for line in f:
+            line = line.split()
+            if len(line) == 0 or line[3] == "TranscriptId":
+                continue
+            rows.append(line)
+    return AttributeTable(rows)
+
+
+def get_attribute_cache_path(attr_path):
+    """
+    Returns the path the parsed form of attr_path is cached to. Keyed on the size and modification time of the
+    attributes file so that a changed file is parsed again.
+    """
+    s = os.stat(attr_path)
+    h = hashlib.md5("{}:{}:{}:{}".format(cache_version, os.path.abspath(attr_path), s.st_size, int(s.st_mtime)))
+    return "{}.{}.pickle".format(attr_path, h.hexdigest())
+
+
+def remove_stale_caches(attr_path, cache_path):
+    """
+    Removes the caches of earlier versions of attr_path, leaving cache_path. Caches that are already gone (removed by
+    another process) or can not be removed are skipped.
+    """
+    d, base = os.path.split(os.path.abspath(attr_path))
+    cache_re = re.compile(re.escape(base) + r"\.[0-9a-f]{32}\.pickle$")
+    keep = os.path.basename(cache_path)
+    for f in os.listdir(d):
+        if f != keep and cache_re.match(f):
+            try:
+                os.remove(os.path.join(d, f))
+            except OSError:
+                pass
+
+
+def load_attribute_table(attr_path):
+    """
+    Returns the AttributeTable for attr_path. Tables are cached in this process and on disk next to the attributes
+    file, both keyed on the cache path so that a changed file is parsed again. If the cache can not be written (read
+    only directory) the file is just parsed.
+    """
+    cache_path = get_attribute_cache_path(attr_path)
+    if cache_path in _tables:
+        return _tables[cache_path]
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as inf:
+            table = pickle.load(inf)
+    else:
+        table = parse_attribute_file(attr_path)
+        tmp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+        try:
+            with open(tmp_path, "wb") as outf:
+                pickle.dump(table, outf, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, cache_path)
+            remove_stale_caches(attr_path, cache_path)
+        except (IOError, OSError):
+            pass
+    _tables[cache_path] = table
+    return table
@@ -0,0 +1,99 @@
+"""
+Helpers for aligning Augustus transcripts to their reference transcripts with blat (see augustus/align_augustus.py):
+parsing the blat output, computing identity and coverage, and the cache of results keyed on (Augustus sequence hash,
+reference ID) that lets sequences seen in a previous run skip blat.
+"""
+import os
+import hashlib
+import cPickle as pickle
+from collections import defaultdict
+
+from lib.psl_lib import PslRow, remove_augustus_alignment_number, remove_alignment_number
+from lib.general_lib import format_ratio
+
+__author__ = "Ian Fiddes"
+
+
+def coverage(p_list):
+    m = sum(x.matches for x in p_list)
+    mi = sum(x.mismatches for x in p_list)
+    rep = sum(x.repmatches for x in p_list)
+    return format_ratio(m + mi + rep, p_list[0].q_size)
+
+
+def identity(p_list):
+    m = sum(x.matches for x in p_list)
+    mi = sum(x.mismatches for x in p_list)
+    rep = sum(x.repmatches for x in p_list)
+    ins = sum(x.q_num_insert for x in p_list)
+    return format_ratio(m + rep, m + rep + mi + ins)
+
+
+def chunker(seq, size):
+    return (seq[pos:pos + size] for pos in xrange(0, len(seq), size))
+
+
+def source_id(aug_aId):
+    """
+    Returns the reference transcript ID an Augustus transcript was predicted from.
+    """
+    return remove_alignment_number(remove_augustus_alignment_number(aug_aId))
+
+
+def cache_key(aug_seq, gencode_id):
+    return hashlib.md5(aug_seq).hexdigest(), gencode_id
+
+
+def load_cache(cache_path):
+    if not os.path.exists(cache_path):
+        return {}
+    with open(cache_path) as inf:
+        return pickle.load(inf)
+
+
+def partition_cached(aug_seqs, cache):
+    """
+    Splits (aug_aId, sequence) pairs into the result lines ([aug_aId, identity, coverage]) of the ones already in
+    cache and the list of Augustus IDs that still need to be aligned.
+    """
+    cached = []
+    to_align = []
+    for aug_aId, aug_seq in aug_seqs:
+        key = cache_key(aug_seq, source_id(aug_aId))
+        if key in cache:
+            cached.append([aug_aId] + cache[key])
+        else:
+            to_align.append(aug_aId)
+    return cached, to_align
+
+
+def parse_blat(r):
+    """
+    Groups the PSL lines in the blat output by (query, target) pair. Lines that are not PSL (blat writes its
+    Loaded/Searched messages to stdout as well) are ignored.
+    """
+    p_lists = defaultdict(list)
+    for line in r.split("\n"):
+        x = line.split("\t")
+        if len(x) == 21 and x[0].isdigit():
+            p = PslRow(line)
+            p_lists[(p.q_name, p.t_name)].append(p)
+    return p_lists
+
+
+def pair_results(pairs, p_lists):
+    """
+    Computes identity and coverage for each requested (aug_aId, gencode_id, cache key) pair from the grouped blat
+    output of a whole chunk. Hits between an Augustus transcript and any other reference transcript in the chunk are
+    discarded; a pair without hits gets 0 for both. Returns the result lines and the new cache entries.
+    """
+    results = []
+    cache = {}
+    for aug_aId, gencode_id, key in pairs:
+        p_list = p_lists.get((aug_aId, gencode_id), [])
+        if len(p_list) == 0:
+            cache[key] = ["0", "0"]
+        else:
+            cache[key] = map(str, [identity(p_list), coverage(p_list)])
+        results.append([aug_aId] + cache[key])
+    return results, cache
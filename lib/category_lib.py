@@ -0,0 +1,156 @@
+"""
+Compiles the category tuples in etc/queries.py and etc/augustus_queries.py (details fields, classify fields, classify
+values and the AND/OR operations linking them) into explicit expression trees, and evaluates them in memory over a
+bit-packed classify matrix.
+
+The operations are applied left to right: fields [a, b, c] with operations [OR, AND] is ((a OR b) AND c). This is what
+the categories are written to mean (interestingBiology is any interesting mutation AND no excluded problem), where a
+flat SQL chain would have bound the ANDs first. sql_lib.compile_where renders the same trees, so both paths agree.
+
+Each classify column is stored as two packed bitmasks, one for rows equal to 1 and one for rows equal to 0. Rows that
+are NULL are in neither. As in SQL, a row is only in a category if the expression is true for it; since categories
+never negate, a NULL comparison can be treated as false.
+"""
+import numpy as np
+
+__author__ = "Ian Fiddes"
+
+
+class Field(object):
+    """
+    Leaf of an expression tree: the classify field name equals value (0 or 1).
+    """
+    def __init__(self, name, value):
+        assert value in [0, 1], "can only compare classify fields to 0 or 1"
+        self.name = name
+        self.value = value
+
+    def __repr__(self):
+        return "Field({!r}, {!r})".format(self.name, self.value)
+
+    def fields(self):
+        return {self.name}
+
+    def to_sql(self, table):
+        return "{}.{} = ?".format(table, self.name)
+
+    def evaluate(self, matrix, cache):
+        """
+        Returns the packed mask of rows for which this expression is true. cache is shared between the expressions
+        evaluated in one pass so that each subexpression is only computed once.
+        """
+        return matrix.columns[self.name][1 - self.value]
+
+
+class Operation(object):
+    """
+    Interior node of an expression tree, linking two subexpressions with AND or OR.
+    """
+    def __init__(self, op, left, right):
+        assert op in ["AND", "OR"], op
+        self.op = op
+        self.left = left
+        self.right = right
+
+    def __repr__(self):
+        return "Operation({!r}, {!r}, {!r})".format(self.op, self.left, self.right)
+
+    def fields(self):
+        return self.left.fields() | self.right.fields()
+
+    def to_sql(self, table):
+        return "({} {} {})".format(self.left.to_sql(table), self.op, self.right.to_sql(table))
+
+    def evaluate(self, matrix, cache):
+        key = repr(self)
+        if key not in cache:
+            left = self.left.evaluate(matrix, cache)
+            right = self.right.evaluate(matrix, cache)
+            cache[key] = left & right if self.op == "AND" else left | right
+        return cache[key]
+
+
+def compile_category(fields, values, operations):
+    """
+    Compiles classify fields, their values and the operations linking them into an expression tree.
+    """
+    assert len(fields) > 0 and len(fields) == len(values) == len(operations) + 1, (fields, values, operations)
+    tree = Field(fields[0], values[0])
+    for field, value, op in zip(fields[1:], values[1:], operations):
+        tree = Operation(op, tree, Field(field, value))
+    return tree
+
+
+def pack(m):
+    """
+    Packs a boolean vector into uint64 words.
+    """
+    packed = np.packbits(np.asarray(m, dtype=bool))
+    packed = np.append(packed, np.zeros(-len(packed) % 8, dtype=np.uint8))
+    return packed.view(np.uint64)
+
+
+def unpack(packed, n):
+    """
+    Unpacks the first n bits of packed into a boolean vector.
+    """
+    return np.unpackbits(packed.view(np.uint8))[:n].astype(bool)
+
+
+class ClassifyMatrix(object):
+    """
+    In-memory classify table for one genome. aln_ids is an array of alignment IDs and columns maps each classify field
+    to its packed (equal to 1, equal to 0) masks.
+    """
+    def __init__(self, aln_ids, names, values):
+        """
+        values is a 2D array of classifier values, one row per alignment ID and one column per name. NaN is NULL.
+        """
+        self.aln_ids = np.asarray(aln_ids, dtype=object)
+        values = np.asarray(values, dtype=float).reshape(len(self.aln_ids), len(names))
+        self.columns = {name: (pack(values[:, i] == 1), pack(values[:, i] == 0)) for i, name in enumerate(names)}
+
+    def __len__(self):
+        return len(self.aln_ids)
+
+    def select(self, tree, cache=None):
+        """
+        Returns the set of alignment IDs for which the expression is true.
+        """
+        mask = tree.evaluate(self, {} if cache is None else cache)
+        return set(self.aln_ids[unpack(mask, len(self))])
+
+
+def categorize(matrix, categories):
+    """
+    Evaluates every category against one ClassifyMatrix in a single pass. categories maps a name to an expression
+    tree, and the result maps the same names to sets of alignment IDs.
+    """
+    cache = {}
+    return {name: matrix.select(tree, cache) for name, tree in categories.iteritems()}
+
+
+def compile_categories(category_fns):
+    """
+    Compiles a list of category functions (such as those in etc/queries.py) into a dict mapping each function name to
+    its expression tree.
+    """
+    categories = {}
+    for fn in category_fns:
+        details_fields, classify_fields, classify_values, classify_operations = fn()
+        categories[fn.__name__] = compile_category(classify_fields, classify_values, classify_operations)
+    return categories
+
+
+def load_classify_matrix(cur, genome, categories, database="main"):
+    """
+    Loads the classify fields used by any of categories for genome from database into a ClassifyMatrix.
+    """
+    from lib.sql_lib import compile_query
+    names = sorted(set.union(*[tree.fields() for tree in categories.itervalues()]))
+    q = compile_query([(database, "AlignmentId")] + [(database, x) for x in names], [database],
+                      name="load_classify_matrix")
+    rows = list(q.execute(cur, genome))
+    aln_ids = [x[0] for x in rows]
+    values = np.array([x[1:] for x in rows], dtype=float)
+    return ClassifyMatrix(aln_ids, names, values)
@@ -0,0 +1,65 @@
+"""
+Hierarchical clustering of binary classifier matrices. Rows (transcripts) are packed into integer bitmasks, one bit
+per classifier, and collapsed to the unique failure patterns with their counts. The weighted Jaccard (binary) distance
+between classifiers is then computed with bit operations over the unique patterns, so the work depends on the number
+of distinct patterns instead of the number of transcripts.
+"""
+import numpy as np
+from scipy.cluster.hierarchy import linkage
+
+__author__ = "Ian Fiddes"
+
+
+def pack_patterns(m):
+    """
+    Packs a boolean matrix (rows are transcripts, columns are classifiers) into one integer per row and collapses
+    identical rows. Returns the unique row masks and the number of rows with each mask.
+    """
+    m = np.asarray(m, dtype=bool)
+    assert m.shape[1] <= 64, "can only pack up to 64 classifiers"
+    bits = np.left_shift(np.uint64(1), np.arange(m.shape[1], dtype=np.uint64))
+    masks = m.astype(np.uint64).dot(bits)
+    return np.unique(masks, return_counts=True)
+
+
+def weighted_jaccard_distances(patterns, counts, num_columns):
+    """
+    Returns the condensed (scipy pdist ordering) Jaccard distance matrix between the columns of the original matrix,
+    computed from the unique patterns and their counts. Two columns that are never set have a distance of 0.
+    """
+    patterns = np.asarray(patterns, dtype=np.uint64)
+    counts = np.asarray(counts, dtype=np.int64)
+    bits = [np.uint64(1) << np.uint64(i) for i in xrange(num_columns)]
+    distances = []
+    for i in xrange(num_columns):
+        for j in xrange(i + 1, num_columns):
+            both = bits[i] | bits[j]
+            hits = patterns & both
+            intersection = counts[hits == both].sum()
+            union = counts[hits != 0].sum()
+            distances.append(1.0 - float(intersection) / union if union > 0 else 0.0)
+    return np.array(distances)
+
+
+def ward_d_linkage(distances):
+    """
+    Ward linkage as done by R's hclust(method="ward.D") (what pvclust's method.hclust="ward" runs), which applies the
+    Ward update to the distances as given. scipy's ward is R's ward.D2, which squares them first, so it is run on the
+    square roots of the distances and the merge heights are squared back.
+    """
+    z = linkage(np.sqrt(distances), method="ward")
+    z[:, 2] **= 2
+    return z
+
+
+def cluster_columns(m, method="ward"):
+    """
+    Clusters the columns of a boolean matrix (or DataFrame) by binary distance. Returns a scipy linkage matrix.
+    method="ward" reproduces R's ward.D, as cluster.R used; other methods are passed to scipy's linkage.
+    """
+    m = np.asarray(m, dtype=bool)
+    patterns, counts = pack_patterns(m)
+    distances = weighted_jaccard_distances(patterns, counts, m.shape[1])
+    if method == "ward":
+        return ward_d_linkage(distances)
+    return linkage(distances, method=method)
@@ -1,7 +1,13 @@
 """
 This file contains helper functions for comparativeAnnotator. These functions revolve around analyzing indels,
-frameshifts and codons.
+frameshifts and codons, and comparing transcript models that lie on the same genome.
 """
+from itertools import izip
+from collections import Counter
+
+import lib.seq_lib as seq_lib
+import lib.psl_lib as psl_lib
+from lib.general_lib import format_ratio
 
 __author__ = "Ian Fiddes"
 
@@ -103,17 +109,17 @@ def frame_shift_iterator(a, t, aln):
             yield start, stop, span
 
 
-def codon_pair_iterator(a, t, aln, target_seq_dict, query_seq_dict):
+def codon_pair_iterator(a, t, aln, target_seq_dict, query_cds):
     """
     Inputs:
     Transcript objects representing the annotation (query) transcript and the target transcript.
     PslRow object that represents the alignment between the transcript objects.
-    SeqDicts/TwoBitFileObjs that contain the genomic sequence for these two transcripts
+    SeqDict/TwoBitFileObj that contains the genomic sequence for the target transcript.
+    The CDS sequence of the annotation transcript, which is precomputed in the reference store.
 
     Order is (target_cds_pos, target, query)
     """
     target_cds = t.get_cds(target_seq_dict)
-    query_cds = a.get_cds(query_seq_dict)
     a_frames = [x for x in a.exonFrames if x != -1]
     if a.strand is True:
         a_offset = a_frames[0]
@@ -134,12 +140,15 @@ def codon_pair_iterator(a, t, aln, target_seq_dict, query_seq_dict):
         yield target_cds_positions[0], target_codon, query_codon
 
 
-def compare_intron_to_reference(intron, a, aln, compare_dict, ref_dict):
+def compare_intron_to_reference(intron, a, aln, compare_dict, ref_annotation):
     """
     For use with the splicing classifiers. Given an index of an intron in t that has a problem,
     determines if this intron exists in the reference. Then, determines if this reference splice
     also has the problem defined by compare_dict. Returns True if the reference also has a splicing problem.
 
+    ref_annotation is the ReferenceTranscript (see lib/reference_lib.py) for a, which holds the reference splice
+    dinucleotides so that the reference sequence is not read again for every alignment of a.
+
     TODO: I don't understand why I am effectively adding 2 below, once before and once after. a_start cannot ever have
     been None because this would raise a TypeError. I am scared to change this without a test...
     """
@@ -148,10 +157,126 @@ def compare_intron_to_reference(intron, a, aln, compare_dict, ref_dict):
     if a_start is None or a_stop is None:
         return False
     a_start += 1
-    for a_intron in a.intronIntervals:
-        if a_intron.start == a_start and a_intron.stop == a_stop:
-            ref_seq = a_intron.get_sequence(ref_dict, strand=True)
-            donor, acceptor = ref_seq[:2], ref_seq[-2:]
-            if donor not in compare_dict or compare_dict[donor] != acceptor:
-                return True
-    return False
\ No newline at end of file
+    if (a_start, a_stop) not in ref_annotation.splice_sites:
+        return False
+    donor, acceptor = ref_annotation.splice_sites[(a_start, a_stop)]
+    return donor not in compare_dict or compare_dict[donor] != acceptor
+
+
+class TranscriptComparison(object):
+    """
+    Stores the base counts from comparing two transcript models on the same genome (see
+    compare_transcript_coordinates):
+    size_a/size_b: the number of exonic bases in each transcript.
+    shared: the number of exonic bases in both transcripts.
+    shared_cds: the number of bases that are coding in both transcripts.
+    shared_cds_in_frame: the number of shared coding bases that are read in the same frame by both transcripts.
+    """
+    __slots__ = ('size_a', 'size_b', 'shared', 'shared_cds', 'shared_cds_in_frame')
+
+    def __init__(self, size_a, size_b, shared=0, shared_cds=0, shared_cds_in_frame=0):
+        self.size_a = size_a
+        self.size_b = size_b
+        self.shared = shared
+        self.shared_cds = shared_cds
+        self.shared_cds_in_frame = shared_cds_in_frame
+
+    def exon_overlap(self):
+        """
+        Shared exonic bases over the exonic bases in either transcript (Jaccard index of the exons).
+        """
+        return format_ratio(self.shared, self.size_a + self.size_b - self.shared)
+
+    def frame_agreement(self):
+        """
+        Fraction of the shared coding bases that both transcripts read in the same frame. NaN if no coding bases
+        are shared.
+        """
+        return format_ratio(self.shared_cds_in_frame, self.shared_cds)
+
+
+def get_cds_intervals(t):
+    """
+    Returns the exon intervals of t clipped to the CDS, in (+) strand ordering.
+    """
+    intervals = []
+    for exon in t.exon_intervals:
+        start, stop = max(exon.start, t.thick_start), min(exon.stop, t.thick_stop)
+        if start < stop:
+            intervals.append(seq_lib.ChromosomeInterval(exon.chromosome, start, stop, exon.strand))
+    return intervals
+
+
+def compare_transcript_coordinates(a, b):
+    """
+    Compares two GenePredTranscript objects that were both placed on the same genome (for example an Augustus
+    prediction and the transMap alignment it was built from) directly in chromosome coordinates, so that neither has
+    to be re-aligned. Returns a TranscriptComparison.
+
+    Shared bases are found by sweeping the sorted exon and CDS intervals of both transcripts. Within a shared coding
+    interval the frame difference between a and b is constant, so it only needs to be looked up once per interval.
+    """
+    r = TranscriptComparison(len(a), len(b))
+    if a.chromosome != b.chromosome or a.strand != b.strand:
+        return r
+    for start, stop in seq_lib.sorted_interval_intersections(a.exon_intervals, b.exon_intervals):
+        r.shared += stop - start
+    a_offset = seq_lib.find_offset(a.exon_frames, a.strand)
+    b_offset = seq_lib.find_offset(b.exon_frames, b.strand)
+    for start, stop in seq_lib.sorted_interval_intersections(get_cds_intervals(a), get_cds_intervals(b)):
+        r.shared_cds += stop - start
+        a_frame = (a.chromosome_coordinate_to_cds(start) - a_offset) % 3
+        b_frame = (b.chromosome_coordinate_to_cds(start) - b_offset) % 3
+        if a_frame == b_frame:
+            r.shared_cds_in_frame += stop - start
+    return r
+
+
+class AugustusPair(object):
+    """
+    One Augustus transcript joined to the transMap transcript it was predicted from:
+    aug_aId/aug_t: the Augustus alignment ID and GenePredTranscript.
+    aId/t: the transMap alignment ID and GenePredTranscript. t is None if the alignment is not in the transMap set.
+    same_locus: True if both transcripts are on the same chromosome and strand.
+    copies: the number of Augustus transcripts from the same Augustus mode (augI1, augI2...) built from the same
+        transMap alignment.
+    """
+    __slots__ = ('aug_aId', 'aug_t', 'aId', 't', 'same_locus', 'copies', '_comparison')
+
+    def __init__(self, aug_aId, aug_t, aId, t, copies):
+        self.aug_aId = aug_aId
+        self.aug_t = aug_t
+        self.aId = aId
+        self.t = t
+        self.same_locus = t is not None and aug_t.strand == t.strand and aug_t.chromosome == t.chromosome
+        self.copies = copies
+        self._comparison = None
+
+    def comparison(self):
+        """
+        Returns the TranscriptComparison of aug_t to t, computed on first use so that it is shared by every Augustus
+        attribute. t must not be None.
+        """
+        if self._comparison is None:
+            self._comparison = compare_transcript_coordinates(self.aug_t, self.t)
+        return self._comparison
+
+
+def augustus_copy_key(aug_aId, aId):
+    """
+    Returns the key used to count Augustus copies of a transMap alignment: the Augustus mode and alignment ID. Copies
+    over different alignments of the same source transcript are left to the transMap paralogy classifier.
+    """
+    return aug_aId.split("-", 1)[0], aId
+
+
+def build_augustus_pairs(aug_transcripts, transcript_dict):
+    """
+    Joins a list of Augustus GenePredTranscripts to a dict of transMap GenePredTranscripts keyed on alignment ID.
+    The alignment IDs are resolved once here so that the Augustus classifiers never need to parse them again.
+    Returns a list of AugustusPair objects.
+    """
+    aIds = [psl_lib.remove_augustus_alignment_number(aug_t.name) for aug_t in aug_transcripts]
+    counts = Counter(augustus_copy_key(aug_t.name, aId) for aug_t, aId in izip(aug_transcripts, aIds))
+    return [AugustusPair(aug_t.name, aug_t, aId, transcript_dict.get(aId), counts[augustus_copy_key(aug_t.name, aId)])
+            for aug_t, aId in izip(aug_transcripts, aIds)]
@@ -0,0 +1,115 @@
+"""
+Cross-genome comparisons of the best transMap alignment of every source transcript. Instead of querying each genome
+table in turn, the best alignments for all target genomes are loaded once into source transcript x genome matrices
+(alignment ID, coverage, identity and OK status) that can be queried across genomes with numpy.
+"""
+import sqlite3 as sql
+
+import numpy as np
+import pandas as pd
+
+__author__ = "Ian Fiddes"
+
+# values of GenomeMatrix.ok
+no_alignment = -1
+not_ok = 0
+ok = 1
+
+
+class GenomeMatrix(object):
+    """
+    Holds the best alignment of every source transcript in every genome. Row i is transcript_ids[i], column j is
+    genomes[j]. coverage and identity are NaN and aln_ids is None where a transcript has no alignment in a genome.
+    ok is 1 (OK), 0 (not OK) or -1 (no alignment).
+    """
+    def __init__(self, best_alignments, genomes=None):
+        """
+        best_alignments is a DataFrame with Genome, TranscriptId, TranscriptType, AlignmentId, AlignmentIdentity,
+        AlignmentCoverage and Ok columns, one row per genome and source transcript. genomes fixes the column order,
+        otherwise the genomes are sorted.
+        """
+        if genomes is None:
+            genomes = sorted(set(best_alignments.Genome))
+        self.genomes = list(genomes)
+        self.genome_index = {g: j for j, g in enumerate(self.genomes)}
+        best_alignments = best_alignments[best_alignments.Genome.isin(self.genome_index)]
+        tx_codes, self.transcript_ids = pd.factorize(best_alignments.TranscriptId, sort=True)
+        self.transcript_ids = np.asarray(self.transcript_ids, dtype=object)
+        self.transcript_index = {t: i for i, t in enumerate(self.transcript_ids)}
+        genome_codes = best_alignments.Genome.map(self.genome_index).values
+        shape = (len(self.transcript_ids), len(self.genomes))
+        self.coverage = np.full(shape, np.nan)
+        self.identity = np.full(shape, np.nan)
+        self.ok = np.full(shape, no_alignment, dtype=np.int8)
+        self.aln_ids = np.full(shape, None, dtype=object)
+        self.coverage[tx_codes, genome_codes] = best_alignments.AlignmentCoverage.values
+        self.identity[tx_codes, genome_codes] = best_alignments.AlignmentIdentity.values
+        self.ok[tx_codes, genome_codes] = best_alignments.Ok.values
+        self.aln_ids[tx_codes, genome_codes] = best_alignments.AlignmentId.values
+        self.biotypes = np.full(len(self.transcript_ids), None, dtype=object)
+        self.biotypes[tx_codes] = best_alignments.TranscriptType.values
+
+    def _columns(self, genomes):
+        return slice(None) if genomes is None else [self.genome_index[g] for g in genomes]
+
+    def _rows(self, biotype):
+        if biotype is None:
+            return np.ones(len(self.transcript_ids), dtype=bool)
+        return self.biotypes == biotype
+
+    def ok_counts(self, genomes=None):
+        """
+        Returns, for every source transcript, the number of genomes (out of genomes, default all) it is OK in.
+        """
+        return (self.ok[:, self._columns(genomes)] == ok).sum(axis=1)
+
+    def transcripts_ok_in(self, min_genomes, genomes=None, biotype=None):
+        """
+        Returns the set of source transcripts OK in at least min_genomes of genomes (default all genomes), optionally
+        restricted to one biotype.
+        """
+        hits = (self.ok_counts(genomes) >= min_genomes) & self._rows(biotype)
+        return set(self.transcript_ids[hits])
+
+    def transcripts_not_ok_in(self, genomes=None, biotype=None):
+        """
+        Returns the set of source transcripts that are not OK (or not aligned) in every one of genomes.
+        """
+        hits = (self.ok_counts(genomes) == 0) & self._rows(biotype)
+        return set(self.transcript_ids[hits])
+
+    def failing_genomes(self, tx_id):
+        """
+        Returns the genomes in which this source transcript is not OK or has no alignment.
+        """
+        row = self.ok[self.transcript_index[tx_id]]
+        return [g for g, v in zip(self.genomes, row) if v != ok]
+
+    def best_alignments(self, genome, biotype=None):
+        """
+        Returns a dict mapping each aligned source transcript to the (aln_id, identity, coverage) of its best alignment
+        in genome, like highest_cov_aln. Can be restricted by biotype.
+        """
+        j = self.genome_index[genome]
+        hits = np.flatnonzero((self.ok[:, j] != no_alignment) & self._rows(biotype))
+        return {self.transcript_ids[i]: (self.aln_ids[i, j], self.identity[i, j], self.coverage[i, j]) for i in hits}
+
+    def not_ok_alignments(self, genome, biotype=None):
+        """
+        Returns the set of best alignment IDs in genome that are not OK. Can be restricted by biotype.
+        """
+        j = self.genome_index[genome]
+        return set(self.aln_ids[(self.ok[:, j] == not_ok) & self._rows(biotype), j])
+
+
+def load_genome_matrix(metrics_path, genomes=None):
+    """
+    Builds a GenomeMatrix from the best_alignments table of a metrics store (see plotting/metrics_store.py) in a
+    single query.
+    """
+    con = sql.connect(metrics_path)
+    cmd = ("SELECT Genome, TranscriptId, TranscriptType, AlignmentId, AlignmentIdentity, AlignmentCoverage, Ok FROM "
+           "best_alignments")
+    best_alignments = pd.read_sql_query(cmd, con)
+    con.close()
+    return GenomeMatrix(best_alignments, genomes)
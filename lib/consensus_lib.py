@@ -0,0 +1,150 @@
+"""
+Bins the consensus candidates (Augustus and transMap alignments) of every source transcript. The candidates are held
+in one table and binned with grouped columnar operations, see bin_transcripts. Also loads the genePred records of the
+binned alignments sorted by position, see load_sorted_records.
+"""
+import numpy as np
+import pandas as pd
+from lib.psl_lib import remove_alignment_number, remove_augustus_alignment_number
+
+__author__ = "Ian Fiddes"
+
+
+def load_aug_stats(stats_path):
+    """
+    Loads the blat identity and coverage of every Augustus transcript to its source transcript, as written by
+    align_augustus.py (one whitespace separated line of alignment ID, identity and coverage per transcript).
+    """
+    return pd.read_csv(stats_path, sep=r"\s+", header=None, names=["AlignmentId", "Identity", "Coverage"])
+
+
+def build_candidates(aug_stats, tm_stats, coding_ok, noncoding_ok):
+    """
+    Combines the Augustus and transMap alignment stats (AlignmentId, Identity, Coverage) into one candidate table with
+    the source transcript ID and OK flags of each alignment. Augustus alignments come first, which is the order ties
+    are broken in.
+    """
+    columns = ["AlignmentId", "Identity", "Coverage"]
+    candidates = pd.concat([aug_stats[columns], tm_stats[columns]], ignore_index=True)
+    candidates["TranscriptId"] = [remove_alignment_number(remove_augustus_alignment_number(x))
+                                  for x in candidates.AlignmentId]
+    candidates["CodingOk"] = candidates.AlignmentId.isin(coding_ok)
+    candidates["NoncodingOk"] = candidates.AlignmentId.isin(noncoding_ok)
+    return candidates
+
+
+class GenePredRecord(object):
+    """
+    A genePred line with typed sort fields. The tokens are fixed up once when the record is loaded: the alignment
+    numbers are removed from the name, the unique ID field is set to the Aug/TM alignment ID and the name2 field is
+    set to the gene ID.
+    """
+    __slots__ = ('aln_id', 'chrom', 'start', 'line')
+
+    def __init__(self, line, gene_map):
+        tokens = line.split("\t")
+        self.aln_id = tokens[0]
+        self.chrom = tokens[1]
+        self.start = int(tokens[3])
+        tx_id = remove_alignment_number(remove_augustus_alignment_number(self.aln_id))
+        tokens[0] = tx_id
+        tokens[10] = self.aln_id  # use unique Aug/TM ID as unique identifier
+        tokens[11] = gene_map[tx_id]
+        self.line = "\t".join(tokens)
+
+    def sort_key(self):
+        return self.chrom, self.start
+
+
+def load_sorted_records(gp_paths, gene_map, aln_ids):
+    """
+    Loads the genePred records for aln_ids as GenePredRecords and sorts them once by (chromosome, start).
+    """
+    records = []
+    for p in gp_paths:
+        for line in open(p):
+            if line.split("\t", 1)[0] in aln_ids:
+                records.append(GenePredRecord(line, gene_map))
+    return sorted(records, key=GenePredRecord.sort_key)
+
+
+def make_bins():
+    return {"bestOk": [], "augAltOk": [], "tmAltOk": [], "bestNotOk": [], "augAltNotOk": [], "tmAltNotOk": [],
+            "fail": [], "discarded": [], "tieIds": set()}
+
+
+def group_max(values, groups):
+    """
+    Returns, for every row, the maximum of values over the rows in the same group.
+    """
+    return pd.Series(values).groupby(groups).transform("max").values
+
+
+def label_candidates(candidates):
+    """
+    Labels the non-discarded candidates of every source transcript with their bin. If a source transcript has any OK
+    candidates only those are considered, otherwise its not OK candidates. The winner is the candidate with the highest
+    identity, ties going to the earliest candidate. The remaining candidates are Augustus or transMap alternatives. A
+    transcript is a tie if both an Augustus and a transMap candidate share the best identity (rounded to 6 places), so
+    Augustus ran in two modes (I1 and I2) does not count as a tie. Expects the candidates to be sorted with an integer
+    Group column numbering the source transcripts; returns them in the same order with Label and Tie columns.
+    """
+    groups = candidates.Group.values
+    is_ok = (candidates.Bin == "ok").values
+    tier_ok = group_max(is_ok, groups).astype(bool)
+    in_tier = is_ok == tier_ok
+    tier = candidates[in_tier]
+    groups = groups[in_tier]
+    tier_ok = tier_ok[in_tier]
+    ident = tier.Identity.fillna(-np.inf).values
+    rounded = np.round(ident, 6)
+    is_best = rounded == group_max(rounded, groups)
+    is_aug = tier.AlignmentId.str.startswith("aug").values
+    is_tie = group_max(is_best & is_aug, groups).astype(bool) & group_max(is_best & ~is_aug, groups).astype(bool)
+    # highest identity first, then earliest candidate
+    by_ident = np.lexsort((tier.Order.values, -ident, groups))
+    is_first = np.ones(len(tier), dtype=bool)
+    is_first[1:] = groups[by_ident][1:] != groups[by_ident][:-1]
+    is_winner = np.zeros(len(tier), dtype=bool)
+    is_winner[by_ident[is_first]] = True
+    label = np.where(is_winner, "best", np.where(is_aug, "augAlt", "tmAlt"))
+    return tier.assign(Label=np.core.defchararray.add(label, np.where(tier_ok, "Ok", "NotOk")), Tie=is_tie)
+
+
+def bin_transcripts(candidates, attribute_table, filter_ids, discard_cov_cutoff=0.50, filter_cov_cutoff=0.80):
+    """
+    Bins the candidates for every source transcript of every biotype with grouped operations over the candidate table.
+    Protein coding transcripts use the coding OK flags, everything else the noncoding ones. All candidates must have
+    discard_cov_cutoff coverage or they are discarded. In order to be a OK candidate, a transcript must be classifier OK
+    and have coverage above filter_cov_cutoff. Source transcripts in filter_ids are left out. Returns a dict mapping
+    each biotype to its binned transcripts.
+    """
+    candidates = candidates.join(attribute_table.TranscriptType, on="TranscriptId", how="inner")
+    candidates = candidates[~candidates.TranscriptId.isin(filter_ids)]
+    ok = np.where(candidates.TranscriptType == "protein_coding", candidates.CodingOk, candidates.NoncodingOk)
+    discarded = ~(candidates.Coverage >= discard_cov_cutoff)  # missing coverage is discarded
+    candidates = candidates.assign(Bin=np.where(discarded, "discarded",
+                                                np.where(ok & (candidates.Coverage >= filter_cov_cutoff), "ok",
+                                                         "notOk")),
+                                   Order=np.arange(len(candidates)))
+    candidates = candidates.sort_values(["TranscriptType", "TranscriptId", "Order"])
+    candidates["Group"] = pd.factorize(candidates.TranscriptId)[0]
+    is_discarded = (candidates.Bin == "discarded").values
+    kept = candidates[~is_discarded]
+    labeled = label_candidates(kept)
+    binned = {biotype: make_bins() for biotype in set(attribute_table.TranscriptType)}
+    for (biotype, label), aln_ids in labeled.groupby(["TranscriptType", "Label"], sort=False).AlignmentId:
+        binned[biotype][label] = list(aln_ids)
+    for biotype, tx_ids in labeled[labeled.Tie].drop_duplicates("Group").groupby("TranscriptType").TranscriptId:
+        binned[biotype]["tieIds"] = set(tx_ids)
+    for biotype, aln_ids in candidates[is_discarded].groupby("TranscriptType", sort=False).AlignmentId:
+        binned[biotype]["discarded"] = list(aln_ids)
+    # source transcripts with every candidate discarded, or with no alignments at all, fail
+    all_discarded = candidates[~candidates.Group.isin(kept.Group)].drop_duplicates("Group")
+    for biotype, tx_ids in all_discarded.groupby("TranscriptType", sort=False).TranscriptId:
+        binned[biotype]["fail"] = list(tx_ids)
+    biotypes = attribute_table.TranscriptType
+    no_alignments = biotypes[~biotypes.index.isin(candidates.TranscriptId) & ~biotypes.index.isin(filter_ids)]
+    for biotype, tx_ids in no_alignments.groupby(no_alignments, sort=False):
+        binned[biotype]["fail"].extend(tx_ids.index)
+    return binned
@@ -0,0 +1,55 @@
+"""
+Merges GTF files that are each sorted by chromosome and start position into one sorted GTF, as done for the per-job
+Augustus outputs of augustus/run_augustus.py.
+"""
+import os
+import heapq
+import tempfile
+
+__author__ = "Ian Fiddes"
+
+# most files merged at once; more than this are merged in several passes so that too many files are not held open
+max_merge_files = 500
+
+
+def gtf_sort_key(line):
+    """
+    Sort key for GTF lines: chromosome, then numeric start position.
+    """
+    chrom, _, _, start, _ = line.split("\t", 4)
+    return chrom, int(start)
+
+
+def decorated_gtf_iterator(path):
+    """
+    Yields (sort key, line) tuples for a sorted GTF so that many can be merged with heapq.merge.
+    """
+    with open(path) as inf:
+        for line in inf:
+            yield gtf_sort_key(line), line
+
+
+def merge_sorted_gtfs(paths, out_path):
+    """
+    k-way merges sorted GTF files into out_path.
+    """
+    iterators = [decorated_gtf_iterator(x) for x in paths]
+    with open(out_path, "w") as outf:
+        for _, line in heapq.merge(*iterators):
+            outf.write(line)
+
+
+def merge_many_sorted_gtfs(paths, out_path, tmp_dir, max_files=max_merge_files):
+    """
+    Merges any number of sorted GTF files into out_path. If there are more than max_files, groups of them are first
+    merged into intermediate files in tmp_dir, as many passes as needed.
+    """
+    while len(paths) > max_files:
+        merged = []
+        for i in xrange(0, len(paths), max_files):
+            fd, path = tempfile.mkstemp(dir=tmp_dir, suffix=".gtf")
+            os.close(fd)
+            merge_sorted_gtfs(paths[i:i + max_files], path)
+            merged.append(path)
+        paths = merged
+    merge_sorted_gtfs(paths, out_path)
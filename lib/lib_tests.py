@@ -12,7 +12,20 @@ import subprocess
 import unittest
 import seq_lib
 import psl_lib
+import reference_lib
+import comp_ann_lib
+import cluster_lib
+import attribute_lib
+import comparison_lib
+import sql_lib
+import category_lib
+import augustus.hints_db as hints_db
+import augustus.transmap_2_hints as transmap_2_hints
+import consensus_lib
+import blat_lib
+import gtf_lib
 import random
+import imp
 
 __author__ = "Ian Fiddes"
 
@@ -1475,5 +1488,1028 @@ class ZeroBasepairIntron(unittest.TestCase):
                 self.assertEqual(self.t.chromosome_coordinate_to_transcript(tmp), i)
 
 
+class LazyTranscript(unittest.TestCase):
+    """
+    Tests that the intervals and exons of a Transcript are only built when they are first accessed.
+    """
+    def test_lazy_fields(self):
+        t = seq_lib.Transcript(['chr1', '1', '14', 'A', '0', '+', '7', '14', '0,128,0', '3', '5,4,1', '0,5,12'])
+        self.assertEqual((t.name, t.chromosome, t.start, t.stop), ('A', 'chr1', 1, 14))
+        self.assertIsNone(t._exon_intervals)
+        self.assertIsNone(t._exons)
+        self.assertEqual(len(t), 10)
+        self.assertIsNone(t._exon_intervals)
+        self.assertEqual(t.get_cds_length(), 4)
+        self.assertEqual([(x.start, x.stop) for x in t.intron_intervals], [(6, 6), (10, 13)])
+        self.assertIs(t.exon_intervals, t.exon_intervals)
+        self.assertIsNone(t._exons)
+        self.assertEqual(t.transcript_coordinate_to_chromosome(9), 13)
+        self.assertEqual(len(t.exons), 3)
+
+
+class SequenceNormalization(unittest.TestCase):
+    """
+    Tests complement, reverse_complement and normalize_sequence on soft-masked and IUPAC sequence.
+    """
+    def test_complement(self):
+        self.assertEqual(seq_lib.complement("ATGCatgc"), "TACGtacg")
+        self.assertEqual(seq_lib.complement("NRYKMSWBDHVU"), "NYRMKSWVHDBA")
+
+    def test_reverse_complement(self):
+        self.assertEqual(seq_lib.reverse_complement("AAcgT"), "AcgTT")
+        self.assertEqual(seq_lib.reverse_complement("GNRt"), "aYNC")
+
+    def test_normalize_sequence(self):
+        self.assertEqual(seq_lib.normalize_sequence("acgTNn"), "ACGTNN")
+        self.assertEqual(seq_lib.normalize_sequence("acgTNn", strand=False), "NNACGT")
+        self.assertEqual(seq_lib.normalize_sequence("ggry", strand=False), "RYCC")
+        self.assertEqual(seq_lib.normalize_sequence(bytearray("aacg"), strand=False), bytearray("CGTT"))
+
+    def test_soft_masked_transcript(self):
+        t = seq_lib.GenePredTranscript(['A', 'chr1', '-', '2', '15', '4', '13', '3', '2,7,12', '6,10,15', '1',
+                                        'q2', 'cmpl', 'cmpl', '2,0,0'])
+        tmp = os.path.abspath(makeTempDir())
+        createSequenceFile({"chr1": "gtattcttggacctaa"}, tmp)
+        self.addCleanup(removeDir, tmp)
+        chrom_seq = seq_lib.get_sequence_dict(os.path.join(tmp, "seq.fa"))
+        self.assertEqual(t.get_mrna(chrom_seq), "TAGCCAGAAT")
+        self.assertEqual(t.get_cds(chrom_seq), "GCCAGA")
+        self.assertEqual(t.get_intron_sequences(chrom_seq), ["GT", "A"])
+
+
+class SequenceCache(unittest.TestCase):
+    """
+    Tests the Transcript sequence cache and the global cache budget.
+    """
+    def setUp(self):
+        self.t = seq_lib.GenePredTranscript(['A', 'chr1', '-', '2', '15', '4', '13', '3', '2,7,12', '6,10,15', '1',
+                                             'q2', 'cmpl', 'cmpl', '2,0,0'])
+        tmp = os.path.abspath(makeTempDir())
+        createSequenceFile({"chr1": "gtattcttggacctaa"}, tmp)
+        self.addCleanup(removeDir, tmp)
+        self.addCleanup(seq_lib.set_sequence_cache_budget, None)
+        self.chrom_seq = seq_lib.get_sequence_dict(os.path.join(tmp, "seq.fa"))
+
+    def test_consistent_values(self):
+        self.assertEqual(self.t.get_mrna(self.chrom_seq), "TAGCCAGAAT")
+        self.assertEqual(self.t.get_mrna(self.chrom_seq), "TAGCCAGAAT")
+        self.assertEqual(self.t.get_cds(self.chrom_seq), "GCCAGA")
+        self.assertEqual(self.t.get_cds(self.chrom_seq), "GCCAGA")
+        self.assertEqual(self.t.get_protein_sequence(self.chrom_seq), "AR")
+        self.assertEqual(self.t.get_intron_sequences(self.chrom_seq), ["GT", "A"])
+        self.assertEqual(self.t.get_intron_sequences(self.chrom_seq), ["GT", "A"])
+
+    def test_keyed_by_source(self):
+        other = {"chr1": "CCCCCCCCCCCCCCCC"}
+        self.assertEqual(self.t.get_cds(self.chrom_seq), "GCCAGA")
+        self.assertEqual(self.t.get_cds(other), "GGGGGG")
+        self.assertEqual(self.t.get_cds(self.chrom_seq), "GCCAGA")
+
+    def test_clear(self):
+        seq_dict = {"chr1": "CCCCCCCCCCCCCCCC"}
+        self.assertEqual(self.t.get_cds(seq_dict), "GGGGGG")
+        seq_dict["chr1"] = "AAAAAAAAAAAAAAAA"
+        self.assertEqual(self.t.get_cds(seq_dict), "GGGGGG")
+        self.t.clear_sequence_cache()
+        self.assertEqual(self.t.get_cds(seq_dict), "TTTTTT")
+
+    def test_budget(self):
+        seq_lib.set_sequence_cache_budget(12)
+        self.t.get_mrna(self.chrom_seq)
+        self.t.get_cds(self.chrom_seq)
+        self.assertEqual(len(self.t._sequence_cache), 1)
+        self.assertEqual(seq_lib._sequence_cache_budget.size, 6)
+        self.assertEqual(self.t.get_mrna(self.chrom_seq), "TAGCCAGAAT")
+        self.t.clear_sequence_cache()
+        self.assertEqual(seq_lib._sequence_cache_budget.size, 0)
+
+    def test_cached_before_budget(self):
+        self.t.get_cds(self.chrom_seq)
+        seq_lib.set_sequence_cache_budget(12)
+        self.assertEqual(self.t.get_cds(self.chrom_seq), "GCCAGA")
+        self.assertEqual(seq_lib._sequence_cache_budget.size, 0)
+
+    def test_source_key_holds_source(self):
+        key = seq_lib.sequence_source_key({"chr1": "CCCCCCCCCCCCCCCC"})
+        self.assertEqual(key.source, {"chr1": "CCCCCCCCCCCCCCCC"})
+        self.assertNotEqual(key, seq_lib.sequence_source_key({"chr1": "CCCCCCCCCCCCCCCC"}))
+        self.assertEqual(key, seq_lib.sequence_source_key(key.source))
+
+
+class ReferenceStore(unittest.TestCase):
+    """
+    Tests the precomputed reference properties in reference_lib using the negative strand genePred transcript.
+    """
+    def setUp(self):
+        self.t = seq_lib.GenePredTranscript(['A', 'chr1', '-', '2', '15', '4', '13', '3', '2,7,12', '6,10,15', '1',
+                                             'q2', 'cmpl', 'cmpl', '2,0,0'])
+        self.tmp = os.path.abspath(makeTempDir())
+        createSequenceFile({"chr1": "GTATTCTTGGACCTAA"}, self.tmp)
+        self.chrom_seq = seq_lib.get_sequence_dict(os.path.join(self.tmp, "seq.fa"))
+        self.addCleanup(removeDir, self.tmp)
+
+    def test_reference_transcript(self):
+        r = reference_lib.ReferenceTranscript(self.t, self.chrom_seq)
+        self.assertEqual(r.name, "A")
+        self.assertEqual(r.intron_intervals, [(6, 7), (10, 12)])
+        self.assertEqual(r.splice_sites, {(6, 7): ("A", "A"), (10, 12): ("GT", "GT")})
+        self.assertEqual(r.cds, "GCCAGA")
+        self.assertEqual(r.cds_length, 6)
+        self.assertEqual(r.start_codon, "GCC")
+        self.assertEqual(r.stop_codon, "AGA")
+
+    def test_store_round_trip(self):
+        store_path = os.path.join(self.tmp, "A.reference.pickle")
+        reference_lib.write_reference_dict({"A": reference_lib.ReferenceTranscript(self.t, self.chrom_seq)},
+                                           store_path)
+        r = reference_lib.load_reference_dict(store_path)["A"]
+        self.assertEqual(r.splice_sites, {(6, 7): ("A", "A"), (10, 12): ("GT", "GT")})
+        self.assertEqual(r.stop_codon, "AGA")
+
+
+class AttributeTable(unittest.TestCase):
+    """
+    Tests parsing and caching the gencode attributes file.
+    """
+    def setUp(self):
+        self.tmp = os.path.abspath(makeTempDir())
+        self.addCleanup(removeDir, self.tmp)
+        self.attr_path = os.path.join(self.tmp, "attrs.tsv")
+        with open(self.attr_path, "w") as outf:
+            outf.write("GeneId\tGeneName\tGeneType\tTranscriptId\tTranscriptType\n")
+            outf.write("G1\tA\tprotein_coding\tT1\tprotein_coding\n")
+            outf.write("G1\tA\tprotein_coding\tT2\tretained_intron\n")
+            outf.write("G2\tB\tlincRNA\tT3\tlincRNA\n")
+
+    def test_indexes(self):
+        table = attribute_lib.parse_attribute_file(self.attr_path)
+        self.assertEqual(len(table), 3)
+        self.assertNotIn("TranscriptId", table)
+        self.assertEqual(table.get_biotypes(), {"protein_coding", "retained_intron", "lincRNA"})
+        self.assertEqual(table.get_transcript_ids("protein_coding"), {"T1"})
+        self.assertEqual(table.get_transcript_ids(), {"T1", "T2", "T3"})
+        self.assertEqual(table.get_gene_ids("lincRNA"), {"G2"})
+        self.assertEqual(table.get_transcript_ids("snoRNA"), set())
+        self.assertEqual(table.get_gene_map(), {"T1": "G1", "T2": "G1", "T3": "G2"})
+        self.assertEqual(table.get_gene_biotype_map(), {"G1": "protein_coding", "G2": "lincRNA"})
+        self.assertEqual(table.get_attribute("T2").transcript_type, "retained_intron")
+        self.assertEqual(table.to_frame().loc["T3", "GeneName"], "B")
+
+    def test_cache(self):
+        table = attribute_lib.load_attribute_table(self.attr_path)
+        self.assertIs(attribute_lib.load_attribute_table(self.attr_path), table)
+        cache_path = attribute_lib.get_attribute_cache_path(self.attr_path)
+        self.assertTrue(os.path.exists(cache_path))
+        del attribute_lib._tables[cache_path]
+        cached = attribute_lib.load_attribute_table(self.attr_path)
+        self.assertIsNot(cached, table)
+        self.assertEqual(cached.get_gene_map(), table.get_gene_map())
+        self.assertEqual(cached.get_transcript_ids("protein_coding"), {"T1"})
+        # strings are interned again when loaded from the cache
+        self.assertIs(cached.gene_ids[0], cached.gene_ids[1])
+        self.assertIs(cached.transcript_ids[0], intern("T1"))
+
+    def test_changed_file(self):
+        table = attribute_lib.load_attribute_table(self.attr_path)
+        with open(self.attr_path, "a") as outf:
+            outf.write("G3\tC\tsnoRNA\tT4\tsnoRNA\n")
+        s = os.stat(self.attr_path)
+        os.utime(self.attr_path, (s.st_atime, s.st_mtime + 10))
+        changed = attribute_lib.load_attribute_table(self.attr_path)
+        self.assertIsNot(changed, table)
+        self.assertEqual(changed.get_transcript_ids("snoRNA"), {"T4"})
+        # the cache of the old file is removed
+        caches = [x for x in os.listdir(self.tmp) if x.endswith(".pickle")]
+        self.assertEqual(caches, [os.path.basename(attribute_lib.get_attribute_cache_path(self.attr_path))])
+
+
+class CoordinateComparison(unittest.TestCase):
+    """
+    Tests comparing two genePred transcripts on the same genome in chromosome coordinates. b has a shorter second exon
+    so the second part of its CDS is out of frame with a.
+    """
+    def setUp(self):
+        self.a = seq_lib.GenePredTranscript(['a', 'chr1', '+', '2', '14', '3', '12', '2', '2,8', '6,14', '0', 'q2',
+                                             'cmpl', 'cmpl', '0,0'])
+        self.b = seq_lib.GenePredTranscript(['b', 'chr1', '+', '2', '14', '3', '12', '2', '2,9', '6,14', '0', 'q2',
+                                             'cmpl', 'cmpl', '0,0'])
+
+    def test_sorted_interval_intersections(self):
+        r = list(seq_lib.sorted_interval_intersections(self.a.exon_intervals, self.b.exon_intervals))
+        self.assertEqual(r, [(2, 6), (9, 14)])
+        self.assertEqual(list(seq_lib.sorted_interval_intersections(self.a.exon_intervals, [])), [])
+
+    def test_comparison(self):
+        c = comp_ann_lib.compare_transcript_coordinates(self.a, self.b)
+        self.assertEqual([c.size_a, c.size_b, c.shared, c.shared_cds, c.shared_cds_in_frame], [10, 9, 9, 6, 3])
+        self.assertAlmostEqual(c.exon_overlap(), 0.9)
+        self.assertAlmostEqual(c.frame_agreement(), 0.5)
+
+    def test_different_strand(self):
+        b = seq_lib.GenePredTranscript(['b', 'chr1', '-', '2', '14', '3', '12', '2', '2,9', '6,14', '0', 'q2',
+                                        'cmpl', 'cmpl', '0,0'])
+        c = comp_ann_lib.compare_transcript_coordinates(self.a, b)
+        self.assertEqual(c.shared, 0)
+        self.assertEqual(c.shared_cds, 0)
+
+
+class IntervalSweeps(unittest.TestCase):
+    """
+    Tests the sorted-sweep interval comparisons against the pairwise versions.
+    """
+    def setUp(self):
+        self.a = [seq_lib.ChromosomeInterval('chr1', x, y, True) for x, y in [(0, 10), (20, 30), (100, 150)]]
+        self.b = [seq_lib.ChromosomeInterval('chr1', x, y, True) for x, y in [(5, 8), (12, 18), (40, 60), (95, 160)]]
+
+    def test_gap_merge(self):
+        merged = seq_lib.gap_merge_intervals(self.b, gap=4)
+        self.assertEqual([(x.start, x.stop) for x in merged], [(5, 18), (40, 60), (95, 160)])
+        self.assertEqual((self.b[0].start, self.b[0].stop), (5, 8))
+
+    def test_not_intersecting(self):
+        for query, target in [(self.a, self.b), (self.b, self.a)]:
+            expected = [x for x in query if seq_lib.interval_not_intersect_intervals(target, x)]
+            self.assertEqual(list(seq_lib.intervals_not_intersecting(query, target)), expected)
+        self.assertEqual(list(seq_lib.intervals_not_intersecting(self.a, [])), self.a)
+
+    def test_not_within_wiggle_room(self):
+        for wiggle_room in [0, 5, 10, 30]:
+            for query, target in [(self.a, self.b), (self.b, self.a)]:
+                expected = [x for x in query if
+                            seq_lib.interval_not_within_wiggle_room_intervals(target, x, wiggle_room)]
+                self.assertEqual(list(seq_lib.intervals_not_within_wiggle_room(query, target, wiggle_room)),
+                                 expected)
+
+
+class AugustusPairs(unittest.TestCase):
+    """
+    Tests joining Augustus transcripts to their transMap transcripts.
+    """
+    def test_build_augustus_pairs(self):
+        def make_gp(name, strand):
+            return seq_lib.GenePredTranscript([name, 'chr1', strand, '2', '14', '3', '12', '2', '2,8', '6,14', '0',
+                                               'q2', 'cmpl', 'cmpl', '0,0'])
+        tm = {x.name: x for x in [make_gp('A.1-1', '+'), make_gp('A.1-2', '-')]}
+        aug = [make_gp('augI1-A.1-1', '+'), make_gp('augI1-2-A.1-1', '+'), make_gp('augI1-A.1-2', '+'),
+               make_gp('augI2-A.1-1', '+'), make_gp('augI1-B.1-1', '+')]
+        pairs = {p.aug_aId: p for p in comp_ann_lib.build_augustus_pairs(aug, tm)}
+        self.assertEqual(pairs['augI1-A.1-1'].aId, 'A.1-1')
+        self.assertTrue(pairs['augI1-A.1-1'].same_locus)
+        self.assertFalse(pairs['augI1-A.1-2'].same_locus)
+        self.assertIsNone(pairs['augI1-B.1-1'].t)
+        self.assertFalse(pairs['augI1-B.1-1'].same_locus)
+        self.assertEqual(pairs['augI1-2-A.1-1'].aId, 'A.1-1')
+        c = pairs['augI1-A.1-1'].comparison()
+        self.assertIs(pairs['augI1-A.1-1'].comparison(), c)
+        self.assertEqual([c.shared, c.exon_overlap()], [10, 1.0])
+        # copies are counted per mode and alignment, not over the alignments of a source transcript
+        self.assertEqual([pairs[x].copies for x in ['augI1-A.1-1', 'augI1-2-A.1-1', 'augI1-A.1-2', 'augI2-A.1-1',
+                                                    'augI1-B.1-1']],
+                         [2, 2, 1, 1, 1])
+
+
+def reference_ward_d(distances, n):
+    """
+    Naive agglomerative clustering with the Lance-Williams Ward update applied to the distances as given, which is
+    what R's hclust(method="ward.D") does. Returns a list of (merged leaves, height) in merge order.
+    """
+    from scipy.spatial.distance import squareform
+    d = squareform(distances)
+    clusters = {frozenset([i]): i for i in xrange(n)}
+    dist = {}
+    for a in clusters:
+        for b in clusters:
+            if a != b:
+                dist[frozenset([a, b])] = d[clusters[a], clusters[b]]
+    merges = []
+    while len(clusters) > 1:
+        pair, height = min(dist.iteritems(), key=lambda x: x[1])
+        i, j = pair
+        del clusters[i], clusters[j]
+        merged = i | j
+        for k in clusters:
+            ni, nj, nk = len(i), len(j), len(k)
+            dist[frozenset([merged, k])] = ((ni + nk) * dist[frozenset([i, k])] + (nj + nk) * dist[frozenset([j, k])] -
+                                            nk * height) / (ni + nj + nk)
+        dist = {key: v for key, v in dist.iteritems() if i not in key and j not in key}
+        clusters[merged] = None
+        merges.append((merged, height))
+    return merges
+
+
+class ClassifierClustering(unittest.TestCase):
+    """
+    Tests the weighted binary distances used to cluster classifiers.
+    """
+    def test_matches_pairwise_jaccard(self):
+        import numpy as np
+        from scipy.spatial.distance import pdist
+        m = np.random.RandomState(0).rand(500, 6) < 0.3
+        m[:, 5] = m[:, 0]
+        patterns, counts = cluster_lib.pack_patterns(m)
+        self.assertEqual(counts.sum(), 500)
+        self.assertLessEqual(len(patterns), 64)
+        d = cluster_lib.weighted_jaccard_distances(patterns, counts, m.shape[1])
+        self.assertTrue(np.allclose(d, pdist(m.T, "jaccard")))
+        self.assertEqual(d[4], 0.0)
+        self.assertEqual(cluster_lib.cluster_columns(m).shape, (5, 4))
+
+    def test_ward_d(self):
+        """
+        cluster_columns must build the same tree, with the same merge heights, as R's ward.D on the binary distances.
+        """
+        import numpy as np
+        m = np.random.RandomState(1).rand(300, 7) < np.linspace(0.1, 0.6, 7)
+        patterns, counts = cluster_lib.pack_patterns(m)
+        d = cluster_lib.weighted_jaccard_distances(patterns, counts, m.shape[1])
+        expected = reference_ward_d(d, m.shape[1])
+        z = cluster_lib.cluster_columns(m)
+        clusters = [frozenset([i]) for i in xrange(m.shape[1])]
+        merges = []
+        for a, b, height, size in z:
+            clusters.append(clusters[int(a)] | clusters[int(b)])
+            self.assertEqual(len(clusters[-1]), size)
+            merges.append((clusters[-1], height))
+        self.assertEqual([x[0] for x in merges], [x[0] for x in expected])
+        self.assertTrue(np.allclose([x[1] for x in merges], [x[1] for x in expected]))
+
+
+class GenomeMatrix(unittest.TestCase):
+    """
+    Tests cross-genome queries over the best alignment of each source transcript.
+    """
+    def setUp(self):
+        import pandas as pd
+        rows = [["g1", "A", "protein_coding", "A-1", 1.0, 1.0, 1],
+                ["g2", "A", "protein_coding", "A-2", 0.9, 0.8, 0],
+                ["g3", "A", "protein_coding", "A-1", 1.0, 0.9, 1],
+                ["g1", "B", "lincRNA", "B-1", 0.99, 1.0, 1],
+                ["g3", "B", "lincRNA", "B-1", 0.5, 0.6, 0]]
+        df = pd.DataFrame(rows, columns=["Genome", "TranscriptId", "TranscriptType", "AlignmentId",
+                                         "AlignmentIdentity", "AlignmentCoverage", "Ok"])
+        self.m = comparison_lib.GenomeMatrix(df)
+
+    def test_matrix(self):
+        self.assertEqual(self.m.genomes, ["g1", "g2", "g3"])
+        self.assertEqual(list(self.m.ok_counts()), [2, 1])
+        self.assertEqual(self.m.ok[self.m.transcript_index["B"], 1], comparison_lib.no_alignment)
+
+    def test_queries(self):
+        self.assertEqual(self.m.transcripts_ok_in(2), {"A"})
+        self.assertEqual(self.m.transcripts_ok_in(1, biotype="lincRNA"), {"B"})
+        self.assertEqual(self.m.transcripts_ok_in(1, genomes=["g2", "g3"]), {"A"})
+        self.assertEqual(self.m.transcripts_not_ok_in(genomes=["g2", "g3"]), {"B"})
+        self.assertEqual(self.m.failing_genomes("B"), ["g2", "g3"])
+        self.assertEqual(self.m.best_alignments("g2"), {"A": ("A-2", 0.9, 0.8)})
+        self.assertEqual(self.m.not_ok_alignments("g3"), {"B-1"})
+        self.assertEqual(self.m.not_ok_alignments("g3", biotype="protein_coding"), set())
+
+
+
+class BestAlignments(unittest.TestCase):
+    """
+    Tests materializing the best alignment per source transcript from an attributes database.
+    """
+    def setUp(self):
+        import sqlite3
+        self.tmp = os.path.abspath(makeTempDir())
+        self.addCleanup(removeDir, self.tmp)
+        self.attr_path = os.path.join(self.tmp, "attributes.db")
+        self.best_path = os.path.join(self.tmp, "bestAlignments.db")
+        con = sqlite3.connect(self.attr_path)
+        for genome in ["g1", "g2"]:
+            con.execute("CREATE TABLE '{}' (AlignmentId TEXT PRIMARY KEY, TranscriptId TEXT, AlignmentIdentity REAL, "
+                        "AlignmentCoverage REAL)".format(genome))
+        con.executemany("INSERT INTO g1 VALUES (?, ?, ?, ?)", [["A-1", "A", 0.9, 0.5], ["A-2", "A", 0.8, 0.9],
+                                                              ["A-3", "A", 1.0, 0.9], ["B-1", "B", 1.0, 1.0]])
+        con.executemany("INSERT INTO g2 VALUES (?, ?, ?, ?)", [["A-1", "A", 0.7, 0.7]])
+        con.commit()
+        con.close()
+
+    def get_rows(self, genome):
+        import sqlite3
+        con = sqlite3.connect(self.best_path)
+        rows = con.execute("SELECT * FROM '{}' ORDER BY TranscriptId".format(genome)).fetchall()
+        con.close()
+        return [list(x) for x in rows]
+
+    def test_best_alignments(self):
+        sql_lib.write_best_alignments(self.attr_path, self.best_path, "g1")
+        self.assertEqual(self.get_rows("g1"), [["A", "A-2", 0.8, 0.9, 3], ["B", "B-1", 1.0, 1.0, 1]])
+
+    def test_incremental(self):
+        sql_lib.write_best_alignments(self.attr_path, self.best_path, "g1")
+        sql_lib.write_best_alignments(self.attr_path, self.best_path, "g2")
+        sql_lib.write_best_alignments(self.attr_path, self.best_path, "g2")
+        self.assertEqual(self.get_rows("g2"), [["A", "A-1", 0.7, 0.7, 1]])
+        self.assertEqual(len(self.get_rows("g1")), 2)
+
+    def test_construct_tables(self):
+        """
+        Builds an attributes table the way ConstructDatabases does and materializes its best alignments.
+        """
+        attr_path = os.path.join(self.tmp, "constructed.db")
+        columns = [["TranscriptId", "TEXT"], ["AlignmentIdentity", "REAL"], ["AlignmentCoverage", "REAL"]]
+        for _ in xrange(2):
+            with sql_lib.ExclusiveSqlConnection(attr_path) as cur:
+                sql_lib.initializeTable(cur, "g1", columns, "AlignmentId", drop_if_exists=True)
+                sql_lib.insertRows(cur, "g1", "AlignmentId", ["AlignmentId"], [("A-1",), ("A-2",)])
+                sql_lib.updateRows(cur, "g1", "AlignmentId", "TranscriptId", [("A", "A-1"), ("A", "A-2")])
+                sql_lib.updateRows(cur, "g1", "AlignmentId", "AlignmentIdentity", [(0.9, "A-1"), (1.0, "A-2")])
+                sql_lib.updateRows(cur, "g1", "AlignmentId", "AlignmentCoverage", [(0.8, "A-1"), (0.95, "A-2")])
+        sql_lib.write_best_alignments(attr_path, self.best_path, "g1")
+        self.assertEqual(self.get_rows("g1"), [["A", "A-2", 1.0, 0.95, 2]])
+
+
+
+class QueryBuilder(unittest.TestCase):
+    """
+    Tests compiling category tuples into parameterized queries between a classify and a details database.
+    """
+    def setUp(self):
+        import sqlite3
+        self.tmp = os.path.abspath(makeTempDir())
+        self.addCleanup(removeDir, self.tmp)
+        self.con = sqlite3.connect(os.path.join(self.tmp, "classify.db"))
+        self.addCleanup(self.con.close)
+        sql_lib.attach_database(self.con, os.path.join(self.tmp, "details.db"), "details")
+        self.cur = self.con.cursor()
+        self.cur.execute("CREATE TABLE main.'g-1' (AlignmentId TEXT, A INTEGER, B INTEGER, C INTEGER)")
+        self.cur.execute("CREATE TABLE details.'g-1' (AlignmentId TEXT, A TEXT, B TEXT, C TEXT)")
+        self.cur.executemany("INSERT INTO main.'g-1' VALUES (?, ?, ?, ?)", [["x", 1, 0, 0], ["y", 0, 1, 1],
+                                                                          ["z", 0, 0, 0]])
+        self.cur.executemany("INSERT INTO details.'g-1' VALUES (?, ?, ?, ?)", [["x", "xa", None, None],
+                                                                             ["y", None, "yb", "yc"],
+                                                                             ["z", None, None, None]])
+
+    def test_compile_where(self):
+        self.assertEqual(sql_lib.compile_where(["A", "B"], ["OR"]), "((main.{genome}.A = ? OR main.{genome}.B = ?))")
+        self.assertRaises(AssertionError, sql_lib.compile_where, ["A", "B"], [])
+
+    def test_select_between_databases(self):
+        r = sql_lib.select_between_databases(self.cur, "details", "A", ["A", "B"], [1, 1], ["OR"], "AlignmentId",
+                                             "g-1")
+        self.assertEqual(sorted(r), [(None,), ("xa",)])
+        # operations apply left to right, (A = 0 OR B = 1) AND C = 1
+        r = sql_lib.select_between_databases(self.cur, "details", "AlignmentId", ["A", "B", "C"], [0, 1, 1],
+                                             ["OR", "AND"], "AlignmentId", "g-1")
+        self.assertEqual(sorted(r), [("y",)])
+
+    def test_cached(self):
+        q = sql_lib.compile_query([("main", "AlignmentId")], ["main"], ["A"], [], name="test_cached")
+        self.assertIs(sql_lib.compile_query([("main", "AlignmentId")], ["main"], ["A"], [], name="test_cached"), q)
+        self.assertEqual(list(q.execute(self.cur, "g-1", [0], size=1)), [("y",), ("z",)])
+        self.assertEqual(sql_lib.query_timings["test_cached"][0], 1)
+
+
+
+class CategoryPredicates(unittest.TestCase):
+    """
+    Tests compiling category tuples into expression trees and evaluating them over packed classify matrices.
+    """
+    def setUp(self):
+        nan = float("nan")
+        # 70 rows so that the masks span more than one 64 bit word
+        self.aln_ids = ["x", "y", "z", "n"] + ["r{}".format(i) for i in xrange(66)]
+        values = [[1, 0, 0], [0, 1, 1], [0, 0, 0], [nan, 1, 0]] + [[0, 0, 1]] * 66
+        self.m = category_lib.ClassifyMatrix(self.aln_ids, ["A", "B", "C"], values)
+
+    def test_left_to_right(self):
+        tree = category_lib.compile_category(["A", "B", "C"], [0, 1, 1], ["OR", "AND"])
+        self.assertEqual(tree.fields(), {"A", "B", "C"})
+        self.assertEqual(tree.to_sql("t"), "((t.A = ? OR t.B = ?) AND t.C = ?)")
+        self.assertEqual(self.m.select(tree), {"y"} | set(self.aln_ids[4:]))
+
+    def test_null(self):
+        # a NULL comparison is never true, but does not stop an OR from being true
+        self.assertIn("n", self.m.select(category_lib.compile_category(["A", "B"], [1, 1], ["OR"])))
+        self.assertNotIn("n", self.m.select(category_lib.compile_category(["A"], [0], [])))
+        self.assertNotIn("n", self.m.select(category_lib.compile_category(["A"], [1], [])))
+
+    def test_categorize(self):
+        categories = {"a": category_lib.compile_category(["A"], [1], []),
+                      "bc": category_lib.compile_category(["B", "C"], [1, 1], ["AND"])}
+        self.assertEqual(category_lib.categorize(self.m, categories), {"a": {"x"}, "bc": {"y"}})
+
+    def test_load(self):
+        import sqlite3
+        con = sqlite3.connect(":memory:")
+        con.execute("CREATE TABLE g (AlignmentId TEXT, A INTEGER, B INTEGER)")
+        con.executemany("INSERT INTO g VALUES (?, ?, ?)", [["x", 1, None], ["y", 0, 1]])
+        categories = {"a": category_lib.compile_category(["A", "B"], [1, 1], ["OR"])}
+        m = category_lib.load_classify_matrix(con.cursor(), "g", categories)
+        self.assertEqual(category_lib.categorize(m, categories), {"a": {"x", "y"}})
+
+
+
+class HintsDatabase(unittest.TestCase):
+    """
+    Tests the pooled hints database access layer against the original per-window query on a small hints database.
+    """
+    per_window_query = """select source,typename,start,end,score,strand,frame,priority,grp,mult,esource
+      FROM hints,featuretypes
+      WHERE hints.speciesid IN (SELECT speciesid FROM speciesnames WHERE speciesname="{genome}")
+             AND seqnr IN (SELECT seqnr FROM seqnames WHERE speciesid IN (SELECT speciesid FROM speciesnames WHERE
+             speciesname="{genome}") AND seqname="{chrom}")
+             AND start >= {start} AND end <= {stop} AND typeid=type"""
+
+    def setUp(self):
+        import sqlite3
+        self.tmp = os.path.abspath(makeTempDir())
+        self.addCleanup(removeDir, self.tmp)
+        self.addCleanup(hints_db.close_connections)
+        self.path = os.path.join(self.tmp, "hints.db")
+        con = sqlite3.connect(self.path)
+        con.execute("CREATE TABLE speciesnames (speciesid INTEGER, speciesname TEXT)")
+        con.execute("CREATE TABLE seqnames (seqnr INTEGER, speciesid INTEGER, seqname TEXT)")
+        con.execute("CREATE TABLE featuretypes (typeid INTEGER, typename TEXT)")
+        con.execute("CREATE TABLE hints (speciesid INTEGER, seqnr INTEGER, source TEXT, start INTEGER, end INTEGER, "
+                    "score REAL, type INTEGER, strand TEXT, frame TEXT, priority INTEGER, grp TEXT, mult INTEGER, "
+                    "esource TEXT)")
+        con.executemany("INSERT INTO speciesnames VALUES (?, ?)", [[1, "g1"], [2, "g2"]])
+        con.executemany("INSERT INTO seqnames VALUES (?, ?, ?)", [[1, 1, "chr1"], [2, 1, "chr2"], [3, 2, "chr1"]])
+        con.executemany("INSERT INTO featuretypes VALUES (?, ?)", [[0, "exonpart"], [1, "intron"]])
+        random.seed(1)
+        hints = []
+        for _ in xrange(500):
+            speciesid, seqnr = random.choice([[1, 1], [1, 2], [2, 3]])
+            start = random.randint(0, 10000)
+            hints.append([speciesid, seqnr, "b2h", start, start + random.randint(0, 300), random.random(),
+                          random.randint(0, 1), random.choice("+-."), ".", 4, "", random.randint(1, 5), "E"])
+        con.executemany("INSERT INTO hints VALUES ({})".format(", ".join(["?"] * 13)), hints)
+        con.commit()
+        con.close()
+
+    def test_pooled(self):
+        self.assertIs(hints_db.get_connection(self.path), hints_db.get_connection(self.path))
+        self.assertIsNone(hints_db.get_species_id(self.path, "g3"))
+        self.assertEqual(hints_db.get_seqnrs(self.path, "g1"), {"chr1": 1, "chr2": 2})
+
+    def test_index(self):
+        self.assertFalse(hints_db.has_hints_index(self.path))
+        hints_db.create_hints_index(self.path)
+        self.assertTrue(hints_db.has_hints_index(self.path))
+
+    def test_batch_matches_per_window(self):
+        import sqlite3
+        hints_db.create_hints_index(self.path)
+        windows = [("chr1", 0, 2000), ("chr2", 1500, 6000), ("chr1", 1000, 3000), ("chrUn", 0, 10000),
+                   ("chr1", 9000, 20000)]
+        con = sqlite3.connect(self.path)
+        for genome in ["g1", "g2", "g3"]:
+            batch = hints_db.get_hints_batch(self.path, genome, windows)
+            for (chrom, start, stop), rows in zip(windows, batch):
+                cmd = self.per_window_query.format(genome=genome, chrom=chrom, start=start, stop=stop)
+                self.assertEqual(sorted(rows), sorted(con.execute(cmd).fetchall()))
+        self.assertGreater(sum(len(x) for x in hints_db.get_hints_batch(self.path, "g1", windows)), 0)
+        con.close()
+
+
+
+def which(program):
+    """
+    Returns the path to program on the PATH, or None.
+    """
+    for d in os.environ.get("PATH", "").split(os.pathsep):
+        path = os.path.join(d, program)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+def random_gene_pred(name, chrom, rnd):
+    """
+    Builds a random genePred line with short and long gaps, tiny exons, UTRs on either side or none, and noncoding
+    records.
+    """
+    start = rnd.randint(0, 5000)
+    starts, ends = [], []
+    pos = start
+    for _ in xrange(rnd.randint(1, 8)):
+        size = rnd.choice([1, 2, 3, rnd.randint(4, 40), rnd.randint(40, 400)])
+        starts.append(pos)
+        ends.append(pos + size)
+        pos += size + rnd.choice([rnd.randint(1, 20), rnd.randint(20, 100), rnd.randint(100, 2000)])
+    tx_start, tx_end = starts[0], ends[-1]
+    kind = rnd.randint(0, 3)
+    if kind == 0:
+        cds_start = cds_end = tx_end
+    elif kind == 1:
+        cds_start, cds_end = tx_start, tx_end
+    else:
+        cds_start, cds_end = sorted([rnd.randint(tx_start, tx_end), rnd.randint(tx_start, tx_end)])
+    frames = ",".join(["0"] * len(starts)) + ","
+    return "\t".join(map(str, [name, chrom, rnd.choice("+-"), tx_start, tx_end, cds_start, cds_end, len(starts),
+                                ",".join(map(str, starts)) + ",", ",".join(map(str, ends)) + ",", 0, name,
+                                "cmpl", "cmpl", frames]))
+
+
+class TransMapHintsPort(unittest.TestCase):
+    """
+    Compares the transMap2hints.pl port against the Perl script on a random genePred corpus, byte for byte.
+    """
+    perl_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "augustus", "transMap2hints.pl")
+
+    def setUp(self):
+        if which("perl") is None:
+            self.skipTest("perl is not installed")
+        self.tmp = os.path.abspath(makeTempDir())
+        self.addCleanup(removeDir, self.tmp)
+        rnd = random.Random(5)
+        lines = [random_gene_pred("T{}-{}".format(i, rnd.randint(1, 3)), chrom, rnd) for chrom in ["chr1", "chr2"]
+                 for i in xrange(150)]
+        # sorted by chromosome and position, as the pipeline feeds it
+        lines.sort(key=lambda l: (l.split("\t")[1], int(l.split("\t")[3])))
+        self.lines = lines
+        self.gp_path = os.path.join(self.tmp, "tm.gp")
+        with open(self.gp_path, "w") as outf:
+            outf.write("\n".join(lines) + "\n")
+
+    def run_perl(self, params):
+        out_path = os.path.join(self.tmp, "hints.gff")
+        cmd = ["perl", self.perl_script, "--in={}".format(self.gp_path), "--out={}".format(out_path)]
+        cmd.extend("--{}={}".format(k, v) for k, v in sorted(params.iteritems()))
+        with open(os.devnull, "w") as devnull:
+            subprocess.check_call(cmd, stdout=devnull)
+        return open(out_path).read()
+
+    def run_port(self, params):
+        gps = [seq_lib.GenePredTranscript(l.split("\t")) for l in self.lines]
+        return "".join(transmap_2_hints.transmap_2_hints(gps, **params))
+
+    def test_pipeline_params(self):
+        self.assertEqual(self.run_port(transmap_2_hints.pipeline_params),
+                         self.run_perl(transmap_2_hints.pipeline_params))
+
+    def test_defaults(self):
+        expected = self.run_perl({})
+        self.assertGreater(len(expected), 0)
+        self.assertEqual(self.run_port({}), expected)
+
+
+
+def reference_bin_transcripts(candidates, attribute_table, filter_ids, discard_cov_cutoff=0.50, filter_cov_cutoff=0.80):
+    """
+    The per source transcript binning that consensus_lib.bin_transcripts replaced, kept to check the grouped version
+    against.
+    """
+    import itertools
+    import re
+    import numpy as np
+    strip = lambda x: psl_lib.remove_alignment_number(psl_lib.remove_augustus_alignment_number(x))
+    stats_dict = {a: [a, i, c] for a, i, c in zip(candidates.AlignmentId, candidates.Identity, candidates.Coverage)}
+    candidates = candidates.join(attribute_table.TranscriptType, on="TranscriptId", how="inner")
+    candidates = candidates[~candidates.TranscriptId.isin(filter_ids)]
+    ok = np.where(candidates.TranscriptType == "protein_coding", candidates.CodingOk, candidates.NoncodingOk)
+    discarded = ~(candidates.Coverage >= discard_cov_cutoff)
+    candidates = candidates.assign(Bin=np.where(discarded, "discarded",
+                                                np.where(ok & (candidates.Coverage >= filter_cov_cutoff), "ok",
+                                                         "notOk")),
+                                   Order=np.arange(len(candidates)))
+    candidates = candidates.sort_values(["TranscriptType", "TranscriptId", "Order"])
+    binned = {biotype: consensus_lib.make_bins() for biotype in set(attribute_table.TranscriptType)}
+    seen = set()
+    rows = itertools.izip(candidates.TranscriptType, candidates.TranscriptId, candidates.AlignmentId, candidates.Bin)
+    for (biotype, ens_id), group in itertools.groupby(rows, key=lambda x: x[:2]):
+        tiers = {"ok": [], "notOk": []}
+        for _, _, aln_id, b in group:
+            if b == "discarded":
+                binned[biotype]["discarded"].append(aln_id)
+            else:
+                tiers[b].append(stats_dict[aln_id])
+        seen.add(ens_id)
+        if len(tiers["ok"]) == len(tiers["notOk"]) == 0:
+            binned[biotype]["fail"].append(ens_id)
+            continue
+        tier, suffix = (tiers["ok"], "Ok") if len(tiers["ok"]) > 0 else (tiers["notOk"], "NotOk")
+        s = sorted(tier, key=lambda x: -x[1])
+        winner_ids = [x[0] for x in s if round(x[1], 6) == round(s[0][1], 6)]
+        binned[biotype]["best" + suffix].append(winner_ids[0])
+        for aln_id, _, _ in tier:
+            if aln_id != winner_ids[0]:
+                binned[biotype][("augAlt" if aln_id.startswith("aug") else "tmAlt") + suffix].append(aln_id)
+        # as in the original, x[0] is the first character of the alignment ID
+        if len({"-".join(re.split("I[1-2]-", x[0])) for x in winner_ids}) > 1:
+            binned[biotype]["tieIds"].add(strip(winner_ids[0]))
+    for ens_id, biotype in attribute_table.TranscriptType.iteritems():
+        if ens_id not in seen and ens_id not in filter_ids:
+            binned[biotype]["fail"].append(ens_id)
+    return binned
+
+
+def random_candidates(rnd):
+    """
+    Builds a random candidate table and attribute table with Augustus ran in one or two modes, identity ties and
+    coverage on both sides of the cutoffs.
+    """
+    import pandas as pd
+    tx_ids = ["T{}".format(i) for i in xrange(40)]
+    attribute_table = pd.DataFrame({"TranscriptId": tx_ids, "GeneId": ["G{}".format(i // 3) for i in xrange(40)],
+                                    "TranscriptType": [rnd.choice(["protein_coding", "lincRNA"]) for _ in tx_ids]})
+    attribute_table = attribute_table.set_index("TranscriptId")
+    aug, tm = [], []
+    for tx_id in tx_ids[:36]:
+        for k in xrange(1, rnd.randint(0, 3) + 1):
+            if rnd.random() < 0.5:
+                aug.extend(["augI1-{}-{}".format(tx_id, k), "augI2-{}-{}".format(tx_id, k)])
+            tm.append("{}-{}".format(tx_id, k))
+    aln_ids = aug + tm
+    candidates = pd.DataFrame({"AlignmentId": aln_ids,
+                               "Identity": [rnd.choice([0.9, 0.95, 1.0, 0.9999999]) for _ in aln_ids],
+                               "Coverage": [rnd.choice([0.3, 0.6, 0.85, 0.99, None]) for _ in aln_ids],
+                               "CodingOk": [rnd.random() < 0.5 for _ in aln_ids],
+                               "NoncodingOk": [rnd.random() < 0.5 for _ in aln_ids]})
+    candidates["TranscriptId"] = [x.split("-")[-2] for x in aln_ids]
+    return candidates, attribute_table
+
+
+class ConsensusBinning(unittest.TestCase):
+    """
+    Tests the grouped consensus binning against the per source transcript implementation it replaced.
+    """
+    def test_matches_reference(self):
+        rnd = random.Random(3)
+        for _ in xrange(25):
+            candidates, attribute_table = random_candidates(rnd)
+            filter_ids = {"T3", "T38"}
+            expected = reference_bin_transcripts(candidates, attribute_table, filter_ids)
+            binned = consensus_lib.bin_transcripts(candidates, attribute_table, filter_ids)
+            self.assertEqual(sorted(binned), sorted(expected))
+            for biotype in expected:
+                for b in expected[biotype]:
+                    self.assertEqual(binned[biotype][b], expected[biotype][b], (biotype, b))
+
+    def test_empty(self):
+        candidates, attribute_table = random_candidates(random.Random(1))
+        binned = consensus_lib.bin_transcripts(candidates[:0], attribute_table, set())
+        self.assertEqual(sum(len(x["fail"]) for x in binned.itervalues()), 40)
+
+    def test_sorted_records(self):
+        """
+        Records are sorted by chromosome and then numerically by start, and their name, unique ID and name2 fields are
+        fixed up.
+        """
+        tmp = os.path.abspath(makeTempDir())
+        self.addCleanup(removeDir, tmp)
+        def make_line(name, chrom, start):
+            return "\t".join([name, chrom, "+", str(start), str(start + 10), str(start), str(start + 10), "1",
+                              str(start), str(start + 10), "0", "x", "cmpl", "cmpl", "0"]) + "\n"
+        tm_gp = os.path.join(tmp, "tm.gp")
+        aug_gp = os.path.join(tmp, "aug.gp")
+        with open(tm_gp, "w") as outf:
+            outf.write(make_line("A.1-1", "chr1", 100))
+            outf.write(make_line("B.1-1", "chr1", 20))
+            outf.write(make_line("C.1-2", "chr2", 5))
+        with open(aug_gp, "w") as outf:
+            outf.write(make_line("augI1-A.1-1", "chr1", 30))
+            outf.write(make_line("augI2-B.1-1", "chr1", 20))
+        gene_map = {"A.1": "GA", "B.1": "GB", "C.1": "GC"}
+        aln_ids = {"A.1-1", "B.1-1", "C.1-2", "augI1-A.1-1"}
+        records = consensus_lib.load_sorted_records([tm_gp, aug_gp], gene_map, aln_ids)
+        self.assertEqual([r.aln_id for r in records], ["B.1-1", "augI1-A.1-1", "A.1-1", "C.1-2"])
+        self.assertEqual([r.start for r in records], [20, 30, 100, 5])
+        tokens = records[1].line.split("\t")
+        self.assertEqual([tokens[0], tokens[10], tokens[11]], ["A.1", "augI1-A.1-1", "GA"])
+        self.assertEqual(records[1].line[-1], "\n")
+
+    def test_augustus_wins(self):
+        """
+        An Augustus transcript that aligns better to the source transcript than its transMap alignment is the best OK.
+        """
+        import pandas as pd
+        tmp = os.path.abspath(makeTempDir())
+        self.addCleanup(removeDir, tmp)
+        stats_path = os.path.join(tmp, "genome.stats")
+        with open(stats_path, "w") as outf:
+            outf.write("augI1-A.1-1\t0.998\t0.99\naugI2-A.1-1\t0.97\t0.99\naugI1-B.1-1\t0.9\t0.99\n")
+        aug = consensus_lib.load_aug_stats(stats_path)
+        tm = pd.DataFrame({"AlignmentId": ["A.1-1", "B.1-1"], "Identity": [0.95, 0.95], "Coverage": [0.98, 0.98]})
+        ok = {"augI1-A.1-1", "augI2-A.1-1", "augI1-B.1-1", "A.1-1", "B.1-1"}
+        candidates = consensus_lib.build_candidates(aug, tm, ok, ok)
+        self.assertEqual(list(candidates.TranscriptId), ["A.1", "A.1", "B.1", "A.1", "B.1"])
+        attribute_table = pd.DataFrame({"TranscriptType": ["protein_coding", "protein_coding"]}, index=["A.1", "B.1"])
+        binned = consensus_lib.bin_transcripts(candidates, attribute_table, set())["protein_coding"]
+        self.assertEqual(binned["bestOk"], ["augI1-A.1-1", "B.1-1"])
+        self.assertEqual(binned["augAltOk"], ["augI2-A.1-1", "augI1-B.1-1"])
+        self.assertEqual(binned["tmAltOk"], ["A.1-1"])
+
+
+def load_plotting_module(name):
+    """
+    The plotting scripts are not a package, so load one of them by path. They import their configuration from etc.
+    """
+    import sys
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    if os.path.join(root, "etc") not in sys.path:
+        sys.path.append(os.path.join(root, "etc"))
+    return imp.load_source(name, os.path.join(root, "plotting", name + ".py"))
+
+
+class MetricsStore(unittest.TestCase):
+    """
+    Tests the plotting metrics store against the histogram and OK logic the plots used before the store.
+    """
+    coding_classifiers = ["C1", "C2"]
+    noncoding_classifiers = ["C2"]
+
+    def setUp(self):
+        import sqlite3
+        self.metrics_store = load_plotting_module("metrics_store")
+        self.tmp = os.path.abspath(makeTempDir())
+        self.addCleanup(removeDir, self.tmp)
+        rnd = random.Random(5)
+        self.biotypes = {"T{}".format(i): rnd.choice(["protein_coding", "lincRNA"]) for i in xrange(30)}
+        with open(os.path.join(self.tmp, "attrs.tsv"), "w") as outf:
+            outf.write("GeneId\tGeneName\tGeneType\tTranscriptId\tTranscriptType\n")
+            for tx_id, biotype in sorted(self.biotypes.iteritems()):
+                outf.write("G{0}\tN{0}\t{1}\t{0}\t{1}\n".format(tx_id, biotype))
+        # T0-T24 are in the gencode set, T0 and T1 on chrY
+        with open(os.path.join(self.tmp, "comp.gp"), "w") as outf:
+            for i in xrange(25):
+                outf.write("T{}\t{}\t+\t0\t10\n".format(i, "chrY" if i < 2 else "chr1"))
+        self.alignments = []
+        self.classify = []
+        for tx_id in sorted(self.biotypes):
+            for k in xrange(1, rnd.randint(0, 3) + 1):
+                aln_id = "{}-{}".format(tx_id, k)
+                self.alignments.append([aln_id, tx_id, rnd.choice([0.0, 0.5, 0.995, 0.997, 0.999, 1.0]),
+                                        rnd.choice([0.0, 0.5, 0.8, 0.9, 0.96, 1.0])])
+                self.classify.append([aln_id] + [rnd.choice([0, 0, 1, None]) for _ in self.coding_classifiers])
+        for db in ["classify", "attributes", "details"]:
+            con = sqlite3.connect(os.path.join(self.tmp, db + ".db"))
+            if db == "classify":
+                con.execute("CREATE TABLE g1 (AlignmentId TEXT PRIMARY KEY, C1 INTEGER, C2 INTEGER)")
+                con.executemany("INSERT INTO g1 VALUES (?, ?, ?)", self.classify)
+            elif db == "attributes":
+                con.execute("CREATE TABLE g1 (AlignmentId TEXT PRIMARY KEY, TranscriptId TEXT, "
+                            "AlignmentIdentity REAL, AlignmentCoverage REAL)")
+                con.executemany("INSERT INTO g1 VALUES (?, ?, ?, ?)", self.alignments)
+            con.commit()
+            con.close()
+        sql_lib.write_best_alignments(os.path.join(self.tmp, "attributes.db"),
+                                      os.path.join(self.tmp, "bestAlignments.db"), "g1")
+        self.metrics_path = os.path.join(self.tmp, "metrics.db")
+        self.metrics_store.build_metrics(self.tmp, ["g1"], os.path.join(self.tmp, "attrs.tsv"),
+                                         {"Comp": os.path.join(self.tmp, "comp.gp")}, self.coding_classifiers,
+                                         self.noncoding_classifiers, self.metrics_path)
+
+    def test_matches_plot_logic(self):
+        import sqlite3
+        import numpy as np
+        from collections import Counter
+        con = sqlite3.connect(os.path.join(self.tmp, "bestAlignments.db"))
+        highest_cov = {x[0]: x[1:] for x in con.execute("SELECT TranscriptId, AlignmentId, AlignmentIdentity, "
+                                                        "AlignmentCoverage FROM g1")}
+        con.close()
+        paralogy = Counter(x[1] for x in self.alignments)
+        classify = {x[0]: dict(zip(self.coding_classifiers, x[1:])) for x in self.classify}
+        best_ids = {x[0] for x in highest_cov.itervalues()}
+        gencode_ids = {"T{}".format(i) for i in xrange(2, 25)}
+        metrics_con = sqlite3.connect(self.metrics_path)
+        self.assertEqual(self.metrics_store.get_gencode_set(metrics_con, "Comp"), gencode_ids)
+        for biotype in ["protein_coding", "lincRNA"]:
+            filter_set = {x for x in gencode_ids if self.biotypes[x] == biotype}
+            classifiers = self.coding_classifiers if biotype == "protein_coding" else self.noncoding_classifiers
+            for analysis, i, bins in [["identity", 1, self.metrics_store.identity_bins],
+                                      ["coverage", 2, self.metrics_store.coverage_bins]]:
+                vals = [v[i] for tx_id, v in highest_cov.iteritems() if tx_id in filter_set]
+                vals.extend([0] * (len(filter_set) - len(vals)))
+                expected = np.histogram(vals, bins)[0]
+                r = self.metrics_store.get_histogram(metrics_con, "g1", biotype, "Comp", analysis)
+                self.assertEqual(list(r), list(expected), (biotype, analysis))
+            expected = np.histogram([paralogy.get(x, 0) for x in filter_set], self.metrics_store.paralogy_bins)[0]
+            r = self.metrics_store.get_histogram(metrics_con, "g1", biotype, "Comp", "paralogy")
+            self.assertEqual(list(r), list(expected), biotype)
+            # transmap_ok: every classifier for this biotype is 0, NULL is not OK
+            tm_ok = {aln_id for aln_id, c in classify.iteritems() if all(c[x] == 0 for x in classifiers)}
+            expected = len({x for x in tm_ok if psl_lib.remove_alignment_number(x) in filter_set and x in best_ids})
+            self.assertEqual(self.metrics_store.get_count(metrics_con, "g1", biotype, "Comp", "OK"), expected)
+            self.assertEqual(self.metrics_store.get_count(metrics_con, "g1", biotype, "Comp", "Total"),
+                             len(filter_set))
+            for c in self.coding_classifiers:
+                expected = len({x for x in best_ids if psl_lib.remove_alignment_number(x) in filter_set and
+                                classify[x][c] > 0})
+                self.assertEqual(self.metrics_store.get_count(metrics_con, "g1", biotype, "Comp", c), expected)
+        metrics_con.close()
+
+
+def fake_plot(out_path, file_name, data, title_string, border=True):
+    """
+    Stands in for a plotting function in the FigureQueue tests.
+    """
+    with open(os.path.join(out_path, file_name + ".pdf"), "w") as outf:
+        outf.write(repr([data, title_string, border]))
+
+
+class FigureQueue(unittest.TestCase):
+    """
+    Tests that FigureQueue only renders figures whose inputs changed.
+    """
+    def setUp(self):
+        self.plot_functions = load_plotting_module("plot_functions")
+        self.tmp = os.path.abspath(makeTempDir())
+        self.addCleanup(removeDir, self.tmp)
+        defaults = fake_plot.__defaults__
+        self.addCleanup(setattr, fake_plot, "__defaults__", defaults)
+
+    def run_queue(self, *args):
+        figures = self.plot_functions.FigureQueue()
+        figures.add(fake_plot, self.tmp, "fig", *args)
+        return figures.run()
+
+    def test_rerender(self):
+        pdf_path = os.path.join(self.tmp, "fig.pdf")
+        self.assertEqual(self.run_queue([1, 2], "title"), [pdf_path])
+        self.assertEqual(self.run_queue([1, 2], "title"), [])
+        self.assertEqual(self.run_queue([1, 3], "title"), [pdf_path])
+        self.assertEqual(self.run_queue([1, 3], "other title"), [pdf_path])
+        self.assertEqual(self.run_queue([1, 3], "other title"), [])
+        # a changed default is an input too
+        fake_plot.__defaults__ = (False,)
+        self.assertEqual(self.run_queue([1, 3], "other title"), [pdf_path])
+        with open(pdf_path) as inf:
+            self.assertEqual(inf.read(), repr([[1, 3], "other title", False]))
+        os.remove(pdf_path)
+        self.assertEqual(self.run_queue([1, 3], "other title"), [pdf_path])
+
+
+def make_psl(q_name, t_name, matches, mismatches, q_num_insert, q_size):
+    """
+    Builds a single block PSL line for the blat tests.
+    """
+    size = matches + mismatches
+    return "\t".join(map(str, [matches, mismatches, 0, 0, q_num_insert, q_num_insert, 0, 0, "+", q_name, q_size, 0,
+                                size, t_name, size, 0, size, 1, "{},".format(size), "0,", "0,"]))
+
+
+class BlatAlignments(unittest.TestCase):
+    """
+    Tests the cache and the per-chunk filtering of the blat alignments of Augustus transcripts.
+    """
+    def test_cache_hit_skips_blat(self):
+        cache = {blat_lib.cache_key("ACGT", "A.1"): ["0.9", "1.0"]}
+        seqs = [("augI1-A.1-1", "ACGT"), ("augI2-A.1-1", "ACGA"), ("augI1-B.1-1", "ACGT")]
+        cached, to_align = blat_lib.partition_cached(seqs, cache)
+        self.assertEqual(cached, [["augI1-A.1-1", "0.9", "1.0"]])
+        # a changed sequence or another source transcript is a miss
+        self.assertEqual(to_align, ["augI2-A.1-1", "augI1-B.1-1"])
+
+    def test_batch_keeps_requested_pairs(self):
+        blat_output = "\n".join(["Loaded 2 sequences", make_psl("augI1-A.1-1", "A.1", 90, 10, 0, 100),
+                                 make_psl("augI1-A.1-1", "B.1", 50, 0, 0, 100),
+                                 make_psl("augI1-B.1-1", "A.1", 40, 0, 0, 40), ""])
+        p_lists = blat_lib.parse_blat(blat_output)
+        self.assertEqual(sorted(p_lists), [("augI1-A.1-1", "A.1"), ("augI1-A.1-1", "B.1"), ("augI1-B.1-1", "A.1")])
+        pairs = [["augI1-A.1-1", "A.1", "k1"], ["augI1-B.1-1", "B.1", "k2"]]
+        results, cache = blat_lib.pair_results(pairs, p_lists)
+        self.assertEqual(results, [["augI1-A.1-1", "0.9", "1.0"], ["augI1-B.1-1", "0", "0"]])
+        self.assertEqual(cache, {"k1": ["0.9", "1.0"], "k2": ["0", "0"]})
+
+
+class GtfMerge(unittest.TestCase):
+    """
+    Tests merging the sorted per-job Augustus GTFs against sorting all of their lines at once.
+    """
+    def setUp(self):
+        self.tmp = os.path.abspath(makeTempDir())
+        self.addCleanup(removeDir, self.tmp)
+        rnd = random.Random(7)
+        self.paths = []
+        self.lines = []
+        for i in xrange(23):
+            lines = []
+            for j in xrange(rnd.randint(0, 30)):
+                start = rnd.randint(1, 2000)
+                lines.append("\t".join(["chr{}".format(rnd.randint(1, 3)), "AUGUSTUS", "exon", str(start),
+                                        str(start + 100), ".", "+", ".", "f{}_{}".format(i, j)]) + "\n")
+            lines.sort(key=gtf_lib.gtf_sort_key)
+            self.paths.append(os.path.join(self.tmp, "job{}.gtf".format(i)))
+            with open(self.paths[-1], "w") as outf:
+                outf.write("".join(lines))
+            self.lines.extend(lines)
+
+    def merge(self, max_files):
+        out_path = os.path.join(self.tmp, "merged.gtf")
+        merge_dir = os.path.join(self.tmp, "merge{}".format(max_files))
+        os.mkdir(merge_dir)
+        gtf_lib.merge_many_sorted_gtfs(self.paths, out_path, merge_dir, max_files=max_files)
+        with open(out_path) as inf:
+            return inf.readlines()
+
+    def test_single_pass(self):
+        merged = self.merge(gtf_lib.max_merge_files)
+        self.assertEqual([gtf_lib.gtf_sort_key(x) for x in merged],
+                         [gtf_lib.gtf_sort_key(x) for x in sorted(self.lines, key=gtf_lib.gtf_sort_key)])
+        self.assertEqual(sorted(merged), sorted(self.lines))
+
+    def test_multi_pass(self):
+        # 23 files in groups of 2 takes five passes
+        merged = self.merge(2)
+        self.assertEqual([gtf_lib.gtf_sort_key(x) for x in merged],
+                         [gtf_lib.gtf_sort_key(x) for x in sorted(self.lines, key=gtf_lib.gtf_sort_key)])
+        self.assertEqual(sorted(merged), sorted(self.lines))
+        self.assertEqual(merged, self.merge(gtf_lib.max_merge_files))
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -8,6 +8,8 @@ Modified by Ian Fiddes
 from collections import Counter
 import re
 
+from lib.general_lib import format_ratio
+
 __author__ = "Ian Fiddes"
 
 
@@ -45,6 +47,20 @@ class PslRow(object):
         self.q_starts = [int(x) for x in data[19].split(',') if x]
         self.t_starts = [int(x) for x in data[20].split(',') if x]
 
+    def coverage(self):
+        """
+        Alignment coverage: (matches + mismatches + repeat matches) / q_size, as a ratio between 0 and 1.
+        """
+        return format_ratio(self.matches + self.mismatches + self.repmatches, self.q_size)
+
+    def identity(self):
+        """
+        Alignment identity: (matches + repeat matches) / (matches + repeat matches + mismatches + query insertions),
+        as a ratio between 0 and 1.
+        """
+        return format_ratio(self.matches + self.repmatches, self.matches + self.repmatches + self.mismatches +
+                            self.q_num_insert)
+
     def hash_key(self):
         """ return a string to use as dict key.
         """
@@ -139,10 +155,10 @@ def get_psl_dict(alignments):
     """
     alignments_dict = {}
     for a in alignments:
-        if a.qName in alignments_dict:
-                raise RuntimeError("getPslDict found duplicate transcript {} when noDuplicates was set".format(a.qName))
+        if a.q_name in alignments_dict:
+            raise RuntimeError("get_psl_dict found duplicate transcript {}".format(a.q_name))
         else:
-            alignments_dict[a.qName] = a
+            alignments_dict[a.q_name] = a
     return alignments_dict
 
 
@@ -0,0 +1,87 @@
+"""
+Library for precomputing reference-side properties of the source annotation. Every alignment of a source transcript
+(paralogous alignments are numbered -1, -2, ...) in every target genome needs the same facts about the reference
+transcript it came from, so these are derived once per annotation and persisted to disk.
+"""
+import os
+import hashlib
+import cPickle as pickle
+
+import lib.seq_lib as seq_lib
+
+__author__ = "Ian Fiddes"
+
+# bump this if the contents of ReferenceTranscript change so that old stores are not reused
+store_version = 2
+
+
+class ReferenceTranscript(object):
+    """
+    Stores the precomputed reference-side properties of one source transcript:
+    intron_intervals: list of (start, stop) tuples, chromosome coordinates in (+) strand ordering.
+    splice_sites: dict mapping each (start, stop) intron tuple to its (donor, acceptor) dinucleotides in
+        transcript orientation.
+    cds: the CDS sequence in transcript orientation.
+    cds_length: the length of the CDS.
+    start_codon/stop_codon: the first and last 3 bases of the CDS.
+    """
+    __slots__ = ('name', 'intron_intervals', 'splice_sites', 'cds', 'cds_length', 'start_codon', 'stop_codon')
+
+    def __init__(self, a, ref_dict):
+        self.name = a.name
+        self.intron_intervals = [(x.start, x.stop) for x in a.intron_intervals]
+        self.splice_sites = {}
+        for intron in a.intron_intervals:
+            seq = intron.get_sequence(ref_dict, strand=True)
+            self.splice_sites[(intron.start, intron.stop)] = (seq[:2], seq[-2:])
+        self.cds = a.get_cds(ref_dict)
+        self.cds_length = a.get_cds_length()
+        self.start_codon = self.cds[:3]
+        self.stop_codon = self.cds[-3:]
+
+
+def build_reference_dict(annotation_gp, ref_fasta):
+    """
+    Builds a dictionary mapping each source transcript ID to a ReferenceTranscript object.
+    """
+    transcripts = seq_lib.get_gene_pred_transcripts(annotation_gp)
+    ref_dict = seq_lib.get_sequence_dict(ref_fasta)
+    return reference_dict_from_transcripts(transcripts, ref_dict)
+
+
+def reference_dict_from_transcripts(transcripts, ref_dict):
+    """
+    Same as build_reference_dict, but for transcripts and reference sequence that have already been loaded.
+    """
+    return {a.name: ReferenceTranscript(a, ref_dict) for a in transcripts}
+
+
+def get_reference_store_path(store_dir, ref_genome, annotation_gp, ref_fasta):
+    """
+    Returns the path a reference store for this annotation/reference pair will be written to. The file name is keyed
+    on the size and modification time of both inputs so that a new annotation version produces a new store.
+    """
+    h = hashlib.md5(str(store_version))
+    for path in [annotation_gp, ref_fasta]:
+        s = os.stat(path)
+        h.update("{}:{}:{}".format(os.path.abspath(path), s.st_size, int(s.st_mtime)))
+    return os.path.join(store_dir, "{}.{}.reference.pickle".format(ref_genome, h.hexdigest()))
+
+
+def write_reference_dict(reference_dict, store_path):
+    """
+    Pickles a reference dict to store_path. Written to a temporary file first so that genomes being analyzed in
+    parallel never see a partially written store.
+    """
+    tmp_path = "{}.{}.tmp".format(store_path, os.getpid())
+    with open(tmp_path, "wb") as outf:
+        pickle.dump(reference_dict, outf, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_path, store_path)
+
+
+def load_reference_dict(store_path):
+    """
+    Loads a reference dict written by write_reference_dict.
+    """
+    with open(store_path, "rb") as inf:
+        return pickle.load(inf)
@@ -7,9 +7,9 @@ Modified by Ian Fiddes
 """
 
 import string
-import copy
 import math
 from itertools import izip
+from collections import OrderedDict
 from pyfaidx import Fasta
 
 __author__ = "Ian Fiddes"
@@ -21,21 +21,25 @@ class Transcript(object):
     and then uses them to create the following class members:
     chromosomeInterval: a ChromosomeInterval object representing the entire transcript
         in chromosome coordinates.
-    exonIntervals: a list of ChromosomeInterval objects representing each exon in
+    exon_intervals: a list of ChromosomeInterval objects representing each exon in
         chromosome coordinates.
-    intronIntervals: a list of ChromosomeInterval objects representing each intron
+    intron_intervals: a list of ChromosomeInterval objects representing each intron
         in chromosome coordinates.
     exons: a list of Exon objects representing this transcript. These objects store mappings
         between chromosome, transcript and CDS coordinate space. Transcript and CDS coordinates
         are always transcript relative (5'->3').
 
-    To be more efficient, the cds and mRNA slots are saved for if those sequences are ever retrieved.
-    Then they will be stored so we don't slice the same thing over and over.
+    To be more efficient, the mRNA, CDS, protein and intron sequences are cached the first time they are retrieved
+    from a sequence source so we don't slice the same thing over and over. See get_cached_sequence.
+
+    exon_intervals, intron_intervals, exons and the sizes are not built until they are first accessed. Many uses of
+    Transcript objects only need the name and position, and building the Exon mappings is most of the cost of
+    loading a genePred. The BED tokens are kept so that they can be built later.
     """
 
-    __slots__ = ('name', 'strand', 'score', 'thick_start', 'rgb', 'thick_stop', 'start', 'stop', 'intron_intervals',
-                 'exon_intervals', 'exons', 'cds', 'mrna', 'block_sizes', 'block_starts', 'block_count', 'chromosome',
-                 'cds_size', 'transcript_size')
+    __slots__ = ('name', 'strand', 'score', 'thick_start', 'rgb', 'thick_stop', 'start', 'stop', '_intron_intervals',
+                 '_exon_intervals', '_exons', '_sequence_cache', 'block_sizes', 'block_starts', 'block_count',
+                 'chromosome', '_cds_size', '_transcript_size', '_bed_tokens')
 
     def __init__(self, bed_tokens):
         self.chromosome = bed_tokens[0]
@@ -50,14 +54,50 @@ class Transcript(object):
         self.block_count = bed_tokens[9]
         self.block_sizes = bed_tokens[10]
         self.block_starts = bed_tokens[11]
-        # build chromosome intervals for exons and introns
-        self.exon_intervals = self._get_exon_intervals(bed_tokens)
-        self.intron_intervals = self._get_intron_intervals()
-        # build Exons mapping transcript space coordinates to chromosome
-        self.exons = self._get_exons(bed_tokens)
-        # calculate sizes
-        self._get_cds_size()
-        self._get_size()
+        self._init_lazy_fields(bed_tokens)
+
+    def _init_lazy_fields(self, bed_tokens):
+        """
+        Stores the BED tokens that the intervals, exons and sizes are built from on first access.
+        """
+        self._bed_tokens = bed_tokens
+        self._exon_intervals = None
+        self._intron_intervals = None
+        self._exons = None
+        self._cds_size = None
+        self._transcript_size = None
+        self._sequence_cache = None
+
+    @property
+    def exon_intervals(self):
+        if self._exon_intervals is None:
+            self._exon_intervals = self._get_exon_intervals(self._bed_tokens)
+        return self._exon_intervals
+
+    @property
+    def intron_intervals(self):
+        if self._intron_intervals is None:
+            self._intron_intervals = self._get_intron_intervals()
+        return self._intron_intervals
+
+    @property
+    def exons(self):
+        if self._exons is None:
+            # build Exons mapping transcript space coordinates to chromosome
+            self._exons = self._get_exons(self._bed_tokens)
+        return self._exons
+
+    @property
+    def cds_size(self):
+        if self._cds_size is None:
+            self._cds_size = self._get_cds_size()
+        return self._cds_size
+
+    @property
+    def transcript_size(self):
+        if self._transcript_size is None:
+            self._transcript_size = self._get_size()
+        return self._transcript_size
 
     def __len__(self):
         return self.transcript_size
@@ -288,7 +328,8 @@ class Transcript(object):
         return exons
 
     def _get_size(self):
-        self.transcript_size = sum(x.stop - x.start for x in self.exon_intervals)
+        # the sum of the block sizes, which does not require building the exon intervals
+        return sum(int(x) for x in str(self._bed_tokens[10]).split(",") if x != "")
 
     def _get_cds_size(self):
         l = 0
@@ -305,7 +346,7 @@ class Transcript(object):
             elif self.thick_start < e.start < self.thick_stop <= e.stop:
                 # thickStop marks the end of the CDS
                 l += self.thick_stop - e.start
-        self.cds_size = l
+        return l
 
     def get_cds_length(self):
         return self.cds_size
@@ -313,32 +354,56 @@ class Transcript(object):
     def get_transcript_length(self):
         return self.transcript_size
 
+    def get_cached_sequence(self, kind, seq_dict, fn):
+        """
+        Returns fn(seq_dict), caching the result on this transcript keyed by the kind of sequence and the sequence
+        source. Sources are identified by file name if they are pyfaidx Fasta objects, otherwise by identity.
+        If a global budget has been set with set_sequence_cache_budget, cached sequences are subject to eviction.
+        """
+        key = (kind, sequence_source_key(seq_dict))
+        if self._sequence_cache is None:
+            self._sequence_cache = {}
+        elif key in self._sequence_cache:
+            if _sequence_cache_budget is not None:
+                _sequence_cache_budget.touch(self, key)
+            return self._sequence_cache[key]
+        seq = fn(seq_dict)
+        self._sequence_cache[key] = seq
+        if _sequence_cache_budget is not None:
+            _sequence_cache_budget.add(self, key, seq)
+        return seq
+
+    def clear_sequence_cache(self):
+        """
+        Removes all cached sequences for this transcript.
+        """
+        if self._sequence_cache is not None and _sequence_cache_budget is not None:
+            for key in self._sequence_cache:
+                _sequence_cache_budget.discard(self, key)
+        self._sequence_cache = None
+
     def get_mrna(self, seq_dict):
         """
         Returns the mRNA sequence for this transcript based on a Fasta object.
         and the start/end positions and the exons. Sequence returned in
         5'-3' transcript orientation.
         """
-        if hasattr(self, "mrna"):
-            return self.mrna
+        return self.get_cached_sequence("mrna", seq_dict, self._get_mrna)
+
+    def _get_mrna(self, seq_dict):
         sequence = seq_dict[self.chromosome]
         assert self.stop <= len(sequence)
         s = []
         for e in self.exon_intervals:
             s.append(sequence[e.start:e.stop])
-        if self.strand is True:
-            mrna = "".join(s)
-        else:
-            mrna = reverse_complement("".join(s))
-        self.mrna = mrna.upper()
-        return mrna
+        return normalize_sequence("".join(s), self.strand is True)
 
     def get_sequence(self, seq_dict):
         """
         Returns the entire chromosome sequence for this transcript, (+) strand orientation.
         """
         sequence = seq_dict[self.chromosome]
-        return sequence[self.start:self.stop].upper()
+        return normalize_sequence(sequence[self.start:self.stop])
 
     def get_cds(self, seq_dict):
         """
@@ -347,8 +412,9 @@ class Transcript(object):
         The returned sequence is in the correct 5'-3' orientation (i.e. it has
         been reverse complemented if necessary).
         """
-        if hasattr(self, "cds"):
-            return self.cds
+        return self.get_cached_sequence("cds", seq_dict, self._get_cds)
+
+    def _get_cds(self, seq_dict):
         sequence = seq_dict[self.chromosome]
         assert self.stop <= len(sequence)
         # make sure this isn't a non-coding gene
@@ -368,12 +434,7 @@ class Transcript(object):
             elif self.thick_start < e.start < self.thick_stop <= e.stop:
                 # thickStop marks the end of the CDS
                 s.append(sequence[e.start:self.thick_stop])
-        if not self.strand:
-            cds = reverse_complement("".join(s)).upper()
-        else:
-            cds = "".join(s)
-        self.cds = cds.upper()
-        return cds
+        return normalize_sequence("".join(s), self.strand is True)
 
     def get_transcript_coordinate_cds_start(self):
         """
@@ -414,10 +475,13 @@ class Transcript(object):
         Returns the translated protein sequence for this transcript in single
         character space.
         """
+        return self.get_cached_sequence("protein", seq_dict, self._get_protein_sequence)
+
+    def _get_protein_sequence(self, seq_dict):
         cds = self.get_cds(seq_dict)
         if len(cds) < 3:
             return ""
-        return translate_sequence(self.get_cds(seq_dict))
+        return translate_sequence(cds)
 
     def intron_sequence_iterator(self, seq_dict):
         """
@@ -434,7 +498,8 @@ class Transcript(object):
         """
         Wrapper for intronSequenceIterator that returns a list of sequences.
         """
-        return list(self.intron_sequence_iterator(seq_dict))
+        introns = self.get_cached_sequence("introns", seq_dict, lambda x: tuple(self.intron_sequence_iterator(x)))
+        return list(introns)
 
     def transcript_coordinate_to_cds(self, p):
         """
@@ -556,8 +621,8 @@ class GenePredTranscript(Transcript):
         between chromosome, transcript and CDS coordinate space. Transcript and CDS coordinates
         are always transcript relative (5'->3').
 
-    To be more efficient, the cds and mRNA slots are saved for if those sequences are ever retrieved.
-    Then they will be stored so we don't slice the same thing over and over.
+    To be more efficient, the mRNA, CDS, protein and intron sequences are cached the first time they are retrieved
+    from a sequence source so we don't slice the same thing over and over. See get_cached_sequence.
     """
     # adding slots for new fields
     __slots__ = ('cds_start_stat', 'cds_end_stat', 'exon_frames')
@@ -587,16 +652,9 @@ class GenePredTranscript(Transcript):
         bed_tokens = [gene_pred_tokens[1], self.start, self.stop, self.name, self.score, gene_pred_tokens[2],
                       self.thick_start, self.thick_stop, self.rgb, self.block_count,
                       self.block_sizes, self.block_starts]
-        # build chromosome intervals for exons and introns
-        self.exon_intervals = self._get_exon_intervals(bed_tokens)
-        self.intron_intervals = self._get_intron_intervals()
-        # build Exons mapping transcript space coordinates to chromosome
-        self.exons = self._get_exons(bed_tokens)
-        # calculate sizes
-        self._get_cds_size()
-        self._get_size()
+        self._init_lazy_fields(bed_tokens)
 
-    def get_protein_sequence(self, seq_dict):
+    def _get_protein_sequence(self, seq_dict):
         """
         Returns the translated protein sequence for this transcript in single
         character space. Overrides this function in the Transcript class to make use of frame information.
@@ -953,12 +1011,10 @@ class ChromosomeInterval(object):
         Returns the sequence for this intron in transcript orientation (reverse complement as necessary)
         If strand is False, returns the + strand regardless of transcript orientation.
         """
-        if strand is False:
-            return seq_dict[self.chromosome][self.start:self.stop].upper()
-        if self.strand is True:
-            return seq_dict[self.chromosome][self.start:self.stop].upper()
+        if strand is False or self.strand is True:
+            return normalize_sequence(seq_dict[self.chromosome][self.start:self.stop])
         if self.strand is False:
-            return reverse_complement(seq_dict[self.chromosome][self.start:self.stop]).upper()
+            return normalize_sequence(seq_dict[self.chromosome][self.start:self.stop], strand=False)
         assert False
 
     def __repr__(self):
@@ -983,19 +1039,68 @@ class Attribute(object):
 
 def gap_merge_intervals(intervals, gap):
     """
-    Merges intervals within gap bases of each other
+    Merges intervals within gap bases of each other. The input intervals are not modified.
     """
     new_intervals = []
     for interval in intervals:
-        if not new_intervals:
-            new_intervals.append(copy.deepcopy(interval))
-        elif interval.separation(new_intervals[-1]) <= gap:
+        if new_intervals and interval.separation(new_intervals[-1]) <= gap:
             new_intervals[-1] = new_intervals[-1].hull(interval)
         else:
-            new_intervals.append(copy.deepcopy(interval))
+            new_intervals.append(ChromosomeInterval(interval.chromosome, interval.start, interval.stop,
+                                                    interval.strand))
     return new_intervals
 
 
+def sorted_interval_intersections(intervals_a, intervals_b):
+    """
+    Sweeps two lists of non-overlapping intervals, each sorted by start position, and yields the (start, stop)
+    of every region covered by both lists. Runs in O(len(a) + len(b)), instead of comparing every pair.
+    """
+    i = j = 0
+    while i < len(intervals_a) and j < len(intervals_b):
+        a, b = intervals_a[i], intervals_b[j]
+        start, stop = max(a.start, b.start), min(a.stop, b.stop)
+        if start < stop:
+            yield start, stop
+        if a.stop < b.stop:
+            i += 1
+        else:
+            j += 1
+
+
+def intervals_not_intersecting(query_intervals, target_intervals):
+    """
+    Sweep version of interval_not_intersect_intervals. Both lists must be non-overlapping, sorted by start position
+    and on the same chromosome and strand (such as the exon intervals of two transcripts at the same locus). Yields
+    each query interval that does not intersect any of the target intervals, in one linear pass.
+    """
+    j = 0
+    for interval in query_intervals:
+        while j < len(target_intervals) and target_intervals[j].stop <= interval.start:
+            j += 1
+        if j == len(target_intervals) or target_intervals[j].start >= interval.stop:
+            yield interval
+
+
+def intervals_not_within_wiggle_room(query_intervals, target_intervals, wiggle_room=0):
+    """
+    Sweep version of interval_not_within_wiggle_room_intervals, with the same requirements on the inputs as
+    intervals_not_intersecting. Yields each query interval that has no target interval within wiggle_room bases on
+    both sides.
+
+    For sorted non-overlapping targets the symmetric separation only grows moving away from the point where the query
+    would be inserted, so only the targets on either side of that point need to be checked.
+    """
+    j = 0
+    for interval in query_intervals:
+        while j < len(target_intervals) and (target_intervals[j].start, target_intervals[j].stop) < \
+                (interval.start, interval.stop):
+            j += 1
+        neighbors = target_intervals[max(j - 1, 0):j + 1]
+        if not any(sum(interval.symmetric_separation(x)) <= 2 * wiggle_room for x in neighbors):
+            yield interval
+
+
 def interval_not_intersect_intervals(intervals, interval):
     """
     Takes a list of intervals and one other interval and determines if interval does not intersect with any of the
@@ -1015,6 +1120,77 @@ def interval_not_within_wiggle_room_intervals(intervals, interval, wiggle_room=0
     return not any([x <= 2 * wiggle_room for x in separation])  # we allow wiggle on both sides
 
 
+class SequenceCacheBudget(object):
+    """
+    Global limit on the number of bases held in Transcript sequence caches. When the limit is exceeded, the least
+    recently used cached sequences are evicted from the transcripts that hold them.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+
+    def add(self, t, key, seq):
+        l = sum(len(x) for x in seq) if isinstance(seq, tuple) else len(seq)
+        self.entries[(id(t), key)] = (t, l)
+        self.size += l
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            (_, old_key), (old_t, old_l) = self.entries.popitem(last=False)
+            self.size -= old_l
+            del old_t._sequence_cache[old_key]
+
+    def touch(self, t, key):
+        # sequences cached before the budget was set are not tracked
+        entry = self.entries.pop((id(t), key), None)
+        if entry is not None:
+            self.entries[(id(t), key)] = entry
+
+    def discard(self, t, key):
+        if (id(t), key) in self.entries:
+            self.size -= self.entries.pop((id(t), key))[1]
+
+
+_sequence_cache_budget = None
+
+
+def set_sequence_cache_budget(max_bytes):
+    """
+    Sets a global limit on the number of bases cached by all Transcript objects. None removes the limit. Sequences
+    already cached are not counted against a new budget.
+    """
+    global _sequence_cache_budget
+    _sequence_cache_budget = SequenceCacheBudget(max_bytes) if max_bytes is not None else None
+
+
+class SequenceSourceKey(object):
+    """
+    Identity based cache key for a sequence source that is not a Fasta, such as a plain dict. Holds a reference to the
+    source so that its id can not be reused by another object while a cached sequence is keyed on it.
+    """
+    __slots__ = ('source',)
+
+    def __init__(self, source):
+        self.source = source
+
+    def __hash__(self):
+        return id(self.source)
+
+    def __eq__(self, other):
+        return isinstance(other, SequenceSourceKey) and other.source is self.source
+
+    def __ne__(self, other):
+        return not self == other
+
+
+def sequence_source_key(seq_dict):
+    """
+    Returns a key identifying a sequence source for the Transcript sequence caches.
+    """
+    if isinstance(seq_dict, Fasta):
+        return seq_dict.filename
+    return SequenceSourceKey(seq_dict)
+
+
 def convert_strand(s):
     """
     Given a potential strand value, converts either from True/False/None
@@ -1035,20 +1211,45 @@ def convert_strand(s):
         return None
 
 
-def complement(seq, comp=string.maketrans("ATGC", "TACG")):
+_iupac = "ACGTUMRWSYKVHDBN"
+_iupac_complement = "TGCAAKYWSRMBDHVN"
+# complements IUPAC characters, preserving case
+_complement_table = string.maketrans(_iupac + _iupac.lower(), _iupac_complement + _iupac_complement.lower())
+# upper cases everything
+_upper_table = string.maketrans(string.ascii_lowercase, string.ascii_uppercase)
+# upper cases everything and complements IUPAC characters in the same pass
+_upper_complement_table = string.maketrans(string.ascii_lowercase + _iupac + _iupac.lower(),
+                                           string.ascii_uppercase + _iupac_complement + _iupac_complement)
+
+
+def complement(seq, comp=_complement_table):
     """
-    given a sequence, return the complement.
+    given a sequence, return the complement. IUPAC aware and case preserving.
     """
     return str(seq).translate(comp)
 
 
-def reverse_complement(seq, comp=string.maketrans("ATGC", "TACG")):
+def reverse_complement(seq, comp=_complement_table):
     """
-    Given a sequence, return the reverse complement.
+    Given a sequence, return the reverse complement. IUPAC aware and case preserving.
     """
     return str(seq).translate(comp)[::-1]
 
 
+def normalize_sequence(seq, strand=True):
+    """
+    Upper cases a sequence (soft-masked genomes are lower case in repeats) and, if strand is False, reverse
+    complements it. Both are done in one translate call, so no intermediate copies are made. Works on str and
+    bytearray. This is what all of the sequence accessors return.
+    """
+    if isinstance(seq, unicode):
+        # pyfaidx returns unicode, which cannot use a 256 character translate table
+        seq = str(seq)
+    if strand is False:
+        return seq.translate(_upper_complement_table)[::-1]
+    return seq.translate(_upper_table)
+
+
 _codon_table = {
     'ATG': 'M',
     'TAA': '*', 'TAG': '*', 'TGA': '*', 'TAR': '*', 'TRA': '*',
@@ -1208,20 +1409,6 @@ def transcript_iterator(stream, transcript):
         yield transcript(tokens)
 
 
-def get_transcript_attribute_dict(attribute_file):
-    """
-    Returns a dictionary mapping the transcript ID to an Attribute object.
-    This stores all of the relevant information from the gencode attributes file.
-    """
-    attribute_dict = {}
-    with open(attribute_file) as f:
-        for line in f:
-            line = line.split()
-            gene_id, gene_name, gene_type, transcript_id, transcript_type = line
-            attribute_dict[transcript_id] = Attribute(gene_id, gene_name, gene_type, transcript_id, transcript_type)
-    return attribute_dict
-
-
 def interval_to_bed(t, interval, rgb, name):
     """
     If you are turning interval objects into BED records, look here. t is a transcript object.
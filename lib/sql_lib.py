@@ -2,9 +2,13 @@
 Convenience library for interfacting with a sqlite database.
 """
 import os
+import time
 import sqlite3 as sql
+from collections import defaultdict
 import pandas as pd
 
+from lib.category_lib import compile_category
+
 __author__ = "Ian Fiddes"
 
 
@@ -51,12 +55,168 @@ def attach_databases(comp_ann_path, has_augustus=False):
     if has_augustus:
         aug_classify_path = os.path.join(comp_ann_path, "augustusClassify.db")
         aug_details_path = os.path.join(comp_ann_path, "augustusDetails.db")
-        assert all([os.path.exists(x) for x in [aug_classify_path, aug_details_path]])
+        aug_attr_path = os.path.join(comp_ann_path, "augustusAttributes.db")
+        assert all([os.path.exists(x) for x in [aug_classify_path, aug_details_path, aug_attr_path]])
         attach_database(con, aug_classify_path, "augustus")
         attach_database(con, aug_details_path, "augustus_details")
+        attach_database(con, aug_attr_path, "augustus_attributes")
+    best_path = os.path.join(comp_ann_path, "bestAlignments.db")
+    if os.path.exists(best_path):
+        attach_database(con, best_path, "best_alignments")
     return con, cur
 
 
+def quote_identifier(name):
+    """
+    Quotes a table or column name (such as a genome name) for use in a SQL statement.
+    """
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+# number of executions and total seconds spent (executing and fetching) for each compiled query, keyed on query name
+query_timings = defaultdict(lambda: [0, 0.0])
+
+# compiled queries, keyed on the arguments to compile_query
+_queries = {}
+
+
+class Query(object):
+    """
+    A SELECT statement compiled once for a schema. Values are always bound as parameters. Genome names can not be
+    bound because they are table names, so the statement text is built once per genome and reused. sqlite3 keeps the
+    prepared form of recently executed statements per connection, so repeated executions are not reparsed or replanned.
+    """
+    def __init__(self, name, template):
+        self.name = name
+        self.template = template
+        self._statements = {}
+
+    def statement(self, genome):
+        """
+        Returns the statement text for this genome.
+        """
+        if genome not in self._statements:
+            self._statements[genome] = self.template.format(genome=quote_identifier(genome))
+        return self._statements[genome]
+
+    def execute(self, cur, genome, values=(), size=10000):
+        """
+        Runs the query against the tables for genome and streams the result rows, fetching size rows at a time. Time
+        spent in sqlite is recorded in query_timings.
+        """
+        timing = query_timings[self.name]
+        start = time.time()
+        c = cur.execute(self.statement(genome), values)
+        rows = c.fetchmany(size)
+        timing[0] += 1
+        timing[1] += time.time() - start
+        while len(rows) > 0:
+            for row in rows:
+                yield row
+            start = time.time()
+            rows = c.fetchmany(size)
+            timing[1] += time.time() - start
+
+
+def compile_where(fields, operations, database="main"):
+    """
+    Compiles a list of fields and the AND/OR operations linking them (as found in the category tuples in
+    etc/queries.py) into a WHERE expression with one placeholder per field. Fields are qualified with the genome table
+    in database. The operations are applied left to right, with explicit parentheses (see category_lib).
+    """
+    # only the field names are rendered, the values are bound when the query is executed
+    tree = compile_category(fields, [1] * len(fields), operations)
+    return "(" + tree.to_sql("{}.{{genome}}".format(database)) + ")"
+
+
+def compile_query(select, databases, fields=(), operations=(), filters=(), primary_key="AlignmentId", name=None):
+    """
+    Returns the Query for these arguments, compiling it the first time it is asked for.
+    select: list of (database, column) pairs to return.
+    databases: the databases whose genome tables are queried, joined on primary_key. fields are in the first one.
+    fields, operations: classify fields and the AND/OR operations between them, see compile_where.
+    filters: list of (database, column) pairs that must also equal a value. Their values follow those of fields.
+    name: the key timings are recorded under. Defaults to the statement template.
+    """
+    key = (tuple(select), tuple(databases), tuple(fields), tuple(operations), tuple(filters), primary_key, name)
+    if key not in _queries:
+        columns = ", ".join("{}.{{genome}}.{}".format(database, column) for database, column in select)
+        cmd = "SELECT {} FROM {}.{{genome}}".format(columns, databases[0])
+        for database in databases[1:]:
+            cmd += " JOIN {}.{{genome}} USING ({})".format(database, primary_key)
+        where = [compile_where(fields, operations, databases[0])] if len(fields) > 0 else []
+        where.extend("{}.{{genome}}.{} = ?".format(database, column) for database, column in filters)
+        if len(where) > 0:
+            cmd += " WHERE " + " AND ".join(where)
+        _queries[key] = Query(name if name is not None else cmd, cmd)
+    return _queries[key]
+
+
+def select_between_databases(cur, database, details_field, classify_fields, classify_values, classify_operations,
+                             primary_key, genome):
+    """
+    Streams details_field from the genome table in database for every row whose classify fields (in the main
+    database) match classify_values, linked by classify_operations.
+    """
+    q = compile_query([(database, details_field)], ["main", database], classify_fields, classify_operations,
+                      primary_key=primary_key)
+    return q.execute(cur, genome, classify_values)
+
+
+def initializeTable(cur, table, columns, primaryKey, drop_if_exists=False):
+    """
+    Creates table with a TEXT primary key column primaryKey followed by columns, a list of [name, data type] pairs.
+    If drop_if_exists is True an existing table of the same name is replaced, otherwise it is kept.
+    """
+    if drop_if_exists:
+        cur.execute("DROP TABLE IF EXISTS {}".format(quote_identifier(table)))
+    column_definitions = ", ".join(["{} TEXT PRIMARY KEY".format(quote_identifier(primaryKey))] +
+                                   ["{} {}".format(quote_identifier(name), data_type) for name, data_type in columns])
+    cur.execute("CREATE TABLE IF NOT EXISTS {} ({})".format(quote_identifier(table), column_definitions))
+
+
+def insertRows(cur, table, primaryKey, columns, valueIter):
+    """
+    Inserts a row into table for each tuple in valueIter, holding the values of columns in order.
+    """
+    statement = "INSERT INTO {} ({}) VALUES ({})".format(quote_identifier(table),
+                                                         ", ".join(quote_identifier(x) for x in columns),
+                                                         ", ".join("?" * len(columns)))
+    cur.executemany(statement, valueIter)
+
+
+def updateRows(cur, table, primaryKey, column, valueIter):
+    """
+    Sets column in table from valueIter, an iterable of (value, primary key value) pairs.
+    """
+    statement = "UPDATE {} SET {} = ? WHERE {} = ?".format(quote_identifier(table), quote_identifier(column),
+                                                         quote_identifier(primaryKey))
+    cur.executemany(statement, valueIter)
+
+
+def write_best_alignments(attributes_path, best_path, genome):
+    """
+    Materializes the best alignment for each source transcript in genome into the table genome of the database at
+    best_path, replacing that table if it exists. Tables for other genomes are left alone, so genomes can be added
+    one at a time. The best alignment is the one with the highest coverage, ties going to the first in the attributes
+    table. Paralogy is the number of alignments of the source transcript. TranscriptId is the primary key.
+    """
+    con = sql.connect(attributes_path)
+    cmd = "SELECT AlignmentId, TranscriptId, AlignmentIdentity, AlignmentCoverage FROM '{}'".format(genome)
+    alns = pd.read_sql_query(cmd, con)
+    con.close()
+    paralogy = alns.groupby("TranscriptId").size()
+    best = alns.sort_values("AlignmentCoverage", ascending=False, kind="mergesort").drop_duplicates("TranscriptId")
+    best = best.assign(Paralogy=best.TranscriptId.map(paralogy).values).sort_values("TranscriptId")
+    with ExclusiveSqlConnection(best_path) as con:
+        con.execute("DROP TABLE IF EXISTS '{}'".format(genome))
+        con.execute("""CREATE TABLE '{}' (TranscriptId TEXT PRIMARY KEY, AlignmentId TEXT, AlignmentIdentity REAL,
+                       AlignmentCoverage REAL, Paralogy INTEGER)""".format(genome))
+        con.executemany("INSERT INTO '{}' VALUES (?, ?, ?, ?, ?)".format(genome),
+                        best[["TranscriptId", "AlignmentId", "AlignmentIdentity", "AlignmentCoverage",
+                              "Paralogy"]].itertuples(index=False))
+
+
 def write_dict(data_dict, database_path, table):
     """
     Writes a dict of dicts to a sqlite database.
@@ -1,10 +1,10 @@
 import re
 from scripts.consensus import *
 from scripts.coverage_identity_ok_plots import *
+from metrics_store import get_metrics_path, get_not_ok_alignments
 import pandas as pd
 from jobTree.scriptTree.target import Target
 from jobTree.scriptTree.stack import Stack
-from sonLib.bioio import system, getRandomAlphaNumericString
 
 
 tm_grouped = {"CodingIndels": ["CodingInsertions", "CodingDeletions"],
@@ -25,6 +25,7 @@ def build_parser():
     parser.add_argument("--annotationGp", type=str, required=True, help="annotation genePred")
     parser.add_argument("--gencode", type=str, required=True, help="current gencode set being analyzed")
     parser.add_argument("--attributePath", type=str, required=True, help="attribute tsv file")
+    parser.add_argument("--metricsDir", required=True, help="directory containing metrics.db (see metrics_store.py)")
     return parser
 
 
@@ -69,22 +70,25 @@ def munge_data(d, filter_set, pre_cluster=False, coding=False):
     return m, s
 
 
-def find_aln_id_set(cur, attr_path, ref_gp_path, genome, biotype, classifiers):
+def find_aln_id_set(metrics_path, attr_path, ref_gp_path, genome, biotype):
     """
-    Finds the set of aln_ids for this combination of reference gencode set, biotype, and fail these classifiers
-    (are not OK)
+    Finds the set of aln_ids for this combination of reference gencode set, biotype, and fail the classifiers for
+    this biotype (are not OK). The best alignments and their OK status come from the metrics store.
     """
     biotype_names = get_all_ids(attr_path, biotype=biotype)  # load all ens_ids for this biotype
     chr_y_names = gp_chrom_filter(ref_gp_path)
     biotype_set = biotype_names - chr_y_names  # filter out ens_ids that are on chromosome Y
-    best_covs = set(zip(*highest_cov_aln(cur, genome).itervalues())[0])  # find which aln_ids are the best
-    tm_ok_names = transmap_ok(cur, genome, classifiers)  # find the set of OK with these classifiers
-    filter_set = {x for x in best_covs if x not in tm_ok_names and strip_alignment_numbers(x) in biotype_set}
+    metrics_con = sql.connect(metrics_path)
+    not_ok = get_not_ok_alignments(metrics_con, genome, biotype)
+    metrics_con.close()
+    filter_set = {x for x in not_ok if strip_alignment_numbers(x) in biotype_set}
     return filter_set, len(biotype_set)
 
 
-def main_fn(target, comp_ann_path, attr_path, ref_gp_path, gencode, genome, biotype, base_out_path, method):
-    base_clust_title = "Hierarchical_clustering_of_transMap_classifiers"
+def main_fn(target, comp_ann_path, metrics_dir, attr_path, ref_gp_path, gencode, genome, biotype, base_out_path,
+            method):
+    base_clust_title = ("Hierarchical clustering of transMap classifiers\ngenome: {}    {:,} ({:0.2f}%) not OK "
+                        "transcripts\nGencode set: {}    Biotype: {}")
     base_barplot_title = ("Proportion of transcripts that fail transMap classifiers\ngenome: {}.    {:,} ({:0.2f}%) not OK "
                     "transcripts \nGencode set: {}    Biotype: {}")
     out_path = os.path.join(base_out_path, biotype, "clustering", method, genome)
@@ -96,7 +100,7 @@ def main_fn(target, comp_ann_path, attr_path, ref_gp_path, gencode, genome, biot
         classifiers = tm_noncoding_classifiers
         coding = False
     sql_data = load_data(con, genome, classifiers)
-    filter_set, num_biotype = find_aln_id_set(cur, attr_path, ref_gp_path, genome, biotype, classifiers)
+    filter_set, num_biotype = find_aln_id_set(get_metrics_path(metrics_dir), attr_path, ref_gp_path, genome, biotype)
     if num_biotype > 25 and len(filter_set) > 10:
         percent_not_ok = round(100.0 * len(filter_set) / num_biotype, 2)
         if method == "pre_cluster":
@@ -106,23 +110,20 @@ def main_fn(target, comp_ann_path, attr_path, ref_gp_path, gencode, genome, biot
         mkdir_p(out_path)
         barplot_title = base_barplot_title.format(genome, len(filter_set), percent_not_ok, gencode, biotype)
         out_barplot_file = os.path.join(out_path, "barplot{}_{}".format(genome, biotype))
-        barplot(stats, out_path, out_barplot_file, barplot_title)
-        # TODO: why can't I use local temp? R fails inexplicably
-        tmp_path = os.path.join(target.getGlobalTempDir(), "{}.txt".format(getRandomAlphaNumericString()))
-        munged.to_csv(tmp_path)
-        out_cluster_file = os.path.join(out_path, "clustering_{}_{}".format(genome, biotype))
-        # TODO: why do we have to use my R? 
-        system("export R_HOME=/cluster/home/ifiddes/lib64/R && /cluster/home/ifiddes/bin/Rscript {}/scripts/cluster.R {} {} {} {} {} {} {} {}".format(os.getcwd(), tmp_path, base_clust_title, 
-                                                                       genome, len(filter_set), percent_not_ok, gencode, 
-                                                                       biotype, out_cluster_file))
-
-
-def wrapper(target, comp_ann_path, attr_path, ref_gp_path, gencode, genomes, biotypes, base_out_path):
+        figures = FigureQueue()
+        figures.add(barplot, stats, out_path, out_barplot_file, barplot_title)
+        clust_title = base_clust_title.format(genome, len(filter_set), percent_not_ok, gencode, biotype)
+        out_cluster_file = "clustering_{}_{}".format(genome, biotype)
+        figures.add(dendrogram_plot, munged, out_path, out_cluster_file, clust_title)
+        figures.run()
+
+
+def wrapper(target, comp_ann_path, metrics_dir, attr_path, ref_gp_path, gencode, genomes, biotypes, base_out_path):
     for genome in genomes:
         for biotype in biotypes:
             for method in ["full", "pre_cluster"]:
-                target.addChildTargetFn(main_fn, args=(comp_ann_path, attr_path, ref_gp_path, gencode, genome, biotype,
-                                                   base_out_path, method))
+                target.addChildTargetFn(main_fn, args=(comp_ann_path, metrics_dir, attr_path, ref_gp_path, gencode,
+                                                       genome, biotype, base_out_path, method))
 
 
 def main():
@@ -132,8 +133,8 @@ def main():
     #biotypes = get_all_biotypes(args.attributePath)
     biotypes = ["protein_coding", "miRNA", "snoRNA", "snRNA", "lincRNA", "processed_pseudogenes", "unprocessed_pseudogenes", 
                 "pseudogenes"]
-    job_args = (args.comparativeAnnotationDir, args.attributePath, args.annotationGp, args.gencode, args.genomes,
-                biotypes, args.outDir)
+    job_args = (args.comparativeAnnotationDir, args.metricsDir, args.attributePath, args.annotationGp, args.gencode,
+                args.genomes, biotypes, args.outDir)
     i = Stack(Target.makeTargetFn(wrapper, args=job_args)).startJobTree(args)
     if i != 0:
         raise RuntimeError("Got failed jobs")
@@ -2,7 +2,6 @@
 from scripts.consensus import *
 from scripts.coverage_identity_ok_plots import *
 from scripts.clustering import *
-from sonLib.bioio import system
 import argparse
 
 def parse_args():
@@ -47,7 +46,8 @@ def munge_data(data, filter_set):
 
 base_barplot_title = ("Proportion of protein coding transcripts that fail classifiers in the reference\n"
                       "{:,} ({:0.2f}%) not OK transcripts \n")
-base_cluster_title = "Hierarchical_clustering_of_classifiers"
+base_cluster_title = ("Hierarchical clustering of classifiers\ngenome: {}    {:,} ({:0.2f}%) not OK transcripts\n"
+                      "Gencode set: {}    Biotype: {}")
 file_name_dict = {"Comp": "ref_protein_coding_comprehensive", "Basic": "ref_protein_coding_basic", 
                   "Complement": "ref_protein_coding_complement"}
 gencode_dict = {"Comp": "GencodeCompVM4", "Basic": "GencodeBasicVM4", "Complement": "GencodeCompVM4_Specific"}
@@ -64,16 +64,10 @@ def main():
         barplot_title = base_barplot_title.format(len(m), percent_not_ok)
         file_name = file_name_dict[cat]
         barplot(s, out_path, file_name, barplot_title)
-        tmp_csv = "{}.txt".format(cat)
-        m.to_csv(tmp_csv)
         genome = "C57B6J"
         biotype = "protein_coding"
-        out_cluster_file = os.path.join(out_path, file_name + "_clustering")
-        gencode = gencode_dict[cat]
-        system("Rscript {}/scripts/cluster.R {} {} {} {} {} {} {} {}".format(os.getcwd(), tmp_csv, base_cluster_title, 
-                                                                             genome, len(m), percent_not_ok,  
-                                                                             gencode, biotype, out_cluster_file))
-        os.remove(tmp_csv)
+        cluster_title = base_cluster_title.format(genome, len(m), percent_not_ok, gencode_dict[cat], biotype)
+        dendrogram_plot(m, out_path, file_name + "_clustering", cluster_title)
 
 
 if __name__ == "__main__":
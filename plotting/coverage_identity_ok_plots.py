@@ -1,6 +1,10 @@
 import argparse
+import multiprocessing
 from scripts.plot_functions import *
 from src.queries import assemblyErrors, alignmentErrors
+from metrics_store import *
+from lib.comparison_lib import load_genome_matrix
+from lib.category_lib import compile_categories, categorize, load_classify_matrix
 
 
 def parse_args():
@@ -11,36 +15,20 @@ def parse_args():
     parser.add_argument("--annotationGp", type=str, required=True, help="annotation genePred")
     parser.add_argument("--gencode", type=str, required=True, help="current gencode set being analyzed")
     parser.add_argument("--attributePath", type=str, required=True, help="attribute tsv file")
+    parser.add_argument("--metricsDir", required=True, help="directory containing metrics.db (see metrics_store.py)")
+    parser.add_argument("--numProcesses", type=int, default=multiprocessing.cpu_count(),
+                        help="Number of figures to render in parallel")
     return parser.parse_args()
 
 
-# Hard coded bins used for plots.
-paralogy_bins = [0, 1, 2, 3, 4, float('inf')]
-identity_bins = [0, 0.0001, 0.995, 0.998, 0.99999999, 1.0]
-coverage_bins = [0, 0.0001, 0.8, 0.95, 0.99999999, 1.0]
-
-
-def paralogy(cur, genome):
+def find_categorized(cur, genomes, cat_fns):
     """
-    Finds the number of paralogous alignments. This is defined as the number of gene IDs with more than one
-    alignment.
+    Finds the alignment IDs categorized by each categorizing function in each genome. All categories are evaluated in
+    one pass over an in-memory classify matrix per genome. Returns a dict mapping each genome to a dict mapping each
+    categorizing function name to a set of alignment IDs.
     """
-    cmd = """SELECT TranscriptId FROM attributes.'{0}'""".format(genome)
-    return Counter([x[0] for x in cur.execute(cmd).fetchall()])
-
-
-def number_categorized(cur, genome, cat_fn, biotype=None):
-    """
-    Finds the alignment IDs categorized by a categorizing function. Can be restricted by biotype
-    """
-    classify_fields, details_fields, classify_values, classify_operations = cat_fn()
-    cmd = """SELECT AlignmentId FROM main.'{0}' JOIN attributes.'{0}' USING (AlignmentId) WHERE (""".format(genome)
-    for col, mod in zip(classify_fields[:-1], classify_operations):
-        cmd += " {} = ? {}".format(col, mod)
-    cmd += " {} = ?)".format(classify_fields[-1])
-    if biotype is not None:
-        cmd += " AND TranscriptType = '{}'".format(biotype)
-    return {x[0] for x in cur.execute(cmd, classify_values).fetchall()}
+    categories = compile_categories(cat_fns)
+    return {g: categorize(load_classify_matrix(cur, g, categories), categories) for g in genomes}
 
 
 def find_genome_order(highest_cov_dict, filter_set):
@@ -56,112 +44,108 @@ def find_genome_order(highest_cov_dict, filter_set):
     return zip(*order)[0]
 
 
-def make_hist(vals, bins, total, g, reverse=False):
-    raw = np.histogram(vals, bins)[0]
+def make_hist(raw, total, g, reverse=False):
+    """
+    Normalizes raw histogram counts from the metrics store to percentages of total.
+    """
     if reverse is True:
         raw = raw[::-1]
     norm = raw / (0.01 * total)
     return g, norm, raw
 
 
-def paralogy_plot(cur, genome_order, out_path, base_file_name, biotype, gencode, filter_set):
+def paralogy_plot(figures, metrics_con, genome_order, out_path, base_file_name, biotype, gencode, total):
     results = []
     file_name = "{}_{}".format(base_file_name, "paralogy")
     for g in genome_order:
-        p = paralogy(cur, g)
-        p = [p.get(x, 0) for x in filter_set]
-        g, norm, raw = make_hist(p, paralogy_bins, len(filter_set), g)
+        raw = get_histogram(metrics_con, g, biotype, gencode, "paralogy")
+        g, norm, raw = make_hist(raw, total, g)
         results.append([g, norm])
-    title_string = "Proportion of {:,} {} transcripts in {}\nthat have multiple alignments".format(len(filter_set), 
-                                                                                                   biotype, gencode)
+    title_string = "Proportion of {:,} {} transcripts in {}\nthat have multiple alignments".format(total, biotype,
+                                                                                                   gencode)
     legend_labels = ["= {}".format(x) for x in paralogy_bins[:-2]] + [u"\u2265 {}".format(paralogy_bins[-2])] 
-    stacked_barplot(results, legend_labels, out_path, file_name, title_string)
+    figures.add(stacked_barplot, results, legend_labels, out_path, file_name, title_string)
 
 
-def categorized_plot(cur, highest_cov_dict, genome_order, out_path, file_name, biotype, gencode, filter_set, cat_fn):
+def categorized_plot(figures, categorized, highest_cov_dict, genome_order, out_path, file_name, biotype, gencode,
+                     filter_set, cat_fn):
     results = []
     for g in genome_order:
         best_ids = set(zip(*highest_cov_dict[g].itervalues())[0])
-        r = number_categorized(cur, g, cat_fn, biotype=biotype)
+        r = categorized[g][cat_fn.__name__]
         raw = len({x for x in r if strip_alignment_numbers(x) in filter_set and x in best_ids})
         norm = raw / (0.01 * len(filter_set))
         results.append([g, norm, raw])
     title_string = "Proportion of {:,} {} transcripts in {}\ncategorized as {}".format(len(filter_set), biotype, 
                                                                                        gencode, cat_fn.__name__)
-    barplot(results, out_path, file_name, title_string, adjust_y=False)
+    figures.add(barplot, results, out_path, file_name, title_string, adjust_y=False)
 
 
-def cat_plot_wrapper(cur, highest_cov_dict, genome_order, out_path, base_file_name, biotype, gencode, filter_set):
+def cat_plot_wrapper(figures, categorized, highest_cov_dict, genome_order, out_path, base_file_name, biotype, gencode,
+                     filter_set):
     for cat_fn in [assemblyErrors, alignmentErrors]:
         file_name = "{}_{}".format(base_file_name, cat_fn.__name__)
-        categorized_plot(cur, highest_cov_dict, genome_order, out_path, file_name, biotype, gencode, filter_set, cat_fn)
+        categorized_plot(figures, categorized, highest_cov_dict, genome_order, out_path, file_name, biotype, gencode,
+                         filter_set, cat_fn)
 
 
-def metrics_plot(highest_cov_dict, bins, genome_order, out_path, file_name, biotype, gencode, filter_set, analysis):
+def metrics_plot(figures, metrics_con, bins, genome_order, out_path, file_name, biotype, gencode, total, analysis):
     results = []
     for g in genome_order:
-        mets = highest_cov_dict[g]
-        mets = [eval(analysis) for tx_id, (aln_id, identity, coverage) in mets.iteritems() if tx_id in filter_set]
-        mets.extend([0] * (len(filter_set) - len(mets)))
-        g, norm, raw = make_hist(mets, bins, len(filter_set), g, reverse=True)
+        raw = get_histogram(metrics_con, g, biotype, gencode, analysis)
+        g, norm, raw = make_hist(raw, total, g, reverse=True)
         results.append([g, norm])
-    title_string = "transMap alignment {} breakdown for\n{:,} {} transcripts in {}".format(analysis, len(filter_set),
-                                                                                                 biotype, gencode)
+    title_string = "transMap alignment {} breakdown for\n{:,} {} transcripts in {}".format(analysis, total, biotype,
+                                                                                         gencode)
     legend_labels = ["= {0:.1f}%".format(100 * bins[-1])]
     legend_labels.extend(["< {0:.1f}%".format(100 * x) for x in bins[2:-1][::-1]])
     legend_labels.append("= {0:.1f}%".format(100 * bins[0]))
-    stacked_barplot(results, legend_labels, out_path, file_name, title_string)
+    figures.add(stacked_barplot, results, legend_labels, out_path, file_name, title_string)
 
 
-def cov_ident_wrapper(highest_cov_dict, genome_order, out_path, base_file_name, biotype, gencode, filter_set):
+def cov_ident_wrapper(figures, metrics_con, genome_order, out_path, base_file_name, biotype, gencode, total):
     for analysis in ["coverage", "identity"]:
-        bins = eval(analysis + "_bins")
+        bins = histogram_bins[analysis]
         file_name = "{}_{}".format(base_file_name, analysis)
-        metrics_plot(highest_cov_dict, bins, genome_order, out_path, file_name, biotype, gencode, filter_set, analysis)
+        metrics_plot(figures, metrics_con, bins, genome_order, out_path, file_name, biotype, gencode, total, analysis)
 
 
-def num_ok(highest_cov_dict, cur, genome_order, out_path, base_file_name, biotype, gencode, filter_set):
+def num_ok(figures, metrics_con, genome_order, out_path, base_file_name, biotype, gencode, total):
     file_name = "{}_numOK".format(base_file_name)
-    if biotype == 'protein_coding':
-        classifiers = tm_coding_classifiers
-    else:
-        classifiers = tm_noncoding_classifiers
     results = []
     for genome in genome_order:
-        tm_ok = transmap_ok(cur, genome, classifiers)
-        best_ids = set(zip(*highest_cov_dict[genome].itervalues())[0])
-        raw = len({x for x in tm_ok if strip_alignment_numbers(x) in filter_set and x in best_ids})
-        norm = raw / (0.01 * len(filter_set))
+        raw = get_count(metrics_con, genome, biotype, gencode, "OK")
+        norm = raw / (0.01 * total)
         results.append([genome, norm, raw])
-    title_string = "Proportion of {:,} {} transcripts in {}\ncategorized as OK".format(len(filter_set), biotype, 
-                                                                                       gencode)
-    barplot(results, out_path, file_name, title_string, adjust_y=False)
+    title_string = "Proportion of {:,} {} transcripts in {}\ncategorized as OK".format(total, biotype, gencode)
+    figures.add(barplot, results, out_path, file_name, title_string, adjust_y=False)
 
 
 def main():
     args = parse_args()
     con, cur = attach_databases(args.comparativeAnnotationDir)
-    highest_cov_dict = {}
-    for genome in args.genomes:
-        highest_cov_dict[genome] = highest_cov_aln(cur, genome)
-    gencode_ids = get_gp_ids(args.annotationGp)
-    chr_y_ids = gp_chrom_filter(args.annotationGp)
-    # genome_order = find_genome_order(highest_cov_dict, gencode_ids)
+    metrics_con = sql.connect(get_metrics_path(args.metricsDir))
+    matrix = load_genome_matrix(get_metrics_path(args.metricsDir), args.genomes)
+    highest_cov_dict = {genome: matrix.best_alignments(genome) for genome in args.genomes}
+    # genome_order = find_genome_order(highest_cov_dict, get_gp_ids(args.annotationGp))
     genome_order = hard_coded_genome_order
-    for biotype in get_all_biotypes(args.attributePath):
-        biotype_ids = get_all_ids(args.attributePath, biotype=biotype)
-        filter_set = (biotype_ids & gencode_ids) - chr_y_ids
-        if len(filter_set) > 200:  # hardcoded cutoff to avoid issues where this biotype/gencode mix is nearly empty
+    categorized = find_categorized(cur, genome_order, [assemblyErrors, alignmentErrors])
+    figures = FigureQueue(args.numProcesses)
+    for biotype in get_biotypes(metrics_con, args.gencode):
+        total = get_count(metrics_con, genome_order[0], biotype, args.gencode, "Total")
+        if total > 200:  # hardcoded cutoff to avoid issues where this biotype/gencode mix is nearly empty
+            filter_set = get_gencode_set(metrics_con, args.gencode) & get_all_ids(args.attributePath, biotype=biotype)
             base_file_name = args.gencode
             out_path = os.path.join(args.outDir, biotype)
             mkdir_p(out_path)
-            cov_ident_wrapper(highest_cov_dict, genome_order, out_path, base_file_name, biotype, args.gencode, 
-                              filter_set)
-            cat_plot_wrapper(cur, highest_cov_dict, genome_order, out_path, base_file_name, biotype, args.gencode, 
-                             filter_set)
-            paralogy_plot(cur, genome_order, out_path, base_file_name, biotype, args.gencode, filter_set)
-            num_ok(highest_cov_dict, cur, genome_order, out_path, base_file_name, biotype, args.gencode, filter_set)
+            cov_ident_wrapper(figures, metrics_con, genome_order, out_path, base_file_name, biotype, args.gencode,
+                              total)
+            cat_plot_wrapper(figures, categorized, highest_cov_dict, genome_order, out_path, base_file_name, biotype,
+                             args.gencode, filter_set)
+            paralogy_plot(figures, metrics_con, genome_order, out_path, base_file_name, biotype, args.gencode, total)
+            num_ok(figures, metrics_con, genome_order, out_path, base_file_name, biotype, args.gencode, total)
+    figures.run()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -52,7 +52,9 @@ from matplotlib.ticker import ScalarFormatter, FormatStrFormatter
 import numpy
 ##############################
 from argparse import ArgumentParser
+import cPickle as pickle
 from glob import glob
+import hashlib
 import os
 from scipy.stats import scoreatpercentile, linregress, gaussian_kde
 import sys
@@ -65,48 +67,32 @@ class BadInput(Exception):
   pass
 
 
-class Row(object):
-  """ Class Row holds a single line of a file in split format.
-  """
-  def __init__(self):
-    self.columns = []
-    self.line_number = None
+CATEGORY_KEYS = [0.0, 0.5, 0.9, 0.95, 0.99, 1.0]
 
 
 class Data(object):
-  """ Class Data holds data from one file for plotting.
+  """ Class Data holds the category histogram of one file for plotting.
   """
   def __init__(self):
-    self.rows = None  # this will be a list of lists.
-    self.names = []  # this will be a list
-    self.q_size = []  # this will be a numpy array
-    self.bases_mapped = []
-    self.fraction_mapped = []
+    self.categories = dict((key, 0) for key in CATEGORY_KEYS)
     self.label = ''
-  def process_data(self, args):
-    i = 1
-    for r in self.rows:
-      self.names.append(r.columns[0])
-      self.q_size.append(int(r.columns[1]))
-      self.bases_mapped.append(int(r.columns[2]))
-      self.fraction_mapped.append(float(r.columns[3]))
-    self.q_size = numpy.array(self.q_size)
-    self.bases_mapped = numpy.array(self.bases_mapped)
-    self.fraction_mapped = numpy.array(self.fraction_mapped)
-    self.categories = {0.0: 0, 0.5: 0, 0.9: 0, 0.95: 0, 0.99:0, 1.0:0}
-    for i, row in enumerate(self.rows, 0):
-      if self.fraction_mapped[i] == 0:
-        self.categories[0.0] += 1
-      elif self.fraction_mapped[i] < 0.5:
-        self.categories[0.5] += 1
-      elif self.fraction_mapped[i] < 0.9:
-        self.categories[0.9] += 1
-      elif self.fraction_mapped[i] < 0.95:
-        self.categories[0.95] += 1
-      elif self.fraction_mapped[i] < 1.0:
-        self.categories[0.99] += 1
-      else:
-        self.categories[1.0] += 1
+
+  def add_fraction(self, fraction_mapped):
+    """ Count one transcript in the category its fraction mapped falls in.
+    """
+    if fraction_mapped == 0:
+      self.categories[0.0] += 1
+    elif fraction_mapped < 0.5:
+      self.categories[0.5] += 1
+    elif fraction_mapped < 0.9:
+      self.categories[0.9] += 1
+    elif fraction_mapped < 0.95:
+      self.categories[0.95] += 1
+    elif fraction_mapped < 1.0:
+      self.categories[0.99] += 1
+    else:
+      self.categories[1.0] += 1
+
 
 def InitArguments(parser):
   """ Initialize arguments for the program.
@@ -141,6 +127,10 @@ def InitArguments(parser):
                             'default=%(default)s'))
   parser.add_argument('--ignore_first_n_lines', type=int, default=1,
                       help='Ignore the first n number of lines')
+  parser.add_argument('--cache_dir', type=str, default=None,
+                      help=('directory to cache the category summary of each '
+                            '*basestats file in, so unchanged files are not '
+                            're-parsed. default=<out>_cache'))
 
 
 def CheckArguments(args, parser):
@@ -172,6 +162,8 @@ def CheckArguments(args, parser):
   if (args.out.endswith('.png') or args.out.endswith('.pdf') or
       args.out.endswith('.eps')):
     args.out = args.out[:-4]
+  if args.cache_dir is None:
+    args.cache_dir = args.out + '_cache'
   args.xmax = -sys.maxint
   args.xmin = sys.maxint
   args.ymax = -sys.maxint
@@ -377,7 +369,7 @@ def WriteImage(fig, pdf, args):
 
 
 def ReadDirs(args):
-  """ Read all *basestats files from each directory, return list of deltas.
+  """ Summarize all *basestats files from each directory, return list of deltas.
 
   Args:
     args: an argparse arguments object
@@ -393,10 +385,10 @@ def ReadDirs(args):
     stats[d.label] = d
   files = glob(os.path.join(args.directories[1], '*basestats'))
   for a_file in files:
-    d = FileToData(a_file, args)
-    if d.label not in stats:
+    if os.path.basename(a_file) not in stats:
       # we can't get deltas on things not in the original run.
       continue
+    d = FileToData(a_file, args)
     deltas.append(CreateDelta(stats[d.label], d, args))
   return deltas
 
@@ -407,51 +399,73 @@ def CreateDelta(d1, d2, args):
   delta = Data()
   assert(d1.label == d2.label)
   delta.label = d1.label
-  delta.categories = {0.0: 0, 0.5: 0, 0.9: 0, 0.95: 0, 0.99:0, 1.0:0}
-  delta.d2_categories = {0.0: 0, 0.5: 0, 0.9: 0, 0.95: 0, 0.99:0, 1.0:0}
+  delta.d2_categories = dict((key, 0) for key in CATEGORY_KEYS)
   if args.ratio:
     # normalize the data to 1.0
     for d in [d1, d2]:
       norm = 0.0
-      for key in [0.0, 0.5, 0.9, 0.95, 0.99, 1.0]:
+      for key in CATEGORY_KEYS:
         norm += d.categories[key]
       if norm == 0:
         print d.label
         print d.categories
       assert(norm != 0)
-      for key in [0.0, 0.5, 0.9, 0.95, 0.99, 1.0]:
+      for key in CATEGORY_KEYS:
         d.categories[key] /= float(norm)
-  # for sorting:
-  delta.fraction_mapped = d2.fraction_mapped
   for key in delta.categories:
     delta.categories[key] = d2.categories[key] - d1.categories[key]
     delta.d2_categories[key] = d2.categories[key]
   return delta
 
 
-def FileToData(a_file, args):
-  """ Read A_FILE and return a Data object.
+def SummaryCachePath(a_file, args):
+  """ Return the path the category summary of A_FILE is cached to. The name is
+  keyed on the path, size and modification time of A_FILE and on
+  --ignore_first_n_lines, so a changed file is summarized again.
+  """
+  s = os.stat(a_file)
+  key = '%s:%d:%d:%d' % (os.path.abspath(a_file), s.st_size, int(s.st_mtime),
+                         args.ignore_first_n_lines)
+  return os.path.join(args.cache_dir,
+                      '%s.%s.pickle' % (os.path.basename(a_file),
+                                        hashlib.md5(key).hexdigest()))
+
+
+def SummarizeFile(a_file, args):
+  """ Stream A_FILE once and return a Data object with its category histogram.
+  Only the fraction mapped column (the fourth) of each line is looked at and no
+  rows are kept.
   """
-  num_columns = None
-  f = open(a_file, 'r')
-  rows = []
-  line_number = 0
-  for line in f:
-    line_number += 1
-    line = line.strip()
-    if line.startswith('#'):
-      continue
-    if line_number <= args.ignore_first_n_lines:
-      continue
-    r = Row()
-    r.columns = line.split()
-    r.line_number = line_number
-    rows.append(r)
-  f.close()
   d = Data()
   d.label = os.path.basename(a_file)
-  d.rows = rows
-  d.process_data(args)
+  with open(a_file, 'r') as f:
+    for line_number, line in enumerate(f, 1):
+      line = line.strip()
+      if line.startswith('#') or line_number <= args.ignore_first_n_lines:
+        continue
+      columns = line.split()
+      if columns:
+        d.add_fraction(float(columns[3]))
+  return d
+
+
+def FileToData(a_file, args):
+  """ Return a Data object for A_FILE, from the cached summary if A_FILE has not
+  changed since it was last summarized.
+  """
+  cache_path = SummaryCachePath(a_file, args)
+  if os.path.exists(cache_path):
+    with open(cache_path, 'rb') as f:
+      d = Data()
+      d.label, d.categories = pickle.load(f)
+      return d
+  d = SummarizeFile(a_file, args)
+  if not os.path.exists(args.cache_dir):
+    os.makedirs(args.cache_dir)
+  tmp_path = '%s.%d.tmp' % (cache_path, os.getpid())
+  with open(tmp_path, 'wb') as f:
+    pickle.dump((d.label, d.categories), f, pickle.HIGHEST_PROTOCOL)
+  os.rename(tmp_path, cache_path)
   return d
 
 
@@ -0,0 +1,217 @@
+"""
+Materializes the metrics that the plotting scripts need into one small sqlite database, so that figures can be
+regenerated without rescanning the comparativeAnnotator databases and the attributes file for every
+genome/biotype/gencode set combination. No pipeline stage builds it: run this script once after the comparativeAnnotator
+databases (including bestAlignments.db) are built and before coverage_identity_ok_plots.py or clustering.py, which
+require it through --metricsDir.
+
+Only those two scripts read the store. consensus.py still works from the comparativeAnnotator databases, since it
+needs every candidate alignment and not just the best ones. clustering.py also still loads the full classifier matrix
+with load_data, and the biotype totals from the attributes file, because the store holds neither.
+
+The store has four tables:
+best_alignments: for each genome and source transcript, the highest coverage transMap alignment with its identity,
+    coverage, number of alignments (Paralogy) and whether it is OK under the classifiers for its biotype.
+gencode_sets: the source transcripts in each gencode set, chrY transcripts already removed.
+histograms: raw counts of the coverage, identity and paralogy histograms, keyed by (Genome, Biotype, GencodeSet,
+    Analysis, Bin).
+counts: keyed by (Genome, Biotype, GencodeSet, Classifier). Classifier is Total (number of source transcripts), OK
+    (number whose best alignment is OK) or a classifier name (number whose best alignment fails it).
+"""
+import os
+import re
+import argparse
+import sqlite3 as sql
+
+import numpy as np
+import pandas as pd
+
+from lib.general_lib import mkdir_p
+from lib.attribute_lib import load_attribute_table
+from lib.sql_lib import attach_databases
+
+__author__ = "Ian Fiddes"
+
+# Hard coded bins used for plots.
+paralogy_bins = [0, 1, 2, 3, 4, float('inf')]
+identity_bins = [0, 0.0001, 0.995, 0.998, 0.99999999, 1.0]
+coverage_bins = [0, 0.0001, 0.8, 0.95, 0.99999999, 1.0]
+histogram_bins = {"paralogy": paralogy_bins, "identity": identity_bins, "coverage": coverage_bins}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--genomes", type=str, nargs="+", required=True, help="genomes in this comparison")
+    parser.add_argument("--comparativeAnnotationDir", required=True, help="directory containing databases")
+    parser.add_argument("--attributePath", type=str, required=True, help="attribute tsv file")
+    parser.add_argument("--annotationGps", type=str, nargs="+", required=True, help="genePred of each gencode set")
+    parser.add_argument("--gencodes", type=str, nargs="+", required=True, help="name of each gencode set")
+    parser.add_argument("--outDir", required=True, help="directory to write metrics.db to")
+    return parser.parse_args()
+
+
+def get_metrics_path(out_dir):
+    return os.path.join(out_dir, "metrics.db")
+
+
+def load_gencode_set(gp, filter_chrom=re.compile("(Y)|(chrY)")):
+    """
+    Returns the set of transcript IDs in a gencode genePred, excluding chrY transcripts.
+    """
+    r = set()
+    for l in open(gp):
+        l = l.split("\t")
+        if not filter_chrom.match(l[1]):
+            r.add(l[0])
+    return r
+
+
+def load_biotypes(attr_path):
+    """
+    Returns a Series mapping each transcript ID to its biotype.
+    """
+    return load_attribute_table(attr_path).to_frame().TranscriptType
+
+
+def best_alignments(con, genome, biotypes, coding_classifiers, noncoding_classifiers):
+    """
+    Builds the best_alignments rows for one genome from the best alignment table built with the databases (see
+    sql_lib.write_best_alignments).
+    """
+    cmd = ("SELECT AlignmentId, TranscriptId, AlignmentIdentity, AlignmentCoverage, Paralogy FROM "
+           "best_alignments.'{}'".format(genome))
+    best = pd.read_sql_query(cmd, con)
+    classifiers = sorted(set(coding_classifiers) | set(noncoding_classifiers))
+    cmd = "SELECT AlignmentId, {} FROM main.'{}'".format(", ".join(classifiers), genome)
+    classify = pd.read_sql_query(cmd, con, index_col="AlignmentId").reindex(best.AlignmentId)
+    best = best.set_index("AlignmentId")
+    best["TranscriptType"] = best.TranscriptId.map(biotypes)
+    # same as transmap_ok: a NULL classifier is not OK
+    coding_ok = (classify[coding_classifiers] == 0).all(axis=1)
+    noncoding_ok = (classify[noncoding_classifiers] == 0).all(axis=1)
+    best["Ok"] = np.where(best.TranscriptType == "protein_coding", coding_ok, noncoding_ok).astype(int)
+    best["Genome"] = genome
+    return best.reset_index(), classify.reset_index()
+
+
+def summarize(genome, best, classify, biotype, gencode, filter_set):
+    """
+    Builds the histogram and count rows for one (genome, biotype, gencode set). Source transcripts in filter_set
+    without an alignment count as 0 in every histogram.
+    """
+    best = best[best.TranscriptId.isin(filter_set)]
+    missing = [0] * (len(filter_set) - len(best))
+    key = [genome, biotype, gencode]
+    histograms = []
+    for analysis, col in [["coverage", "AlignmentCoverage"], ["identity", "AlignmentIdentity"],
+                          ["paralogy", "Paralogy"]]:
+        vals = np.concatenate([best[col].fillna(0).values, missing])
+        raw = np.histogram(vals, histogram_bins[analysis])[0]
+        histograms.extend([key + [analysis, i, int(c)] for i, c in enumerate(raw)])
+    counts = [key + ["Total", len(filter_set)], key + ["OK", int(best.Ok.sum())]]
+    failed = classify[classify.AlignmentId.isin(best.AlignmentId)].set_index("AlignmentId") > 0
+    counts.extend([key + [c, int(n)] for c, n in failed.sum().iteritems()])
+    return histograms, counts
+
+
+def build_metrics(comp_ann_path, genomes, attr_path, gencode_gps, coding_classifiers, noncoding_classifiers,
+                  out_path):
+    """
+    Builds the metrics store at out_path. gencode_gps is a dict mapping each gencode set name to its genePred.
+    """
+    biotypes = load_biotypes(attr_path)
+    gencode_sets = {gencode: load_gencode_set(gp) for gencode, gp in gencode_gps.iteritems()}
+    biotype_sets = {biotype: set(ids) for biotype, ids in biotypes.groupby(biotypes).groups.iteritems()}
+    con, cur = attach_databases(comp_ann_path)
+    all_best = []
+    histograms = []
+    counts = []
+    for genome in genomes:
+        best, classify = best_alignments(con, genome, biotypes, coding_classifiers, noncoding_classifiers)
+        all_best.append(best)
+        for (gencode, gencode_ids), (biotype, biotype_ids) in ((x, y) for x in gencode_sets.iteritems() for y in
+                                                               biotype_sets.iteritems()):
+            h, c = summarize(genome, best, classify, biotype, gencode, gencode_ids & biotype_ids)
+            histograms.extend(h)
+            counts.extend(c)
+    con.close()
+    tmp_path = "{}.{}.tmp".format(out_path, os.getpid())
+    out_con = sql.connect(tmp_path)
+    pd.concat(all_best, ignore_index=True).to_sql("best_alignments", out_con, index=False)
+    pd.DataFrame([[gencode, x] for gencode, ids in gencode_sets.iteritems() for x in ids],
+                 columns=["GencodeSet", "TranscriptId"]).to_sql("gencode_sets", out_con, index=False)
+    pd.DataFrame(histograms, columns=["Genome", "Biotype", "GencodeSet", "Analysis", "Bin", "Count"]).to_sql(
+        "histograms", out_con, index=False)
+    pd.DataFrame(counts, columns=["Genome", "Biotype", "GencodeSet", "Classifier", "Count"]).to_sql(
+        "counts", out_con, index=False)
+    out_con.execute("CREATE INDEX best_alignments_genome ON best_alignments (Genome, TranscriptType)")
+    out_con.commit()
+    out_con.close()
+    os.rename(tmp_path, out_path)
+
+
+def get_best_alignments(con, genome, biotype=None):
+    """
+    Returns a dict mapping each source transcript ID to the (aln_id, identity, coverage) of its best alignment in
+    genome, like highest_cov_aln. Can be restricted by biotype.
+    """
+    cmd = "SELECT TranscriptId, AlignmentId, AlignmentIdentity, AlignmentCoverage FROM best_alignments WHERE Genome = ?"
+    vals = [genome]
+    if biotype is not None:
+        cmd += " AND TranscriptType = ?"
+        vals.append(biotype)
+    return {x[0]: x[1:] for x in con.execute(cmd, vals)}
+
+
+def get_not_ok_alignments(con, genome, biotype):
+    """
+    Returns the set of best alignment IDs in genome for this biotype that are not OK.
+    """
+    cmd = "SELECT AlignmentId FROM best_alignments WHERE Genome = ? AND TranscriptType = ? AND Ok = 0"
+    return {x[0] for x in con.execute(cmd, [genome, biotype])}
+
+
+def get_histogram(con, genome, biotype, gencode, analysis):
+    """
+    Returns the raw histogram counts for analysis (coverage, identity or paralogy) as a numpy array.
+    """
+    cmd = ("SELECT Count FROM histograms WHERE Genome = ? AND Biotype = ? AND GencodeSet = ? AND Analysis = ? "
+           "ORDER BY Bin")
+    return np.array([x[0] for x in con.execute(cmd, [genome, biotype, gencode, analysis])])
+
+
+def get_count(con, genome, biotype, gencode, classifier):
+    """
+    Returns one value from the counts table. 0 if it does not exist.
+    """
+    cmd = "SELECT Count FROM counts WHERE Genome = ? AND Biotype = ? AND GencodeSet = ? AND Classifier = ?"
+    r = con.execute(cmd, [genome, biotype, gencode, classifier]).fetchone()
+    return r[0] if r is not None else 0
+
+
+def get_gencode_set(con, gencode):
+    """
+    Returns the set of source transcript IDs in this gencode set, chrY transcripts excluded.
+    """
+    return {x[0] for x in con.execute("SELECT TranscriptId FROM gencode_sets WHERE GencodeSet = ?", [gencode])}
+
+
+def get_biotypes(con, gencode):
+    """
+    Returns the biotypes present in the store for this gencode set.
+    """
+    return {x[0] for x in con.execute("SELECT DISTINCT Biotype FROM counts WHERE GencodeSet = ?", [gencode])}
+
+
+def main():
+    from config import tm_coding_classifiers, tm_noncoding_classifiers
+    args = parse_args()
+    assert len(args.annotationGps) == len(args.gencodes)
+    mkdir_p(args.outDir)
+    build_metrics(args.comparativeAnnotationDir, args.genomes, args.attributePath,
+                  dict(zip(args.gencodes, args.annotationGps)), tm_coding_classifiers, tm_noncoding_classifiers,
+                  get_metrics_path(args.outDir))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,10 @@ import os
 import itertools
 import math
 import re
+import inspect
+import hashlib
+import multiprocessing
+import cPickle as pickle
 import numpy as np
 from collections import defaultdict, OrderedDict
 
@@ -16,9 +20,12 @@ import matplotlib.patches as mpatches
 import matplotlib.pyplot as plt
 import matplotlib.pylab as pylab
 import matplotlib.backends.backend_pdf as plt_back
+from scipy.cluster.hierarchy import dendrogram
 
 from lib.psl_lib import remove_alignment_number, remove_augustus_alignment_number
-from lib.general_lib import skip_header
+from lib.attribute_lib import load_attribute_table
+from lib.cluster_lib import cluster_columns
+from lib.sql_lib import compile_query
 
 from config import *
 
@@ -36,31 +43,25 @@ def get_all_biotypes(attr_path):
     """
     Returns all biotypes in the attribute database.
     """
-    return {x.split()[4] for x in skip_header(attr_path)}
+    return load_attribute_table(attr_path).get_biotypes()
 
 
 def transmap_ok(cur, genome, classify_fields):
     """
     Finds all aIds which are 'OK' based on the classify_fields below
     """
-    cmd = """SELECT AlignmentId FROM main.'{0}' WHERE (""".format(genome)
-    for col in classify_fields[:-1]:
-        cmd += " {} = ? {}".format(col, "AND")
-    cmd += " {} = ? )".format(classify_fields[-1])
-    vals = [0] * len(classify_fields)
-    return {x[0] for x in cur.execute(cmd, vals).fetchall()}
+    q = compile_query([("main", "AlignmentId")], ["main"], classify_fields, ["AND"] * (len(classify_fields) - 1),
+                      name="transmap_ok")
+    return {x[0] for x in q.execute(cur, genome, [0] * len(classify_fields))}
 
 
 def augustus_ok(cur, genome):
     """
     Finds all aug_aIds which are 'OK' as defined by the fields in aug_ok_fields
     """
-    cmd = """SELECT augustus.'{0}'.'AlignmentId' FROM augustus.'{0}' WHERE (""".format(genome)
-    for col in aug_ok_fields[:-1]:
-        cmd += " augustus.'{}'.'{}' = ? {}".format(genome, col, "AND")
-    cmd += " augustus.'{}'.'{}' = ?)".format(genome, aug_ok_fields[-1])
-    vals = [0] * len(aug_ok_fields)
-    return {x[0] for x in cur.execute(cmd, vals).fetchall()}
+    q = compile_query([("augustus", "AlignmentId")], ["augustus"], aug_ok_fields, ["AND"] * (len(aug_ok_fields) - 1),
+                      name="augustus_ok")
+    return {x[0] for x in q.execute(cur, genome, [0] * len(aug_ok_fields))}
 
 
 def get_all_ok(cur, genome, tm_classifiers):
@@ -72,35 +73,26 @@ def get_all_ok(cur, genome, tm_classifiers):
 
 def highest_cov_aln(cur, genome):
     """
-    Returns the set of alignment IDs that represent the best alignment for each source transcript (that mapped over)
-    Best is defined as highest %COV. Also reports the associated coverage value.
+    Returns the best alignment for each source transcript (that mapped over) as a dictionary mapping the source
+    transcript ID to [aln_id, %ID, %COV]. Best is defined as highest %COV. Read from the best_alignments database built
+    alongside attributes.db.
     """
-    tm_stats = get_tm_stats(cur, genome)  # dictionary mapping each aln_id to [aln_id, %ID, %COV]
-    combined_covs = defaultdict(list)
-    for aln_id, ident, cov in tm_stats.itervalues():
-        tx_id = strip_alignment_numbers(aln_id)
-        combined_covs[tx_id].append([aln_id, ident, cov])
-    best_cov = {}
-    for tx_id, vals in combined_covs.iteritems():
-        best_cov[tx_id] = sorted(vals, key=lambda x: -x[2])[0]
-    return best_cov
+    cmd = "SELECT TranscriptId, AlignmentId, AlignmentIdentity, AlignmentCoverage FROM best_alignments.'{}'".format(
+        genome)
+    return {x[0]: list(x[1:]) for x in cur.execute(cmd)}
 
 
 def get_all_ids(attr_path, biotype=None, filter_set=set(), id_type="Transcript"):
     """
-    returns the set of ensembl IDs in the entire Gencode database pulled from the attribute
+    returns the set of ensembl IDs in the entire Gencode database pulled from the attribute file, minus any IDs in
+    filter_set
     """
     assert id_type in ["Transcript", "Gene"]
+    table = load_attribute_table(attr_path)
     if id_type == "Transcript":
-        if biotype is None:
-            return {x.split()[3] for x in skip_header(attr_path) if x not in filter_set}
-        else:
-            return {x.split()[3] for x in skip_header(attr_path) if x.split()[4] == biotype if x not in filter_set}
+        return table.get_transcript_ids(biotype) - filter_set
     else:
-        if biotype is None:
-            return {x.split()[0] for x in skip_header(attr_path) if x not in filter_set}
-        else:
-            return {x.split()[0] for x in skip_header(attr_path) if x.split()[4] == biotype if x not in filter_set}
+        return table.get_gene_ids(biotype) - filter_set
 
 
 def get_gp_ids(gp):
@@ -159,14 +151,14 @@ def get_gene_biotype_map(attr_path):
     """
     Returns a dictionary mapping all gene IDs to their respective biotypes
     """
-    return {x.split()[0]: x.split()[2] for x in skip_header(attr_path)}
+    return load_attribute_table(attr_path).get_gene_biotype_map()
 
 
 def get_gene_map(attr_path):
     """
     Returns a dictionary mapping all transcript IDs to their respective gene IDs
     """
-    return {x.split()[3]: x.split()[0] for x in skip_header(attr_path)}
+    return load_attribute_table(attr_path).get_gene_map()
 
 
 def get_tm_stats(cur, genome):
@@ -307,3 +299,80 @@ def stacked_barplot(results, legend_labels, out_path, file_name, title_string, c
     fig.savefig(pdf, format='pdf')
     pdf.close()
     plt.close()
+
+
+def dendrogram_plot(m, out_path, file_name, title_string):
+    """
+    Hierarchically clusters the columns of a boolean DataFrame by binary distance (Ward's method) and plots the
+    dendrogram. Replaces cluster.R, so no temporary CSV or R process is needed.
+    """
+    fit = cluster_columns(m)
+    fig, pdf = init_image(out_path, file_name, width, height)
+    ax = fig.add_axes([0.1, 0.3, 0.85, 0.55])
+    dendrogram(fit, labels=list(m.columns), ax=ax, leaf_rotation=90, color_threshold=0)
+    ax.set_title(title_string, fontsize=10)
+    ax.set_xlabel("Binary clustering (Ward's Method)")
+    ax.set_ylabel("Distance")
+    fig.savefig(pdf, format='pdf')
+    pdf.close()
+    plt.close()
+
+
+def render_figure(job):
+    """
+    Renders one queued figure and records the hash of its inputs next to it. Ran in a worker process.
+    """
+    plot_fn, args, kwargs, pdf_path, digest = job
+    plot_fn(*args, **kwargs)
+    with open(pdf_path + ".md5", "w") as outf:
+        outf.write(digest)
+    return pdf_path
+
+
+class FigureQueue(object):
+    """
+    Collects independent figures and renders them together in a process pool. Each figure is keyed on a hash of the
+    plotting function's source and all of its arguments including defaults (data, labels, title, palette), stored in a
+    .md5 file next to the PDF, so a figure whose inputs have not changed since the last run is not drawn again. Plotting functions must take
+    out_path and file_name arguments like barplot and stacked_barplot do.
+    """
+    def __init__(self, num_processes=1):
+        self.num_processes = num_processes
+        self.jobs = []
+
+    def add(self, plot_fn, *args, **kwargs):
+        """
+        Queues plot_fn(*args, **kwargs).
+        """
+        call_args = inspect.getcallargs(plot_fn, *args, **kwargs)
+        pdf_path = os.path.join(call_args["out_path"], call_args["file_name"] + ".pdf")
+        try:
+            source = inspect.getsource(plot_fn)
+        except (IOError, TypeError):
+            source = plot_fn.__code__.co_code
+        digest = hashlib.md5(pickle.dumps((plot_fn.__name__, source, sorted(call_args.items())), 2)).hexdigest()
+        self.jobs.append((plot_fn, args, kwargs, pdf_path, digest))
+
+    def is_current(self, job):
+        """
+        Returns True if the PDF for job exists and was rendered from the same inputs.
+        """
+        pdf_path, digest = job[3:]
+        if not os.path.exists(pdf_path) or not os.path.exists(pdf_path + ".md5"):
+            return False
+        with open(pdf_path + ".md5") as inf:
+            return inf.read() == digest
+
+    def run(self):
+        """
+        Renders all queued figures that are not current. Returns the list of PDFs that were rendered.
+        """
+        jobs = [x for x in self.jobs if not self.is_current(x)]
+        self.jobs = []
+        if self.num_processes <= 1 or len(jobs) <= 1:
+            return map(render_figure, jobs)
+        pool = multiprocessing.Pool(min(self.num_processes, len(jobs)))
+        rendered = pool.map(render_figure, jobs)
+        pool.close()
+        pool.join()
+        return rendered
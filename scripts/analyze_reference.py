@@ -1,8 +1,11 @@
 """
-This script runs a specific subset of classifiers on the reference. This script is designed to run without jobTree
-and can be applied to any genePred (is not comparative).
+This script runs a specific subset of classifiers on the reference. This script can be run standalone without jobTree
+and can be applied to any genePred (is not comparative). The pipeline runs it once per reference/annotation version
+through analyze_reference(), which also writes the reference store (see lib/reference_lib.py) that the per-genome
+classifiers look reference properties up in.
 """
 
+import os
 import sys
 import re
 import argparse
@@ -10,6 +13,8 @@ import itertools
 from collections import defaultdict
 import lib.seq_lib as seq_lib
 import lib.sql_lib as sql_lib
+import lib.reference_lib as reference_lib
+from lib.general_lib import mkdir_p
 
 
 def parse_args():
@@ -64,7 +69,7 @@ def StartOutOfFrame(transcript_dict, seq_dict):
     classify_dict = {}
     details_dict = {}
     for ens_id, t in transcript_iterator(transcript_dict):
-        if t.getCdsLength() <= 75:
+        if t.get_cds_length() <= 75:
             continue
         t_frames = [x for x in t.exon_frames if x != -1]
         if t.strand is True and t_frames[0] != 0 or t.strand is False and t_frames[-1] != 0:
@@ -167,7 +172,7 @@ def base_splice(transcript_dict, seq_dict, inequality, short_intron_size, splice
     classify_dict = {}
     details_dict = defaultdict(list)
     for ens_id, t in transcript_iterator(transcript_dict):
-        for intron in t.intronIntervals:
+        for intron in t.intron_intervals:
             if len(intron) <= short_intron_size:
                 continue
             elif inequality(intron, t):
@@ -208,7 +213,7 @@ def InFrameStop(transcript_dict, seq_dict):
     details_dict = defaultdict(list)
     for ens_id, t in transcript_iterator(transcript_dict):
         cds = t.get_cds(seq_dict)
-        offset = seq_lib.find_offset(t.exonFrames, t.strand)
+        offset = seq_lib.find_offset(t.exon_frames, t.strand)
         for i, codon in seq_lib.read_codons_with_position(cds, offset, skip_last=True):
             amino_acid = seq_lib.codon_to_amino_acid(codon)
             if amino_acid == "*":
@@ -224,9 +229,9 @@ def ShortCds(transcript_dict, seq_dict, cds_cutoff=75):
     classify_dict = {}
     details_dict = {}
     for ens_id, t in transcript_iterator(transcript_dict):
-        if t.getCdsLength() < 3:
+        if t.get_cds_length() < 3:
             continue
-        elif t.getCdsLength() <= cds_cutoff:
+        elif t.get_cds_length() <= cds_cutoff:
             classify_dict[ens_id] = 1
             details_dict[ens_id] = seq_lib.transcript_to_bed(t, rgb, sys._getframe().f_code.co_name)
         else:
@@ -279,19 +284,36 @@ def get_ids(gp):
     return {x.split()[0] for x in open(gp)}
 
 
-def main():
-    args = parse_args()
-    classifiers = [AbutsUnknownBases, StartOutOfFrame, BadFrame, BeginStart, EndStop, CdsGap, UtrGap, UnknownGap,
-                   CdsNonCanonSplice, CdsUnknownSplice, UtrNonCanonSplice, UtrUnknownSplice, InFrameStop, ShortCds,
-                   UnknownBases]
+classifiers = [AbutsUnknownBases, StartOutOfFrame, BadFrame, BeginStart, EndStop, CdsGap, UtrGap, UnknownGap,
+               CdsNonCanonSplice, CdsUnknownSplice, UtrNonCanonSplice, UtrUnknownSplice, InFrameStop, ShortCds,
+               UnknownBases]
+
+
+def analyze_reference(ref_gp, ref_fasta, ref_genome, out_dir, ref_store):
+    """
+    Runs the reference classifiers, writing classify.db and details.db to out_dir, then writes the reference store
+    to ref_store. The store is written last so that its existence means that this reference/annotation version has
+    been completely analyzed.
+    """
+    mkdir_p(out_dir)
+    transcript_dict = get_transcript_dict(ref_gp)
+    seq_dict = seq_lib.get_sequence_dict(ref_fasta)
     classify_dicts = {}
     details_dicts = {}
-    fn_args = {"transcript_dict": get_transcript_dict(args.refGp), "seq_dict": seq_lib.get_sequence_dict(args.refFasta)}
     for fn in classifiers:
-        classify_dicts[fn.__name__], details_dicts[fn.__name__] = fn(**fn_args)
-    for data_dict, database_path in itertools.izip(*[[classify_dicts, details_dicts], ["classify.db", "details.db"]]):
-        sql_lib.write_dict(data_dict, database_path, args.refGenome)
+        classify_dicts[fn.__name__], details_dicts[fn.__name__] = fn(transcript_dict=transcript_dict,
+                                                                     seq_dict=seq_dict)
+    for data_dict, database in itertools.izip(*[[classify_dicts, details_dicts], ["classify.db", "details.db"]]):
+        sql_lib.write_dict(data_dict, os.path.join(out_dir, database), ref_genome)
+    reference_dict = reference_lib.reference_dict_from_transcripts(transcript_dict.itervalues(), seq_dict)
+    reference_lib.write_reference_dict(reference_dict, ref_store)
+
+
+def main():
+    args = parse_args()
+    ref_store = reference_lib.get_reference_store_path(args.outDir, args.refGenome, args.refGp, args.refFasta)
+    analyze_reference(args.refGp, args.refFasta, args.refGenome, args.outDir, ref_store)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -8,6 +8,9 @@ from jobTree.scriptTree.target import Target
 
 import lib.seq_lib as seq_lib
 import lib.psl_lib as psl_lib
+import lib.reference_lib as reference_lib
+import lib.comp_ann_lib as comp_ann_lib
+import lib.attribute_lib as attribute_lib
 
 __author__ = "Ian Fiddes"
 
@@ -23,7 +26,7 @@ class AbstractClassifier(Target):
               }
 
     def __init__(self, genome, aln_psl, fasta, ref_fasta, annotation_gp, gencode_attributes, target_gp, ref_genome,
-outDir):
+outDir, ref_store=None):
         # sanity check
         assert all([genome in x for x in [aln_psl, fasta, target_gp]])
         # initialize the Target
@@ -38,6 +41,8 @@ outDir):
         self.gencodeAttributeMap = gencode_attributes
         self.targetGp = target_gp
         self.annotationGp = annotation_gp
+        # path to the precomputed reference store built by reference_lib. None means compute it in this process.
+        self.refStore = ref_store
         self.outDir = os.path.join(outDir, self.genome)
         if not os.path.exists(outDir):
             os.mkdir(outDir)
@@ -46,7 +51,7 @@ outDir):
 
     def getTranscriptDict(self):
         self.transcripts = seq_lib.get_gene_pred_transcripts(self.targetGp)
-        self.transcriptDict = seq_lib.transcript_list_to_dict(self.transcripts, noDuplicates=True)
+        self.transcriptDict = seq_lib.transcript_list_to_dict(self.transcripts)
 
     def getRefDict(self):
         self.refDict = seq_lib.get_sequence_dict(self.refFasta)
@@ -56,11 +61,21 @@ outDir):
 
     def getAlignmentDict(self):
         self.psls = psl_lib.read_psl(self.alnPsl)
-        self.alignmentDict = psl_lib.get_psl_dict(self.psls, noDuplicates=True)
+        self.alignmentDict = psl_lib.get_psl_dict(self.psls)
 
     def getAnnotationDict(self):
         self.annotations = seq_lib.get_gene_pred_transcripts(self.annotationGp)
-        self.annotationDict = seq_lib.transcript_list_to_dict(self.annotations, noDuplicates=True)
+        self.annotationDict = seq_lib.transcript_list_to_dict(self.annotations)
+
+    def getReferenceAnnotationDict(self):
+        """
+        Loads the reference-side properties of each source transcript. These are shared by every alignment of every
+        genome and so are precomputed once by the pipeline if possible.
+        """
+        if self.refStore is not None and os.path.exists(self.refStore):
+            self.referenceAnnotationDict = reference_lib.load_reference_dict(self.refStore)
+        else:
+            self.referenceAnnotationDict = reference_lib.build_reference_dict(self.annotationGp, self.refFasta)
 
     @property
     def column(self):
@@ -89,17 +104,87 @@ class AbstractAugustusClassifier(AbstractClassifier):
 
     def getAugustusTranscriptDict(self):
         self.augustusTranscripts = seq_lib.get_gene_pred_transcripts(self.augustusGp)
-        self.augustusTranscriptDict = seq_lib.transcript_list_to_dict(self.augustusTranscripts, noDuplicates=True)
+        self.augustusTranscriptDict = seq_lib.transcript_list_to_dict(self.augustusTranscripts)
+
+    def getAugustusPairs(self):
+        """
+        Joins each Augustus transcript to its transMap transcript. See comp_ann_lib.AugustusPair.
+        """
+        self.getAugustusTranscriptDict()
+        self.getTranscriptDict()
+        self.augustusPairs = comp_ann_lib.build_augustus_pairs(self.augustusTranscripts, self.transcriptDict)
+
+    def classifyPair(self, pair):
+        """
+        Classifies one AugustusPair. Returns a (classify value, details) tuple, where details is None or the BED
+        record(s) to report, or returns None if this pair is not classified.
+        """
+        raise NotImplementedError
+
+    def initializeValueDicts(self):
+        self.classifyDict = {}
+        self.detailsDict = {}
+
+    def addPair(self, pair):
+        """
+        Classifies pair and records the result in classifyDict/detailsDict.
+        """
+        r = self.classifyPair(pair)
+        if r is None:
+            return
+        value, details = r
+        self.classifyDict[pair.aug_aId] = value
+        if details:
+            self.detailsDict[pair.aug_aId] = details
+
+    def dumpResults(self):
+        self.dumpValueDicts(self.classifyDict, self.detailsDict)
+
+    def run(self):
+        self.getAugustusPairs()
+        self.initializeValueDicts()
+        for pair in self.augustusPairs:
+            self.addPair(pair)
+        self.dumpResults()
 
 
 class Attribute(AbstractClassifier):
     """Need to overwrite the dumpValueDict method for attributes"""
     def getAttributeDict(self):
-        self.attributeDict = seq_lib.get_transcript_attribute_dict(self.gencodeAttributeMap)
+        self.attributeDict = attribute_lib.load_attribute_table(self.gencodeAttributeMap).get_attribute_dict()
 
     def dumpValueDict(self, valueDict):
         """
         Dumps a attribute dict.
         """
         with open(os.path.join(self.outDir, "Attribute" + self.column + self.genome), "wb") as outf:
-            pickle.dump(valueDict, outf)
\ No newline at end of file
+            pickle.dump(valueDict, outf)
+
+
+class AbstractAugustusAttribute(AbstractAugustusClassifier, Attribute):
+    """
+    Base class for attributes of Augustus transcripts that are derived by comparing each Augustus transcript to the
+    transMap alignment it was predicted from. Both lie on the target genome, so they are compared directly in
+    chromosome coordinates. Like the Augustus classifiers, each attribute handles one AugustusPair at a time so that
+    all of them can be evaluated in the same pass.
+    """
+    def attributePair(self, pair):
+        """
+        Returns the value of this attribute for one AugustusPair whose transMap transcript is present.
+        pair.comparison() holds the TranscriptComparison of the two transcripts.
+        """
+        raise NotImplementedError
+
+    def initializeValueDicts(self):
+        self.valueDict = {}
+
+    def addPair(self, pair):
+        """
+        Records the value of this attribute for pair. Augustus transcripts whose transMap transcript is not present
+        are skipped.
+        """
+        if pair.t is not None:
+            self.valueDict[pair.aug_aId] = self.attributePair(pair)
+
+    def dumpResults(self):
+        self.dumpValueDict(self.valueDict)
@@ -1,7 +1,9 @@
 """
-This is the main driver script for comparativeAnnotator in transMap mode.
+This is the main driver script for comparativeAnnotator in transMap mode. Several genomes can be run together; the
+reference is analyzed once before any of them start.
 """
 
+import os
 import argparse
 
 from jobTree.scriptTree.target import Target
@@ -9,7 +11,9 @@ from jobTree.scriptTree.stack import Stack
 
 from sonLib.bioio import TempFileTree
 
-from lib.general_lib import classes_in_module
+from lib.general_lib import classes_in_module, mkdir_p
+import lib.reference_lib as reference_lib
+from scripts.analyze_reference import analyze_reference
 
 import src.classifiers
 import src.attributes
@@ -25,27 +29,53 @@ def build_parser():
     """
     parser = argparse.ArgumentParser()
     parser.add_argument('--refGenome', type=str, required=True)
-    parser.add_argument('--genome', required=True)
+    parser.add_argument('--genome', nargs="+", required=True,
+                        help="One or more target genomes. The per-genome arguments are given in the same order")
     parser.add_argument('--annotationGp', required=True)
-    parser.add_argument('--psl', required=True)
-    parser.add_argument('--gp', required=True)
-    parser.add_argument('--fasta', required=True)
+    parser.add_argument('--psl', nargs="+", required=True)
+    parser.add_argument('--gp', nargs="+", required=True)
+    parser.add_argument('--fasta', nargs="+", required=True)
     parser.add_argument('--refFasta', type=str, required=True)
-    parser.add_argument('--sizes', required=True)
+    parser.add_argument('--sizes', nargs="+", required=True)
     parser.add_argument('--gencodeAttributes', required=True)
     parser.add_argument('--outDir', type=str, required=True)
     return parser
 
 
+def run_pipeline(target, ref_genome, genomes, annotation_gp, psls, gps, fastas, ref_fasta, sizes, gencode_attributes,
+                 out_dir):
+    # the reference is analyzed and its properties stored once per annotation version, before any genome is started
+    store_dir = os.path.join(out_dir, "reference")
+    mkdir_p(store_dir)
+    ref_store = reference_lib.get_reference_store_path(store_dir, ref_genome, annotation_gp, ref_fasta)
+    if not os.path.exists(ref_store):
+        target.addChildTargetFn(run_reference_analysis, memory=8 * (1024 ** 3),
+                                args=(ref_genome, annotation_gp, ref_fasta, store_dir, ref_store))
+    target.setFollowOnTargetFn(fan_out, args=(ref_genome, genomes, annotation_gp, psls, gps, fastas, ref_fasta, sizes,
+                                              gencode_attributes, out_dir, ref_store))
+
+
+def run_reference_analysis(target, ref_genome, annotation_gp, ref_fasta, store_dir, ref_store):
+    analyze_reference(annotation_gp, ref_fasta, ref_genome, store_dir, ref_store)
+
+
+def fan_out(target, ref_genome, genomes, annotation_gp, psls, gps, fastas, ref_fasta, sizes, gencode_attributes,
+            out_dir, ref_store):
+    assert len(genomes) == len(psls) == len(gps) == len(fastas) == len(sizes), "need one of each input per genome"
+    for genome, psl, gp, fasta, genome_sizes in zip(genomes, psls, gps, fastas, sizes):
+        target.addChildTargetFn(build_analyses, args=(ref_genome, genome, annotation_gp, psl, gp, fasta, ref_fasta,
+                                                      genome_sizes, gencode_attributes, out_dir, ref_store))
+
+
 def build_analyses(target, ref_genome, genome, annotation_gp, psl, gp, fasta, ref_fasta, sizes, gencode_attributes,
-                   out_dir):
+                   out_dir, ref_store):
     # find all user-defined classes in the categories of analyses
     out_file_tree = TempFileTree(target.getGlobalTempDir())
     classifiers = classes_in_module(src.classifiers)
     attributes = classes_in_module(src.attributes)
     for classifier in classifiers:
         target.addChildTarget(classifier(genome, psl, fasta, ref_fasta, annotation_gp, gencode_attributes, gp,
-                                         ref_genome, out_file_tree))
+                                         ref_genome, out_file_tree, ref_store))
     for attribute in attributes:
         target.addChildTarget(attribute(genome, psl, fasta, ref_fasta, annotation_gp, gencode_attributes, gp,
                                         ref_genome, out_file_tree))
@@ -55,7 +85,7 @@ def build_analyses(target, ref_genome, genome, annotation_gp, psl, gp, fasta, re
 
 
 def database(target, out_dir, genome, psl, sizes, gp, annotation_gp, out_file_tree):
-    target.addChildTarget(ConstructDatabases(out_dir, out_file_tree, genome, psl))
+    target.addChildTarget(ConstructDatabases(out_dir, out_file_tree, [genome], [psl], "AlignmentId"))
     target.setFollowOnTarget(BuildTracks(out_dir, genome, sizes, gp, annotation_gp))
 
 
@@ -63,9 +93,9 @@ def main():
     parser = build_parser()
     Stack.addJobTreeOptions(parser)
     args = parser.parse_args()
-    i = Stack(Target.makeTargetFn(build_analyses, args=(args.refGenome, args.genome, args.annotationGp, args.psl,
-                                                        args.gp, args.fasta, args.refFasta, args.sizes,
-                                                        args.gencodeAttributes, args.outDir))).startJobTree(args)
+    i = Stack(Target.makeTargetFn(run_pipeline, args=(args.refGenome, args.genome, args.annotationGp, args.psl,
+                                                      args.gp, args.fasta, args.refFasta, args.sizes,
+                                                      args.gencodeAttributes, args.outDir))).startJobTree(args)
     if i != 0:
         raise RuntimeError("Got failed jobs")
 
@@ -12,7 +12,9 @@ from sonLib.bioio import TempFileTree
 from lib.general_lib import classes_in_module
 
 import src.augustus_classifiers
-from src.construct_databases import ConstructDatabases
+import src.augustus_attributes
+from src.augustus_classifier_pass import AugustusClassifierPass
+from src.construct_databases import ConstructAugustusDatabases
 from src.build_tracks import BuildTracks
 
 __author__ = "Ian Fiddes"
@@ -41,17 +43,17 @@ def build_analyses(target, ref_genome, genome, annotation_gp, psl, gp, aug_gp, f
                    gencode_attributes, out_dir):
     # find all user-defined classes in the categories of analyses
     out_file_tree = TempFileTree(target.getGlobalTempDir())
-    classifiers = classes_in_module(src.augustus_classifiers)
-    for classifier in classifiers:
-        target.addChildTarget(classifier(genome, psl, fasta, ref_fasta, annotation_gp, gencode_attributes, gp,
-                                         ref_genome, out_file_tree, aug_gp))
-        # merge the resulting pickled files into sqlite databases and construct BED tracks
+    args = (genome, psl, fasta, ref_fasta, annotation_gp, gencode_attributes, gp, ref_genome, out_file_tree, aug_gp)
+    # the classifiers and attributes share one join of the Augustus and transMap transcripts
+    classifiers = classes_in_module(src.augustus_classifiers) + classes_in_module(src.augustus_attributes)
+    target.addChildTarget(AugustusClassifierPass(classifiers, *args))
+    # merge the resulting pickled files into sqlite databases and construct BED tracks
     target.setFollowOnTargetFn(database, memory=8 * (1024 ** 3),
-                               args=(out_dir, genome, psl, sizes, gp, annotation_gp, out_file_tree))
+                               args=(out_dir, genome, psl, sizes, gp, aug_gp, annotation_gp, out_file_tree))
 
 
-def database(target, out_dir, genome, psl, sizes, gp, annotation_gp, out_file_tree):
-    target.addChildTarget(ConstructDatabases(out_dir, out_file_tree, genome, psl))
+def database(target, out_dir, genome, psl, sizes, gp, aug_gp, annotation_gp, out_file_tree):
+    target.addChildTarget(ConstructAugustusDatabases(out_dir, out_file_tree, [genome], [aug_gp], "AlignmentId"))
     target.setFollowOnTarget(BuildTracks(out_dir, genome, sizes, gp, annotation_gp))
 
 
@@ -1,6 +1,6 @@
-from src.abstractClassifier import Attribute
+from src.abstract_classifier import Attribute
 
-import lib.sequence_lib as seq_lib
+import lib.seq_lib as seq_lib
 import lib.psl_lib as psl_lib
 from lib.general_lib import format_ratio
 
@@ -30,7 +30,8 @@ class GeneId(Attribute):
     def run(self):
         self.getAttributeDict()
         self.getAlignmentDict()
-        valueDict = {aId: self.attributeDict[psl_lib.remove_alignment_number(aId)].geneId for aId in self.alignmentDict}
+        valueDict = {aId: self.attributeDict[psl_lib.remove_alignment_number(aId)].gene_id for aId in
+                     self.alignmentDict}
         self.dumpValueDict(valueDict)
 
 
@@ -45,7 +46,8 @@ class GeneName(Attribute):
     def run(self):
         self.getAttributeDict()
         self.getAlignmentDict()
-        valueDict = {aId: self.attributeDict[psl_lib.remove_alignment_number(aId)].geneName for aId in self.alignmentDict}
+        valueDict = {aId: self.attributeDict[psl_lib.remove_alignment_number(aId)].gene_name for aId in
+                     self.alignmentDict}
         self.dumpValueDict(valueDict)
 
 
@@ -60,7 +62,8 @@ class GeneType(Attribute):
     def run(self):
         self.getAttributeDict()
         self.getAlignmentDict()
-        valueDict = {aId: self.attributeDict[psl_lib.remove_alignment_number(aId)].geneType for aId in self.alignmentDict}
+        valueDict = {aId: self.attributeDict[psl_lib.remove_alignment_number(aId)].gene_type for aId in
+                     self.alignmentDict}
         self.dumpValueDict(valueDict)
 
 
@@ -75,7 +78,7 @@ class TranscriptType(Attribute):
     def run(self):
         self.getAttributeDict()
         self.getAlignmentDict()
-        valueDict = {aId: self.attributeDict[psl_lib.remove_alignment_number(aId)].transcriptType for aId in
+        valueDict = {aId: self.attributeDict[psl_lib.remove_alignment_number(aId)].transcript_type for aId in
                      self.alignmentDict}
         self.dumpValueDict(valueDict)
 
@@ -0,0 +1,39 @@
+"""
+Attributes of Augustus transcripts, computed by comparing each Augustus transcript to its source transMap alignment
+in target genome coordinates. They are evaluated in the same pass as the Augustus classifiers, see
+src.augustus_classifier_pass. The identity and coverage used in consensus still come from aligning the Augustus mRNA
+to the reference with blat (align_augustus.py).
+"""
+from src.abstract_classifier import AbstractAugustusAttribute
+
+__author__ = "Ian Fiddes"
+
+
+class AugustusExonOverlap(AbstractAugustusAttribute):
+    """
+    Exonic bases shared by the Augustus transcript and its transMap alignment, over the exonic bases in either.
+
+    Reports the value as a REAL between 0 and 1
+    """
+    @staticmethod
+    def dataType():
+        return "REAL"
+
+    def attributePair(self, pair):
+        return pair.comparison().exon_overlap()
+
+
+class AugustusFrameAgreement(AbstractAugustusAttribute):
+    """
+    Fraction of the coding bases shared by the Augustus transcript and its transMap alignment that are read in the
+    same frame by both. NaN if they share no coding bases.
+
+    Reports the value as a REAL between 0 and 1
+    """
+    @staticmethod
+    def dataType():
+        return "REAL"
+
+    def attributePair(self, pair):
+        return pair.comparison().frame_agreement()
+
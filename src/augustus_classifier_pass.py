@@ -0,0 +1,30 @@
+"""
+Runs all of the Augustus classifiers and attributes in one pass. The Augustus and transMap genePreds are loaded and
+joined once, then every classifier and attribute handles each pair in turn. The results are dumped per classifier or
+attribute exactly as if each had been run as its own target, so ConstructAugustusDatabases is unchanged.
+"""
+from src.abstract_classifier import AbstractAugustusClassifier
+
+__author__ = "Ian Fiddes"
+
+
+class AugustusClassifierPass(AbstractAugustusClassifier):
+    """
+    Target that evaluates a list of AbstractAugustusClassifier subclasses (including AbstractAugustusAttribute
+    subclasses) over one shared join. The remaining arguments are the arguments each classifier is constructed with.
+    """
+    def __init__(self, classifiers, *args):
+        AbstractAugustusClassifier.__init__(self, *args)
+        self.classifierClasses = classifiers
+        self.classifierArgs = args
+
+    def run(self):
+        self.getAugustusPairs()
+        classifiers = [c(*self.classifierArgs) for c in self.classifierClasses]
+        for classifier in classifiers:
+            classifier.initializeValueDicts()
+        for pair in self.augustusPairs:
+            for classifier in classifiers:
+                classifier.addPair(pair)
+        for classifier in classifiers:
+            classifier.dumpResults()
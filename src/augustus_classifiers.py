@@ -1,8 +1,10 @@
-import re
-from collections import defaultdict, Counter
-import lib.sequence_lib as seq_lib
-import lib.psl_lib as psl_lib
-from src.abstractClassifier import AbstractAugustusClassifier
+"""
+Classifiers comparing each Augustus transcript to the transMap transcript it was predicted from. Each classifier
+classifies one comp_ann_lib.AugustusPair at a time in classifyPair, so that all of them can be evaluated in a single
+pass over the pairs by src.augustus_classifier_pass.AugustusClassifierPass.
+"""
+import lib.seq_lib as seq_lib
+from src.abstract_classifier import AbstractAugustusClassifier
 
 
 class AugustusNotSameStrand(AbstractAugustusClassifier):
@@ -13,46 +15,28 @@ class AugustusNotSameStrand(AbstractAugustusClassifier):
     def rgb(self):
         return self.colors["alignment"]
 
-    def run(self):
-        self.getAugustusTranscriptDict()
-        self.getTranscriptDict()
-        classify_dict = {}
-        details_dict = defaultdict(list)
-        for aug_aId, aug_t in self.augustusTranscriptDict.iteritems():
-            if psl_lib.remove_augustus_alignment_number(aug_aId) not in self.transcriptDict:
-                continue
-            t = self.transcriptDict[psl_lib.remove_augustus_alignment_number(aug_aId)]
-            if aug_t.strand != t.strand or aug_t.chromosome != t.chromosome:
-                classify_dict[aug_aId] = 1
-                details_dict[aug_aId] = seq_lib.transcript_to_bed(aug_t, self.rgb, self.column)
-            else:
-                classify_dict[aug_aId] = 0
-        self.dumpValueDicts(classify_dict, details_dict)
+    def classifyPair(self, pair):
+        if pair.t is None:
+            return None
+        if not pair.same_locus:
+            return 1, seq_lib.transcript_to_bed(pair.aug_t, self.rgb, self.column)
+        return 0, None
 
 
 class AugustusParalogy(AbstractAugustusClassifier):
     """
-    Does this transcript appear more than once in the augustus transcript dict?
+    Does this transcript appear more than once in the augustus transcript dict? Copies are counted per Augustus mode
+    and transMap alignment, so augI1-1-ID-1 and augI1-2-ID-1 are two copies of alignment ID-1.
     """
     @property
     def rgb(self):
         return self.colors["alignment"]
 
-    def run(self):
-        r = re.compile("-[0-9]+-")
-        self.getAugustusTranscriptDict()
-        counts = Counter("-".join(r.split(aug_aId)) for aug_aId in self.augustusTranscriptDict)
-        details_dict = {}
-        classify_dict = {}
-        for aug_aId, aug_t in self.augustusTranscriptDict.iteritems():
-            if counts[psl_lib.remove_augustus_alignment_number(aug_aId)] > 1:
-                details_dict[aug_aId] = seq_lib.transcript_to_bed(aug_t, self.rgb, self.column + "_{}_Copies".format(
-                                                               counts[psl_lib.remove_augustus_alignment_number(aug_aId)]
-                                                               - 1))
-                classify_dict[aug_aId] = 1
-            else:
-                classify_dict[aug_aId] = 0
-        self.dumpValueDicts(classify_dict, details_dict)
+    def classifyPair(self, pair):
+        if pair.copies > 1:
+            name = self.column + "_{}_Copies".format(pair.copies - 1)
+            return 1, seq_lib.transcript_to_bed(pair.aug_t, self.rgb, name)
+        return 0, None
 
 
 class AugustusExonGain(AbstractAugustusClassifier):
@@ -65,26 +49,13 @@ class AugustusExonGain(AbstractAugustusClassifier):
     def rgb(self):
         return self.colors["alignment"]
 
-    def run(self, shortIntronSize=30):
-        self.getAugustusTranscriptDict()
-        self.getTranscriptDict()
-        classify_dict = {}
-        details_dict = defaultdict(list)
-        for aug_aId, aug_t in self.augustusTranscriptDict.iteritems():
-            if psl_lib.remove_augustus_alignment_number(aug_aId) not in self.transcriptDict:
-                continue
-            t = self.transcriptDict[psl_lib.remove_augustus_alignment_number(aug_aId)]
-            if aug_t.strand != t.strand or aug_t.chromosome != t.chromosome:
-                continue
-            aug_t_intervals = aug_t.exonIntervals
-            merged_t_intervals = seq_lib.gap_merge_intervals(t.exonIntervals, gap=shortIntronSize)
-            for interval in aug_t_intervals:
-                if seq_lib.interval_not_intersect_intervals(merged_t_intervals, interval):
-                    classify_dict[aug_aId] = 1
-                    details_dict[aug_aId].append(interval.get_bed(self.rgb, "/".join([self.column, aug_aId])))
-            if aug_aId not in classify_dict:
-                classify_dict[aug_aId] = 0
-        self.dumpValueDicts(classify_dict, details_dict)
+    def classifyPair(self, pair, shortIntronSize=30):
+        if not pair.same_locus:
+            return None
+        merged_t_intervals = seq_lib.gap_merge_intervals(pair.t.exon_intervals, gap=shortIntronSize)
+        details = [interval.get_bed(self.rgb, "/".join([self.column, pair.aug_aId])) for interval in
+                   seq_lib.intervals_not_intersecting(pair.aug_t.exon_intervals, merged_t_intervals)]
+        return (1, details) if details else (0, None)
 
 
 class AugustusExonLoss(AbstractAugustusClassifier):
@@ -96,26 +67,13 @@ class AugustusExonLoss(AbstractAugustusClassifier):
     def rgb(self):
         return self.colors["alignment"]
 
-    def run(self, shortIntronSize=30):
-        self.getAugustusTranscriptDict()
-        self.getTranscriptDict()
-        classify_dict = {}
-        details_dict = defaultdict(list)
-        for aug_aId, aug_t in self.augustusTranscriptDict.iteritems():
-            if psl_lib.remove_augustus_alignment_number(aug_aId) not in self.transcriptDict:
-                continue
-            t = self.transcriptDict[psl_lib.remove_augustus_alignment_number(aug_aId)]
-            if aug_t.strand != t.strand or aug_t.chromosome != t.chromosome:
-                continue
-            aug_t_intervals = aug_t.exonIntervals
-            merged_t_intervals = seq_lib.gap_merge_intervals(t.exonIntervals, gap=shortIntronSize)
-            for interval in merged_t_intervals:
-                if seq_lib.interval_not_intersect_intervals(aug_t_intervals, interval):
-                    classify_dict[aug_aId] = 1
-                    details_dict[aug_aId].append(interval.get_bed(self.rgb, "/".join([self.column, aug_aId])))
-            if aug_aId not in classify_dict:
-                classify_dict[aug_aId] = 0
-        self.dumpValueDicts(classify_dict, details_dict)
+    def classifyPair(self, pair, shortIntronSize=30):
+        if not pair.same_locus:
+            return None
+        merged_t_intervals = seq_lib.gap_merge_intervals(pair.t.exon_intervals, gap=shortIntronSize)
+        details = [interval.get_bed(self.rgb, "/".join([self.column, pair.aug_aId])) for interval in
+                   seq_lib.intervals_not_intersecting(merged_t_intervals, pair.aug_t.exon_intervals)]
+        return (1, details) if details else (0, None)
 
 
 class AugustusNotSimilarInternalExonBoundaries(AbstractAugustusClassifier):
@@ -127,27 +85,15 @@ class AugustusNotSimilarInternalExonBoundaries(AbstractAugustusClassifier):
     def rgb(self):
         return self.colors["alignment"]
 
-    def run(self, shortIntronSize=30, wiggleRoom=30):
-        self.getAugustusTranscriptDict()
-        self.getTranscriptDict()
-        classify_dict = {}
-        details_dict = defaultdict(list)
-        for aug_aId, aug_t in self.augustusTranscriptDict.iteritems():
-            if psl_lib.remove_augustus_alignment_number(aug_aId) not in self.transcriptDict:
-                continue
-            t = self.transcriptDict[psl_lib.remove_augustus_alignment_number(aug_aId)]
-            if aug_t.strand != t.strand or aug_t.chromosome != t.chromosome:
-                continue
-            merged_t_intervals = seq_lib.gap_merge_intervals(t.exonIntervals, gap=shortIntronSize)
-            merged_t_intervals = merged_t_intervals[1:-1]
-            aug_t_intervals = aug_t.exonIntervals[1:-1]
-            for interval in merged_t_intervals:
-                if seq_lib.interval_not_within_wiggle_room_intervals(aug_t_intervals, interval, wiggleRoom):
-                    classify_dict[aug_aId] = 1
-                    details_dict[aug_aId].append(interval.get_bed(self.rgb, "/".join([self.column, aug_aId])))
-            if aug_aId not in classify_dict:
-                classify_dict[aug_aId] = 0
-        self.dumpValueDicts(classify_dict, details_dict)
+    def classifyPair(self, pair, shortIntronSize=30, wiggleRoom=30):
+        if not pair.same_locus:
+            return None
+        merged_t_intervals = seq_lib.gap_merge_intervals(pair.t.exon_intervals, gap=shortIntronSize)
+        merged_t_intervals = merged_t_intervals[1:-1]
+        aug_t_intervals = pair.aug_t.exon_intervals[1:-1]
+        details = [interval.get_bed(self.rgb, "/".join([self.column, pair.aug_aId])) for interval in
+                   seq_lib.intervals_not_within_wiggle_room(merged_t_intervals, aug_t_intervals, wiggleRoom)]
+        return (1, details) if details else (0, None)
 
 
 class AugustusNotSimilarTerminalExonBoundaries(AbstractAugustusClassifier):
@@ -158,27 +104,15 @@ class AugustusNotSimilarTerminalExonBoundaries(AbstractAugustusClassifier):
     def rgb(self):
         return self.colors["alignment"]
 
-    def run(self, shortIntronSize=100, wiggleRoom=200):
-        self.getAugustusTranscriptDict()
-        self.getTranscriptDict()
-        classify_dict = {}
-        details_dict = defaultdict(list)
-        for aug_aId, aug_t in self.augustusTranscriptDict.iteritems():
-            if psl_lib.remove_augustus_alignment_number(aug_aId) not in self.transcriptDict:
-                continue
-            t = self.transcriptDict[psl_lib.remove_augustus_alignment_number(aug_aId)]
-            if aug_t.strand != t.strand or aug_t.chromosome != t.chromosome:
-                continue
-            merged_t_intervals = seq_lib.gap_merge_intervals(t.exonIntervals, gap=shortIntronSize)
-            merged_t_intervals = [merged_t_intervals[0], merged_t_intervals[-1]]
-            aug_t_intervals = [aug_t.exonIntervals[0], aug_t.exonIntervals[-1]]
-            for interval in merged_t_intervals:
-                if seq_lib.interval_not_within_wiggle_room_intervals(aug_t_intervals, interval, wiggleRoom):
-                    classify_dict[aug_aId] = 1
-                    details_dict[aug_aId].append(interval.get_bed(self.rgb, "/".join([self.column, aug_aId])))
-            if aug_aId not in classify_dict:
-                classify_dict[aug_aId] = 0
-        self.dumpValueDicts(classify_dict, details_dict)
+    def classifyPair(self, pair, shortIntronSize=100, wiggleRoom=200):
+        if not pair.same_locus:
+            return None
+        merged_t_intervals = seq_lib.gap_merge_intervals(pair.t.exon_intervals, gap=shortIntronSize)
+        merged_t_intervals = [merged_t_intervals[0], merged_t_intervals[-1]]
+        aug_t_intervals = [pair.aug_t.exon_intervals[0], pair.aug_t.exon_intervals[-1]]
+        details = [interval.get_bed(self.rgb, "/".join([self.column, pair.aug_aId])) for interval in
+                   seq_lib.intervals_not_within_wiggle_room(merged_t_intervals, aug_t_intervals, wiggleRoom)]
+        return (1, details) if details else (0, None)
 
 
 class AugustusNotSameStartStop(AbstractAugustusClassifier):
@@ -189,25 +123,16 @@ class AugustusNotSameStartStop(AbstractAugustusClassifier):
     def rgb(self):
         return self.colors["alignment"]
 
-    def run(self):
-        self.getAugustusTranscriptDict()
-        self.getTranscriptDict()
-        classify_dict = {}
-        details_dict = {}
-        for aug_aId, aug_t in self.augustusTranscriptDict.iteritems():
-            if psl_lib.remove_augustus_alignment_number(aug_aId) not in self.transcriptDict:
-                continue
-            t = self.transcriptDict[psl_lib.remove_augustus_alignment_number(aug_aId)]
-            if aug_t.strand != t.strand or aug_t.chromosome != t.chromosome or t.thickStart == t.thickStop:
-                continue
-            if t.thickStart != aug_t.thickStart or t.thickStop != aug_t.thickStop:
-                classify_dict[aug_aId] = 1
-                s = aug_t.getCdsLength()
-                if s > 9:
-                    details_dict[aug_aId] = [seq_lib.cds_coordinate_to_bed(aug_t, 0, 3, self.rgb, self.column),
-                                            seq_lib.cds_coordinate_to_bed(aug_t, s - 3, s, self.rgb, self.column)]
-                else:
-                    details_dict[aug_aId] = seq_lib.cds_coordinate_to_bed(aug_t, 0, s, self.rgb, self.column)
+    def classifyPair(self, pair):
+        aug_t, t = pair.aug_t, pair.t
+        if not pair.same_locus or t.thick_start == t.thick_stop:
+            return None
+        if t.thick_start != aug_t.thick_start or t.thick_stop != aug_t.thick_stop:
+            s = aug_t.get_cds_length()
+            if s > 9:
+                details = [seq_lib.cds_coordinate_to_bed(aug_t, 0, 3, self.rgb, self.column),
+                           seq_lib.cds_coordinate_to_bed(aug_t, s - 3, s, self.rgb, self.column)]
             else:
-                classify_dict[aug_aId] = 0
-        self.dumpValueDicts(classify_dict, details_dict)
+                details = seq_lib.cds_coordinate_to_bed(aug_t, 0, s, self.rgb, self.column)
+            return 1, details
+        return 0, None
@@ -4,7 +4,8 @@ import sqlite3 as sql
 from collections import defaultdict
 
 import src.augustusQueries
-import lib.sqlite_lib as sql_lib
+import lib.sql_lib as sql_lib
+import lib.category_lib as category_lib
 import lib.psl_lib as psl_lib
 import lib.sequence_lib as seq_lib
 from lib.general_lib import functions_in_module
@@ -40,7 +41,7 @@ class BuildAugustusTracks(Target):
         bedPath = os.path.join(self.bedDir, categoryName, genome, genome + ".bed")
         with open(bedPath, "w") as outf:
             for details in detailsFields:
-                for record in sql_lib.selectBetweenDatabases(self.cur, "details", details, classifyFields, classifyValues, classifyOperations, self.primaryKeyColumn, genome):
+                for record in sql_lib.select_between_databases(self.cur, "details", details, classifyFields, classifyValues, classifyOperations, self.primaryKeyColumn, genome):
                     if record[0] == None:
                         continue
                     elif type(record[0]) == type(u''):
@@ -63,8 +64,9 @@ class BuildAugustusTracks(Target):
         # first we recolor everything black
         for x in records:
             x.rgb = "0"
-        detailsFields, classifyFields, classifyValues, classifyOperations = src.augustusQueries.augustusNotOk()
-        aIds = {x[0] for x in sql_lib.selectBetweenDatabases(self.cur, "details", self.primaryKeyColumn, classifyFields, classifyValues, classifyOperations, self.primaryKeyColumn, genome)}
+        categories = category_lib.compile_categories([src.augustusQueries.augustusNotOk])
+        aIds = category_lib.categorize(category_lib.load_classify_matrix(self.cur, genome, categories),
+                                       categories)["augustusNotOk"]
         for x in records:
             if x.name in aIds:
                 x.rgb = "83,179,64"
@@ -4,7 +4,8 @@ import sqlite3 as sql
 from collections import defaultdict
 
 import src.queries
-import lib.sqlite_lib as sql_lib
+import lib.sql_lib as sql_lib
+import lib.category_lib as category_lib
 import lib.psl_lib as psl_lib
 import lib.sequence_lib as seq_lib
 from lib.general_lib import functions_in_module
@@ -41,7 +42,7 @@ class BuildTracks(Target):
         bedPath = os.path.join(self.bedDir, categoryName, genome, genome + ".bed")
         with open(bedPath, "w") as outf:
             for details in detailsFields:
-                for record in sql_lib.selectBetweenDatabases(self.cur, "details", details, classifyFields, classifyValues, classifyOperations, self.primaryKeyColumn, genome):
+                for record in sql_lib.select_between_databases(self.cur, "details", details, classifyFields, classifyValues, classifyOperations, self.primaryKeyColumn, genome):
                     if record[0] == None:
                         continue
                     elif type(record[0]) == type(u''):
@@ -65,24 +66,19 @@ class BuildTracks(Target):
         # first we recolor everything black
         for x in records:
             x.rgb = "0"
-        # now we find all interesting biology and color that the interesting biology color
-        detailsFields, classifyFields, classifyValues, classifyOperations = src.queries.interestingBiology()
-        aIds = {x[0] for x in sql_lib.selectBetweenDatabases(self.cur, "details", self.primaryKeyColumn, classifyFields, classifyValues, classifyOperations, self.primaryKeyColumn, genome)}
-        for x in records:
-            if x.name in aIds:
-                x.rgb = self.colors["mutation"]
-        # now the alignment errors...
-        detailsFields, classifyFields, classifyValues, classifyOperations = src.queries.alignmentErrors()
-        aIds = {x[0] for x in sql_lib.selectBetweenDatabases(self.cur, "details", self.primaryKeyColumn, classifyFields, classifyValues, classifyOperations, self.primaryKeyColumn, genome)}
-        for x in records:
-            if x.name in aIds:
-                x.rgb = self.colors["alignment"]
-        # finally the assembly
-        detailsFields, classifyFields, classifyValues, classifyOperations = src.queries.assemblyErrors()
-        aIds = {x[0] for x in sql_lib.selectBetweenDatabases(self.cur, "details", self.primaryKeyColumn, classifyFields, classifyValues, classifyOperations, self.primaryKeyColumn, genome)}
-        for x in records:
-            if x.name in aIds:
-                x.rgb = self.colors["assembly"]
+        # evaluate all three categories in one pass over the classify table
+        categories = category_lib.compile_categories([src.queries.interestingBiology, src.queries.alignmentErrors,
+                                                      src.queries.assemblyErrors])
+        categorized = category_lib.categorize(category_lib.load_classify_matrix(self.cur, genome, categories),
+                                              categories)
+        # now we find all interesting biology and color that the interesting biology color, then the alignment errors
+        # and finally the assembly errors
+        for category, color in [["interestingBiology", "mutation"], ["alignmentErrors", "alignment"],
+                                ["assemblyErrors", "assembly"]]:
+            aIds = categorized[category]
+            for x in records:
+                if x.name in aIds:
+                    x.rgb = self.colors[color]
         return ["\t".join(map(str, x.get_bed())) for x in records]
 
     def run(self):
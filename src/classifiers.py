@@ -6,8 +6,8 @@ import lib.sequence_lib as seq_lib
 import lib.psl_lib as psl_lib
 
 from src.abstractClassifier import AbstractClassifier
-from src.helperFunctions import deletionIterator, insertionIterator, frameShiftIterator, codonPairIterator, \
-    compareIntronToReference
+from src.helperFunctions import deletionIterator, insertionIterator, frameShiftIterator
+from lib.comp_ann_lib import compare_intron_to_reference, codon_pair_iterator
 
 
 class AlignmentAbutsLeft(AbstractClassifier):
@@ -97,7 +97,7 @@ class AlignmentAbutsUnknownBases(AbstractClassifier):
                     intervals.append([intron.start, intron.start + distance])
             intervals.append([t.exonIntervals[-1].stop, t.exonIntervals[-1].stop + distance])
             for start, stop in intervals:
-                seq = self.seqDict[t.chromosome][start:stop].upper()
+                seq = seq_lib.normalize_sequence(self.seqDict[t.chromosome][start:stop])
                 if "N" in seq:
                     classifyDict[aId] = 1
                     detailsDict[aId].append(t.get_bed(self.rgb, self.column))
@@ -419,14 +419,15 @@ class BeginStart(AbstractClassifier):
         self.getAlignmentDict()
         self.getAnnotationDict()
         self.getSeqDict()
-        self.getRefDict()
+        self.getReferenceAnnotationDict()
         detailsDict = {}
         classifyDict = {}
         for aId, t in self.transcriptDict.iteritems():
             a = self.annotationDict[psl_lib.remove_alignment_number(aId)]
+            ref_annotation = self.referenceAnnotationDict[a.name]
             aln = self.alignmentDict[aId]
             # do not include noncoding transcripts or lift-overs that contain less than 25 codons
-            if a.getCdsLength() <= 75 or t.getCdsLength() <= 75:
+            if ref_annotation.cds_length <= 75 or t.getCdsLength() <= 75:
                 continue
             cds_positions = [t.chromosome_coordinate_to_cds(aln.query_coordinate_to_target(a.cds_coordinate_to_transcript(i)))
                              for i in xrange(3)]
@@ -434,7 +435,7 @@ class BeginStart(AbstractClassifier):
                 detailsDict[aId] = seq_lib.cds_coordinate_to_bed(t, 0, 3, self.rgb, self.column)
                 classifyDict[aId] = 1
             elif t.get_cds(self.seqDict)[:3] != "ATG":
-                if a.get_cds(self.refDict)[:3] != "ATG":
+                if ref_annotation.start_codon != "ATG":
                     detailsDict[aId] = seq_lib.cds_coordinate_to_bed(t, 0, 3, self.colors["input"], self.column)
                 else:
                     detailsDict[aId] = seq_lib.cds_coordinate_to_bed(t, 0, 3, self.rgb, self.column)
@@ -585,7 +586,7 @@ class CdsNonCanonSplice(AbstractClassifier):
     def run(self, shortIntronSize=30):
         self.getTranscriptDict()
         self.getSeqDict()
-        self.getRefDict()
+        self.getReferenceAnnotationDict()
         self.getAnnotationDict()
         self.getAlignmentDict()
         detailsDict = defaultdict(list)
@@ -603,7 +604,8 @@ class CdsNonCanonSplice(AbstractClassifier):
                 if donor not in self.canonical or self.canonical[donor] != acceptor:
                     classifyDict[aId] = 1
                     # is this a intron that exists in the reference that also has this problem?
-                    if compareIntronToReference(intron, a, aln, self.canonical, self.refDict) is True:
+                    ref_annotation = self.referenceAnnotationDict[a.name]
+                    if compare_intron_to_reference(intron, a, aln, self.canonical, ref_annotation) is True:
                         detailsDict[aId].append(seq_lib.splice_intron_interval_to_bed(t, intron, self.colors["input"],
                                                                                   self.column))
                     else:
@@ -630,7 +632,7 @@ class CdsUnknownSplice(AbstractClassifier):
     def run(self, shortIntronSize=30):
         self.getTranscriptDict()
         self.getSeqDict()
-        self.getRefDict()
+        self.getReferenceAnnotationDict()
         self.getAnnotationDict()
         self.getAlignmentDict()
         detailsDict = defaultdict(list)
@@ -648,7 +650,8 @@ class CdsUnknownSplice(AbstractClassifier):
                 if donor not in self.non_canonical or self.non_canonical[donor] != acceptor:
                     classifyDict[aId] = 1
                     # is this a intron that exists in the reference that also has this problem?
-                    if compareIntronToReference(intron, a, aln, self.non_canonical, self.refDict) is True:
+                    ref_annotation = self.referenceAnnotationDict[a.name]
+                    if compare_intron_to_reference(intron, a, aln, self.non_canonical, ref_annotation) is True:
                         detailsDict[aId].append(seq_lib.splice_intron_interval_to_bed(t, intron, self.colors["input"],
                                                                                   self.column))
                     else:
@@ -675,7 +678,7 @@ class UtrNonCanonSplice(AbstractClassifier):
     def run(self, shortIntronSize=30):
         self.getTranscriptDict()
         self.getSeqDict()
-        self.getRefDict()
+        self.getReferenceAnnotationDict()
         self.getAnnotationDict()
         self.getAlignmentDict()
         detailsDict = defaultdict(list)
@@ -693,7 +696,8 @@ class UtrNonCanonSplice(AbstractClassifier):
                 if donor not in self.canonical or self.canonical[donor] != acceptor:
                     classifyDict[aId] = 1
                     # is this a intron that exists in the reference that also has this problem?
-                    if compareIntronToReference(intron, a, aln, self.canonical, self.refDict) is True:
+                    ref_annotation = self.referenceAnnotationDict[a.name]
+                    if compare_intron_to_reference(intron, a, aln, self.canonical, ref_annotation) is True:
                         detailsDict[aId].append(seq_lib.splice_intron_interval_to_bed(t, intron, self.colors["input"],
                                                                                   self.column))
                     else:
@@ -722,7 +726,7 @@ class UtrUnknownSplice(AbstractClassifier):
         self.getSeqDict()
         self.getAlignmentDict()
         self.getAnnotationDict()
-        self.getRefDict()
+        self.getReferenceAnnotationDict()
         detailsDict = defaultdict(list)
         classifyDict = {}
         for aId, t in self.transcriptDict.iteritems():
@@ -738,7 +742,8 @@ class UtrUnknownSplice(AbstractClassifier):
                 if donor not in self.non_canonical or self.non_canonical[donor] != acceptor:
                     classifyDict[aId] = 1
                     # is this a intron that exists in the reference that also has this problem?
-                    if compareIntronToReference(intron, a, aln, self.non_canonical, self.refDict) is True:
+                    ref_annotation = self.referenceAnnotationDict[a.name]
+                    if compare_intron_to_reference(intron, a, aln, self.non_canonical, ref_annotation) is True:
                         detailsDict[aId].append(seq_lib.splice_intron_interval_to_bed(t, intron, self.colors["input"],
                                                                                   self.column))
                     else:
@@ -769,20 +774,21 @@ class EndStop(AbstractClassifier):
         self.getTranscriptDict()
         self.getAnnotationDict()
         self.getSeqDict()
-        self.getRefDict()
+        self.getReferenceAnnotationDict()
         detailsDict = {}
         classifyDict = {}
         for aId, t in self.transcriptDict.iteritems():
             a = self.annotationDict[psl_lib.remove_alignment_number(aId)]
+            ref_annotation = self.referenceAnnotationDict[a.name]
             aln = self.alignmentDict[aId]
-            if a.getCdsLength() <= 75 or t.getCdsLength() <= 75:
+            if ref_annotation.cds_length <= 75 or t.getCdsLength() <= 75:
                 continue
             s = t.getCdsLength()
             cds_positions = [t.chromosome_coordinate_to_cds(aln.query_coordinate_to_target(a.cds_coordinate_to_transcript(i)))
                              for i in xrange(s - 4, s - 1)]
             if None in cds_positions or t.get_cds(self.seqDict)[-3:] not in stopCodons:
                 # does this problem exist in the reference?
-                if a.get_cds(self.refDict)[-3:] not in stopCodons:
+                if ref_annotation.stop_codon not in stopCodons:
                     detailsDict[aId] = seq_lib.cds_coordinate_to_bed(t, s - 3, s, self.colors["input"], self.column)
                 else:
                     detailsDict[aId] = seq_lib.cds_coordinate_to_bed(t, s - 3, s, self.rgb, self.column)
@@ -808,18 +814,19 @@ class InFrameStop(AbstractClassifier):
         self.getTranscriptDict()
         self.getAnnotationDict()
         self.getSeqDict()
-        self.getRefDict()
+        self.getReferenceAnnotationDict()
         self.getAlignmentDict()
         detailsDict = defaultdict(list)
         classifyDict = {}
         for aId, t in self.transcriptDict.iteritems():
             a = self.annotationDict[psl_lib.remove_alignment_number(aId)]
+            ref_annotation = self.referenceAnnotationDict[a.name]
             aln = self.alignmentDict[aId]
-            if a.getCdsLength() <= 75 or t.getCdsLength() <= 75:
+            if ref_annotation.cds_length <= 75 or t.getCdsLength() <= 75:
                 continue
             # TODO: this will miss an inframe stop if it is the last 3 bases that are not the annotated stop.
             # use the logic from EndStop to flag this
-            codons = list(codonPairIterator(a, t, aln, self.seqDict, self.refDict))[:-1]
+            codons = list(codon_pair_iterator(a, t, aln, self.seqDict, ref_annotation.cds))[:-1]
             for i, target_codon, query_codon in codons:
                 if seq_lib.codon_to_amino_acid(target_codon) == "*":
                     if target_codon == query_codon:
@@ -848,15 +855,15 @@ class ShortCds(AbstractClassifier):
 
     def run(self, cdsCutoff=75):
         self.getTranscriptDict()
-        self.getAnnotationDict()
+        self.getReferenceAnnotationDict()
         detailsDict = {}
         classifyDict = {}
         for aId, t in self.transcriptDict.iteritems():
             # do not include noncoding transcripts
-            a = self.annotationDict[psl_lib.remove_alignment_number(aId)]
-            if a.getCdsLength() < 3:
+            ref_annotation = self.referenceAnnotationDict[psl_lib.remove_alignment_number(aId)]
+            if ref_annotation.cds_length < 3:
                 continue
-            elif a.getCdsLength() <= cdsCutoff:
+            elif ref_annotation.cds_length <= cdsCutoff:
                 detailsDict[aId] = seq_lib.transcript_to_bed(t, self.colors["input"], self.column)
                 classifyDict[aId] = 1
             elif t.getCdsLength() <= cdsCutoff:
@@ -940,7 +947,7 @@ class Nonsynonymous(AbstractClassifier):
         self.getTranscriptDict()
         self.getAnnotationDict()
         self.getSeqDict()
-        self.getRefDict()
+        self.getReferenceAnnotationDict()
         self.getAlignmentDict()
         detailsDict = defaultdict(list)
         classifyDict = {}
@@ -949,9 +956,11 @@ class Nonsynonymous(AbstractClassifier):
                 continue
             t = self.transcriptDict[aId]
             a = self.annotationDict[psl_lib.remove_alignment_number(aId)]
-            if a.getCdsLength() <= 75 or t.getCdsLength() <= 75:
+            ref_annotation = self.referenceAnnotationDict[a.name]
+            if ref_annotation.cds_length <= 75 or t.getCdsLength() <= 75:
                 continue
-            for i, target_codon, query_codon in codonPairIterator(a, t, aln, self.seqDict, self.refDict):
+            ref_cds = ref_annotation.cds
+            for i, target_codon, query_codon in codon_pair_iterator(a, t, aln, self.seqDict, ref_cds):
                 if "N" not in target_codon and target_codon != query_codon and seq_lib.codon_to_amino_acid(target_codon)\
                         != seq_lib.codon_to_amino_acid(query_codon):
                     detailsDict[aId].append(seq_lib.cds_coordinate_to_bed(t, i, i + 3, self.rgb, self.column))
@@ -974,7 +983,7 @@ class Synonymous(AbstractClassifier):
         self.getTranscriptDict()
         self.getAnnotationDict()
         self.getSeqDict()
-        self.getRefDict()
+        self.getReferenceAnnotationDict()
         self.getAlignmentDict()
         detailsDict = defaultdict(list)
         classifyDict = {}
@@ -983,9 +992,11 @@ class Synonymous(AbstractClassifier):
                 continue
             t = self.transcriptDict[aId]
             a = self.annotationDict[psl_lib.remove_alignment_number(aId)]
-            if a.getCdsLength() <= 75 or t.getCdsLength() <= 75:
+            ref_annotation = self.referenceAnnotationDict[a.name]
+            if ref_annotation.cds_length <= 75 or t.getCdsLength() <= 75:
                 continue
-            for i, target_codon, query_codon in codonPairIterator(a, t, aln, self.seqDict, self.refDict):
+            ref_cds = ref_annotation.cds
+            for i, target_codon, query_codon in codon_pair_iterator(a, t, aln, self.seqDict, ref_cds):
                 if target_codon != query_codon and seq_lib.codon_to_amino_acid(target_codon) == \
                         seq_lib.codon_to_amino_acid(query_codon):
                     detailsDict[aId].append(seq_lib.cds_coordinate_to_bed(t, i, i + 3, self.rgb, self.column))
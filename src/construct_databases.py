@@ -1,11 +1,12 @@
 import os
-from itertools import izip_longest, product, izip
+from itertools import product, izip
 import cPickle as pickle
 
 import src.classifiers
 import src.attributes
-import src.augustusClassifiers
-import lib.sqlite_lib as sql_lib
+import src.augustus_classifiers
+import src.augustus_attributes
+import lib.sql_lib as sql_lib
 import lib.psl_lib as psl_lib
 from jobTree.scriptTree.target import Target
 from lib.general_lib import classes_in_module
@@ -37,6 +38,10 @@ class ConstructDatabases(Target):
         for attribute, genome in product(attributes, self.genomes):
             attributeDict = pickle.load(open(os.path.join(self.tmpDir, genome, "Attribute" + attribute.__name__ + genome), "rb"))
             self.simpleUpdateWrapper(attributeDict, attributesDb, genome, attribute.__name__)
+        # only the genomes in this run are rebuilt, so tables for previously added genomes are kept
+        bestAlignmentsDb = os.path.join(self.outDir, "bestAlignments.db")
+        for genome in self.genomes:
+            sql_lib.write_best_alignments(attributesDb, bestAlignmentsDb, genome)
 
     def invertDict(self, d):
         for a, b in d.iteritems():
@@ -90,7 +95,7 @@ class ConstructDatabases(Target):
 
     def initializeSqlRows(self, db, genome, aIds, primaryKey):
         with sql_lib.ExclusiveSqlConnection(db) as cur:
-            sql_lib.insertRows(cur, genome, primaryKey, [primaryKey], izip_longest(aIds, [None]))
+            sql_lib.insertRows(cur, genome, primaryKey, [primaryKey], ((aId,) for aId in aIds))
 
 
 class ConstructAugustusDatabases(ConstructDatabases):
@@ -99,13 +104,12 @@ class ConstructAugustusDatabases(ConstructDatabases):
         self.augustusGps = augustusGps
 
     def run(self):
-        augustusClassifiers = classes_in_module(src.augustusClassifiers)
+        # this runs once per genome; initializeDb drops and recreates only the tables for self.genomes, so the
+        # databases are never deleted and other genomes' tables are kept
+        augustusClassifiers = classes_in_module(src.augustus_classifiers)
+        augustusAttributes = classes_in_module(src.augustus_attributes)
         classifyDb = os.path.join(self.outDir, "augustusClassify.db")
-        if os.path.exists(classifyDb):
-            os.remove(classifyDb)
         detailsDb = os.path.join(self.outDir, "augustusDetails.db")
-        if os.path.exists(detailsDb):
-            os.remove(detailsDb)
         self.initializeDb(classifyDb, augustusClassifiers, dataType="INTEGER")
         self.initializeDb(detailsDb, augustusClassifiers, dataType="TEXT")
         for classifier, genome in product(augustusClassifiers, self.genomes):
@@ -113,6 +117,11 @@ class ConstructAugustusDatabases(ConstructDatabases):
             self.simpleUpdateWrapper(classifyDict, classifyDb, genome, classifier.__name__)
             detailsDict = pickle.load(open(os.path.join(self.tmpDir, genome, "Details" + classifier.__name__ + genome), "rb"))
             self.simpleBedUpdateWrapper(detailsDict, detailsDb, genome, classifier.__name__)
+        attributesDb = os.path.join(self.outDir, "augustusAttributes.db")
+        self.initializeDb(attributesDb, augustusAttributes)
+        for attribute, genome in product(augustusAttributes, self.genomes):
+            attributeDict = pickle.load(open(os.path.join(self.tmpDir, genome, "Attribute" + attribute.__name__ + genome), "rb"))
+            self.simpleUpdateWrapper(attributeDict, attributesDb, genome, attribute.__name__)
 
     def initializeDb(self, dbPath, classifiers, dataType=None):
         if dataType is None: